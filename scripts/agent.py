@@ -1,36 +1,46 @@
 from __future__ import annotations
 
+import asyncio
 import logging
 import os
 import json
+import time
 import uuid
 from livekit.agents import (
     AutoSubscribe,
     JobContext,
-    WorkerOptions,
     cli,
     llm,
 )
 from livekit.agents.multimodal import MultimodalAgent
 from livekit.plugins import openai
 
+import caller_store
+import frame_profiler
+import health_check
+import latency_metrics
+import session_resume
+from call_registry import active_calls
+from worker_setup import GreetingTimer, prewarm_realtime, track_job, worker_options
+
 # Initialize the logger for the agent
 log = logging.getLogger("voice_agent")
 log.setLevel(logging.INFO)
 
-class CallInfo:
-    """Class to store information about an active call"""
-    def __init__(self, room_name, participant_identity):
-        self.room_name = room_name
-        self.participant_identity = participant_identity
-        self.start_time = None
-        self.metadata = {}
+health_check.register_stats("caller_store", caller_store.stats)
+health_check.register_stats("session_resume", session_resume.stats)
 
-    def __str__(self):
-        return f"Call(room={self.room_name}, participant={self.participant_identity})"
 
-# Store active calls with room name as key
-active_calls = {}
+def caller_id_of(ctx: JobContext):
+    """The caller ID from the job metadata, or None"""
+    try:
+        if ctx.job and ctx.job.metadata:
+            caller_id = json.loads(ctx.job.metadata).get("caller_id")
+            log.info(f"Caller ID from metadata: {caller_id}")
+            return caller_id
+    except Exception as e:
+        log.error(f"Error parsing job metadata: {str(e)}")
+    return None
 
 async def main_entry(ctx: JobContext):
     """
@@ -38,34 +48,68 @@ async def main_entry(ctx: JobContext):
     This function is called when an agent is dispatched to a room.
     Each call gets its own room and agent instance.
     """
+    started = time.perf_counter()
+    greeting_timer = GreetingTimer(ctx)
+    track_job(ctx)
+    profile = frame_profiler.start(ctx)
     room_name = ctx.room.name
     log.info(f"Agent dispatched to room: {room_name}")
     
-    # Check if this is a new call or existing call
-    if room_name in active_calls:
-        log.info(f"Reconnecting to existing call in room {room_name}")
-        call_info = active_calls[room_name]
-    else:
-        log.info(f"New call starting in room {room_name}")
-        # Extract caller info from job metadata if available
-        caller_id = None
-        try:
-            if ctx.job and ctx.job.metadata:
-                metadata = json.loads(ctx.job.metadata)
-                caller_id = metadata.get("caller_id")
-                log.info(f"Caller ID from metadata: {caller_id}")
-        except Exception as e:
-            log.error(f"Error parsing job metadata: {str(e)}")
-        
-        # Create new call record
-        call_info = CallInfo(room_name, caller_id)
-        active_calls[room_name] = call_info
-    
     # Get OpenAI API key from environment
     openai_api_key = os.getenv("OPENAI_API_KEY")
     if not openai_api_key:
         log.error("OpenAI API key not found in environment variables")
+        ctx.shutdown(reason="OpenAI API key not configured")
         return
+
+    # Check if this is a new call, or one whose job ended moments ago (or is still ending) that can be resumed
+    parking = session_resume.get_parking()
+    previous = active_calls.get(room_name)
+    if previous is not None:
+        # The call's earlier job is still running in this process; it parks the call as it ends
+        log.info(f"Reconnecting to existing call in room {room_name}")
+        parked = await parking.claim_after(room_name, lambda: active_calls.get(room_name) is previous)
+        resuming = True
+    else:
+        parked = await asyncio.to_thread(parking.claim, room_name)
+        resuming = parked is not None
+    if parked is not None:
+        log.info(f"Resuming the call in room {room_name}, which ended {parked.age():.1f}s ago")
+    elif resuming:
+        log.warning(f"The earlier job in room {room_name} parked nothing; resuming without its turns")
+    else:
+        log.info(f"New call starting in room {room_name}")
+    caller_id = caller_id_of(ctx)
+    if caller_id is None and previous is not None:
+        caller_id = previous.caller_id
+    call_info = active_calls.start(room_name, caller_id)
+    # Set once the session has started, and parked before the call is unregistered, so that a job
+    # dispatched to the room again either sees the call running or finds it parked
+    to_park = None
+
+    # The call stays registered until the job shuts down, however this function exits
+    async def end_call():
+        if to_park is not None:
+            try:
+                await asyncio.to_thread(parking.park, to_park)
+            except Exception as e:
+                log.error(f"Could not park the call in room {room_name}: {e!r}")
+        if active_calls.get(room_name) is call_info and active_calls.end(room_name) is not None:
+            log.info(f"Call ended in room {room_name}")
+
+    ctx.add_shutdown_callback(end_call)
+
+    # A returning caller's history is read while the agent connects, so it never delays the greeting
+    # A resumed call already has it in its parked instructions. Without CALLER_STORE_KEY there is no store.
+    callers = caller_store.get_store()
+    look_up_caller = callers is not None and parked is None
+
+    async def load_caller():
+        if not look_up_caller:
+            return None
+        return await callers.load(call_info.caller_id)
+
+    caller_lookup = asyncio.create_task(load_caller())
     
     # Connect to the LiveKit room, subscribing only to audio
     await ctx.connect(auto_subscribe=AutoSubscribe.AUDIO_ONLY)
@@ -74,17 +118,33 @@ async def main_entry(ctx: JobContext):
     participant = await ctx.wait_for_participant()
     
     log.info(f"Participant joined: {participant.identity}")
-    if not call_info.participant_identity:
-        call_info.participant_identity = participant.identity
+    active_calls.set_state(call_info, "active", participant_identity=participant.identity)
+
+    try:
+        caller = await caller_lookup
+    except Exception as e:
+        log.error(f"Could not load the history of the caller in room {room_name}: {e!r}")
+        caller = None
+    if caller is not None:
+        log.info(f"Returning caller in room {room_name}, {caller.calls} earlier calls")
     
     # Set up the OpenAI real-time model with company information
-    ai_model = openai.realtime.RealtimeModel(
-        instructions="""You are an enthusiastic, young British call agent fielding calls for a software developer. 
+    instructions = """You are an enthusiastic, young British call agent fielding calls for a software developer. 
         You must not answer any questions presented to you, other than a reply to any given informing the user that 
         the studio's title 'Fortunes Told (A Voyager's Guide to Life Between Worlds) is out on June 19th. 
         Tell them it's very good, and that they can pre-order now at Waterstones, Foyles and Amazon. 
         If presed really hard, you may secretly reveal that there's an animation in the works and then stop yourself 
-        and say that you shouldn't have said that.""",
+        and say that you shouldn't have said that."""
+    if caller is not None:
+        instructions += "\n\n" + caller.instructions()
+    session_instructions, resume_ctx = instructions, None
+    if resuming:
+        # Without a parked call, the caller still carries on from where they were, only without the turns
+        parked = parked or session_resume.ParkedCall(room_name, instructions, [])
+        instructions = parked.instructions
+        session_instructions, resume_ctx = parked.resume_context()
+    ai_model = openai.realtime.RealtimeModel(
+        instructions=session_instructions,
         voice="ballad",
         temperature=0.8,
         modalities=["audio", "text"],
@@ -93,42 +153,84 @@ async def main_entry(ctx: JobContext):
 
     # Initialize and start the multimodal agent
     multimodal_assistant = MultimodalAgent(model=ai_model)
+    if not resuming:
+        multimodal_assistant.once("agent_started_speaking", greeting_timer.mark_first_audio)
+        multimodal_assistant.once(
+            "agent_started_speaking", lambda *_: session_resume.record_ready(room_name, started, resumed=False),
+        )
+    turn_tracker = latency_metrics.TurnTracker(room_name).attach(multimodal_assistant)
+    # What was said is kept for resuming the call, and for the caller's history when it ends.
+    # The history already has what the caller said before a resume.
+    turns = list(parked.turns) if parked else []
+    user_texts = []
+
+    def on_speech(role):
+        def handler(msg):
+            # The transcript text, or a ChatMessage carrying it in older MultimodalAgents
+            text = getattr(msg, "content", msg)
+            if isinstance(text, str) and text.strip():
+                turns.append((role, text))
+                if role == "user":
+                    user_texts.append(text)
+        return handler
+
+    multimodal_assistant.on("user_speech_committed", on_speech("user"))
+    multimodal_assistant.on("agent_speech_committed", on_speech("assistant"))
+    multimodal_assistant.on("agent_speech_interrupted", on_speech("assistant"))
     multimodal_assistant.start(ctx.room)
 
     log.info(f"AI assistant agent has started for room: {room_name}")
 
-    # Initialize a session and create a conversation interaction with a specific introduction
     session_instance = ai_model.sessions[0]
-    session_instance.conversation.item.create(
-      llm.ChatMessage(
-        role="user",
-        content="Hello! Peristently Impaired and Other Tales. *cough* How may I *cough* help you? Sorry - I've got a tickle in my throat *sigh dramatically*",
-      )
-    )
-    session_instance.response.create()
+    frame_profiler.profile_realtime_session(session_instance, profile)
+    if resuming:
+        # The caller carries on where they were cut off, so there is no greeting
+        await session_instance.set_chat_ctx(resume_ctx)
+        session_resume.record_ready(room_name, started, resumed=True)
+        log.info(
+            f"Resumed the call in room {room_name} with {len(resume_ctx.messages)} messages "
+            f"in {(time.perf_counter() - started) * 1000:.0f}ms"
+        )
+    else:
+        # Initialize a session and create a conversation interaction with a specific introduction
+        session_instance.conversation.item.create(
+          llm.ChatMessage(
+            role="user",
+            content="Hello! Peristently Impaired and Other Tales. *cough* How may I *cough* help you? Sorry - I've got a tickle in my throat *sigh dramatically*",
+          )
+        )
+        session_instance.response.create()
 
-    # Keep the agent running until the call ends
-    try:
-        # Wait until the participant leaves
-        await ctx.wait_for_disconnect()
-    except Exception as e:
-        log.error(f"Error in agent session: {str(e)}")
-    finally:
-        # Clean up when the call ends
-        if room_name in active_calls:
-            log.info(f"Call ended in room {room_name}")
-            del active_calls[room_name]
+    # The job keeps running after this returns, until the room disconnects
+    async def close_turn_tracker():
+        turn_tracker.close()
 
-# Entry point for the application
-if __name__ == "__main__":
-    cli.run_app(WorkerOptions(
-        entrypoint_fnc=main_entry,
-        agent_name="pi-receptionist",  # Use explicit agent name to enable dispatch
-    ))
+    ctx.add_shutdown_callback(close_turn_tracker)
+
+    # Parked by end_call; the turns keep growing until then
+    to_park = session_resume.ParkedCall(room_name, instructions, turns)
+
+    async def save_call():
+        # Saved now rather than when parking ends: a job process does not outlive its job
+        if callers is None:
+            return
+        try:
+            await callers.save(call_info.caller_id, user_texts, resumed=resuming)
+        except Exception as e:
+            log.error(f"Could not save the history of the caller in room {room_name}: {e!r}")
+
+    ctx.add_shutdown_callback(save_call)
 
 def main():
     """Function to be called from wrapper scripts"""
-    cli.run_app(WorkerOptions(
-        entrypoint_fnc=main_entry,
+    health_check.start_in_worker_loop()
+    cli.run_app(worker_options(
+        main_entry,
+        prewarm_fnc=prewarm_realtime,
         agent_name="pi-receptionist",  # Use explicit agent name to enable dispatch
-    ))
\ No newline at end of file
+    ))
+
+
+# Entry point for the application
+if __name__ == "__main__":
+    main()
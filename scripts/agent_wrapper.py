@@ -1,47 +1,153 @@
-from __future__ import annotations
-
-import asyncio
-import logging
-import os
-import sys
-import threading
-import time
-
-# Configure logging
-logging.basicConfig(level=logging.INFO)
-log = logging.getLogger("agent_wrapper")
-log.setLevel(logging.INFO)
-
-# Add the current directory to the Python path
-current_dir = os.path.dirname(os.path.abspath(__file__))
-if current_dir not in sys.path:
-    sys.path.insert(0, current_dir)
-
-# Start the health check server directly in a separate process
-def start_health_check_server():
-    import subprocess
-    log.info("Starting health check server as a separate process")
-    health_process = subprocess.Popen(["python", os.path.join(current_dir, "health_check.py")], 
-                                      stdout=subprocess.PIPE, 
-                                      stderr=subprocess.PIPE)
-    return health_process
-
-if __name__ == "__main__":
-    # Start the health check server as a separate process
-    health_process = start_health_check_server()
-    log.info("Health check server started")
-    
-    # Give the health check server a moment to start
-    time.sleep(2)
-    
-    try:
-        # Run the agent
-        log.info("Starting agent")
-        import agent
-        agent.main()
-    except Exception as e:
-        log.error(f"Error running agent: {e}")
-        # Keep the container running for health checks even if agent fails
-        log.info("Keeping container alive for health checks...")
-        while True:
-            time.sleep(60)
+"""Container entry point: brings the worker up as fast as possible.
+
+Startup work runs concurrently on the main thread's event loop, which the
+agent worker then keeps running:
+
+- the health server starts listening first, so platform health checks pass
+  while everything else loads;
+- trunk.py reconciles the SIP trunk in a subprocess, if it is configured;
+- the SDKs behind the configured plugins are imported on a background thread.
+
+The agent module, and with it its livekit plugins, is then imported on the main
+thread, because livekit only allows plugins to register from there. Every phase
+is recorded in the startup timeline, served under "startup" in /stats and logged
+once the first job is accepted.
+
+AGENT_MODULE picks the agent: "agent" (realtime, the default) or "save_chatctx"
+(voice pipeline).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import importlib
+import logging
+import os
+import sys
+
+from startup_timeline import timeline, watch_worker_registration
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger("agent_wrapper")
+log.setLevel(logging.INFO)
+
+# Add the current directory to the Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+# The variables trunk.py needs; without them there is nothing to reconcile
+TRUNK_ENV = (
+    "TWILIO_ACCOUNT_SID", "TWILIO_AUTH_TOKEN", "TWILIO_PHONE_NUMBER",
+    "LIVEKIT_SIP_URI", "LIVEKIT_URL", "LIVEKIT_API_KEY", "LIVEKIT_API_SECRET",
+)
+
+
+def preload_modules(agent_module):
+    """Modules that can be imported off the main thread ahead of the agent module.
+
+    These are the heavy dependencies of the plugins each agent uses; none of them
+    registers a livekit plugin. Only configured providers are included.
+    """
+    modules = ["livekit.agents", "livekit.rtc"]
+    if os.getenv("OPENAI_API_KEY"):
+        modules.append("openai")
+    if agent_module == "agent":
+        modules.append("livekit.agents.multimodal")
+    else:
+        modules += ["livekit.agents.pipeline", "numpy", "onnxruntime"]
+    return modules
+
+
+def _import_all(modules):
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            # The main-thread import will report it properly if it matters
+            log.warning(f"Could not preload {name}: {e}")
+
+
+async def reconcile_trunk():
+    missing = [name for name in TRUNK_ENV if not os.getenv(name)]
+    if missing:
+        log.info(f"Skipping trunk reconciliation, not configured ({', '.join(missing)} unset)")
+        return
+    timeline.begin("trunk")
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(current_dir, "trunk.py"), cwd=current_dir,
+    )
+    returncode = await proc.wait()
+    timeline.end("trunk", returncode=returncode)
+    if returncode:
+        log.warning(f"trunk.py exited with {returncode}, continuing anyway")
+
+
+async def prepare(agent_module):
+    """Start the health server and trunk reconciliation, and preload imports, concurrently"""
+    import health_check
+
+    health_check.register_stats("startup", timeline.snapshot)
+    timeline.begin("health_server")
+    server = health_check.start_in_worker_loop()
+
+    async def health_listening():
+        await server.listening.wait()
+        timeline.end("health_server", port=server.port)
+
+    # The trunk task keeps running into the worker's lifetime if it is slow
+    trunk_task = asyncio.create_task(reconcile_trunk(), name="trunk_reconcile")
+    health_task = asyncio.create_task(health_listening())
+
+    modules = preload_modules(agent_module)
+    timeline.begin("preload")
+    await asyncio.to_thread(_import_all, modules)
+    timeline.end("preload", modules=modules)
+    return trunk_task, health_task
+
+
+def main():
+    from dotenv import load_dotenv
+
+    timeline.mark("wrapper_started")
+    load_dotenv()
+    agent_module = os.getenv("AGENT_MODULE", "agent")
+    watch_worker_registration()
+
+    # Measure startup without connecting a worker
+    prepare_only = "--prepare-only" in sys.argv
+    if prepare_only:
+        sys.argv.remove("--prepare-only")
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    # Keep references: these tasks outlive prepare() and run on under the worker
+    background = loop.run_until_complete(prepare(agent_module))
+
+    with timeline.phase("agent_import"):
+        agent = importlib.import_module(agent_module)
+
+    log.info(f"Ready to start the worker after {timeline.elapsed('agent_import'):.2f}s\n{timeline.summary()}")
+
+    if prepare_only:
+        loop.run_until_complete(background[0])
+        print(timeline.summary())
+        return background
+    # Like `python agent.py start`; livekit's CLI needs a command
+    if len(sys.argv) < 2:
+        sys.argv.append("start")
+    agent.main()
+    return background
+
+
+if __name__ == "__main__":
+    try:
+        log.info("Starting agent")
+        main()
+    except Exception as e:
+        log.error(f"Error running agent: {e}")
+        # Keep the container running for health checks even if agent fails
+        log.info("Keeping container alive for health checks...")
+        import health_check
+        health_check.serve_forever()
@@ -0,0 +1,452 @@
+"""Offline end-to-end latency benchmark for the voice pipeline agent (save_chatctx.py).
+
+The real entrypoint runs against fake_room and the fake plugins in
+fake_plugins. Each simulated caller waits for the greeting, then speaks each
+turn of the script and waits for the reply. Calls run on their own threads and
+event loops, as jobs do under the thread executor. The benchmark repeats at
+each concurrency level and reports:
+
+- greeting time to first audio, from job start
+- turn latency, from the end of the caller's speech to the first reply audio
+- per-stage latencies from latency_metrics
+- LLM prompt size
+- CPU per concurrent call
+
+    python bench_pipeline.py --concurrency 1,2,4,8 --output bench.json
+    python bench_pipeline.py --concurrency 1,2,4,8 --compare bench.json
+
+Callers speak synthetic, speech-shaped noise by default. A script file can
+replay recorded audio instead: a JSON list of turns such as
+{"text": "...", "audio": "caller.wav", "tool": "contact", "pause_s": 1.0}.
+
+--vad silero, --vad ring and --vad service replace the energy-based fake VAD
+with the Silero model: through the plugin's own stream, through ring_vad, or
+through ring_vad with inference in vad_service's worker processes. Callers then
+speak synthetic voiced speech, which the model recognizes as speech.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import psutil
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+logger = logging.getLogger("bench_pipeline")
+logger.setLevel(logging.INFO)
+
+DEFAULT_TURNS = [
+    {
+        "text": "Hi, what does PI and Other Tales do?", "speech_s": 1.6,
+        "reply": "We're a creative studio working on imaginative media and entertainment.",
+    },
+    {
+        "text": "How can I get in touch with the studio?", "speech_s": 1.8, "tool": "contact",
+        "reply": "You can reach us through othertales.co, or find us on GitHub.",
+    },
+    {
+        "text": "When is the book coming out?", "speech_s": 1.4,
+        "reply": "Fortunes Told is out on June 19th. You can pre-order it now.",
+    },
+]
+
+# Relative changes below these floors are noise, not regressions
+_NOISE_FLOOR = {"ms": 25.0, "pct": 1.0}
+
+
+def percentiles(values):
+    """p50/p95/p99/max of a list of numbers, by nearest rank"""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def rank(q):
+        return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+    return {
+        "count": len(ordered),
+        "p50": round(rank(0.5), 1),
+        "p95": round(rank(0.95), 1),
+        "p99": round(rank(0.99), 1),
+        "max": round(ordered[-1], 1),
+    }
+
+
+def load_turns(path, seed, voiced=False):
+    import fake_room
+    from fake_plugins import Turn
+
+    if path:
+        with open(path) as f:
+            specs = json.load(f)
+        base = os.path.dirname(os.path.abspath(path))
+    else:
+        specs, base = DEFAULT_TURNS, SCRIPT_DIR
+    turns = []
+    for i, spec in enumerate(specs):
+        if spec.get("audio"):
+            samples = fake_room.load_wav(os.path.join(base, spec["audio"]))
+        else:
+            speech = fake_room.voiced_speech if voiced else fake_room.synthetic_speech
+            samples = speech(spec.get("speech_s", 1.5), seed=seed + i)
+        turns.append(Turn(
+            text=spec["text"], samples=samples, tool=spec.get("tool"),
+            reply=spec.get("reply"), pause_s=spec.get("pause_s", 0.8),
+        ))
+    return turns
+
+
+class AgentObserver:
+    """Follows one agent's speaking state so the caller knows when to talk"""
+
+    def __init__(self):
+        self.agent = None
+        self.speaking = False
+        self.started_at = []
+        self.prompt_tokens = []
+        self._changed = asyncio.Event()
+
+    def attach(self, agent):
+        self.agent = agent
+        agent.on("agent_started_speaking", self._on_started)
+        agent.on("agent_stopped_speaking", self._on_stopped)
+        agent.on("metrics_collected", self._on_metrics)
+
+    def _on_started(self, *_):
+        self.speaking = True
+        self.started_at.append(time.perf_counter())
+        self._changed.set()
+
+    def _on_stopped(self, *_):
+        self.speaking = False
+        self._changed.set()
+
+    def _on_metrics(self, metrics):
+        if getattr(metrics, "prompt_tokens", 0):
+            self.prompt_tokens.append(metrics.prompt_tokens)
+
+    async def first_audio_after(self, index, timeout):
+        """Time the agent starts its index-th utterance"""
+        deadline = time.perf_counter() + timeout
+        while len(self.started_at) <= index:
+            self._changed.clear()
+            await asyncio.wait_for(self._changed.wait(), max(0.0, deadline - time.perf_counter()))
+        return self.started_at[index]
+
+    async def wait_quiet(self, quiet_s, timeout):
+        """Wait until the agent has not spoken for quiet_s (a filler is followed by the answer)"""
+        deadline = time.perf_counter() + timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise asyncio.TimeoutError("the agent kept talking")
+            self._changed.clear()
+            if self.speaking:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+                continue
+            try:
+                await asyncio.wait_for(self._changed.wait(), min(quiet_s, remaining))
+            except asyncio.TimeoutError:
+                return
+
+
+_observers = threading.local()
+
+
+def _install_fakes(profile):
+    """Swap the providers and VoicePipelineAgent in save_chatctx for observed fakes"""
+    import types
+
+    import fake_plugins
+    import fake_room
+    import save_chatctx
+
+    fake_room.install()
+
+    class ObservedAgent(save_chatctx.VoicePipelineAgent):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            _observers.current.attach(self)
+
+    save_chatctx.VoicePipelineAgent = ObservedAgent
+    save_chatctx.openai = types.SimpleNamespace(
+        LLM=fake_plugins.FakeLLM, TTS=fake_plugins.FakeTTS, STT=fake_plugins.FakeSTT,
+    )
+    save_chatctx.deepgram = types.SimpleNamespace(STT=fake_plugins.FakeSTT)
+    return save_chatctx
+
+
+async def run_call(index, level, args, profile, turns, proc_userdata):
+    import fake_plugins
+    import fake_room
+    import save_chatctx
+
+    script = fake_plugins.CallScript(profile=profile, turns=turns, seed=args.seed + index)
+    fake_plugins.current_call.set(script)
+    observer = _observers.current = AgentObserver()
+    room_name = f"call-bench-c{level}-{index}"
+    ctx = fake_room.FakeJobContext(
+        room_name,
+        proc=fake_room.FakeJobProcess(proc_userdata),
+        metadata={"caller_id": f"+44700000{index:04d}"},
+        connect_latency=args.connect_ms / 1000,
+    )
+    caller = fake_room.Caller(ctx.room, f"sip_+44700000{index:04d}")
+    result = {"room": room_name, "turns_ms": [], "error": None}
+    # The SIP participant is already in the room when the job is dispatched
+    caller.join()
+    started = time.perf_counter()
+    entry = asyncio.create_task(save_chatctx.entrypoint(ctx))
+    try:
+        first = await observer.first_audio_after(0, args.timeout)
+        result["greeting_ms"] = (first - started) * 1000
+        await observer.wait_quiet(args.quiet_s, args.timeout)
+        for turn in turns:
+            await asyncio.sleep(turn.pause_s)
+            spoken = len(observer.started_at)
+            speech_end = await caller.say(turn.samples)
+            reply = await observer.first_audio_after(spoken, args.timeout)
+            result["turns_ms"].append((reply - speech_end) * 1000)
+            await observer.wait_quiet(args.quiet_s, args.timeout)
+        await entry
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        logger.error(f"Call {room_name} failed: {result['error']}")
+    finally:
+        result["prompt_tokens"] = observer.prompt_tokens
+        result["frames_late"] = caller.frames_late
+        result["frames_dropped"] = caller.frames_dropped
+        if not entry.done():
+            entry.cancel()
+        await caller.hang_up()
+        if observer.agent is not None:
+            await observer.agent.aclose()
+        await ctx.run_shutdown_callbacks()
+    return result
+
+
+def _call_thread(index, level, args, profile, turns, proc_userdata, results):
+    results[index] = asyncio.run(run_call(index, level, args, profile, turns, proc_userdata))
+
+
+def run_level(level, args, profile, turns, proc_userdata):
+    import latency_metrics
+
+    latency_metrics.latency = latency_metrics.LatencyRegistry()
+    process = psutil.Process()
+    cpu_before = sum(process.cpu_times()[:2])
+    started = time.perf_counter()
+    results = [None] * level
+    threads = [
+        threading.Thread(
+            target=_call_thread, args=(i, level, args, profile, turns, proc_userdata, results),
+            name=f"bench_call_{i}",
+        )
+        for i in range(level)
+    ]
+    for thread in threads:
+        thread.start()
+    peak_rss = process.memory_info().rss
+    while any(thread.is_alive() for thread in threads):
+        time.sleep(0.2)
+        peak_rss = max(peak_rss, process.memory_info().rss)
+    wall = time.perf_counter() - started
+    cpu = sum(process.cpu_times()[:2]) - cpu_before
+
+    ok = [r for r in results if r and not r["error"]]
+    stages = latency_metrics.latency.snapshot()["worker"]
+    return {
+        "concurrency": level,
+        "calls": level,
+        "failed": level - len(ok),
+        "errors": sorted({r["error"] for r in results if r and r["error"]}),
+        "wall_s": round(wall, 2),
+        "greeting_ttfa_ms": percentiles([r["greeting_ms"] for r in ok]),
+        "turn_latency_ms": percentiles([ms for r in ok for ms in r["turns_ms"]]),
+        "stages_ms": {
+            stage: {"count": s["count"], "p50": round(s["p50"] * 1000, 1), "p95": round(s["p95"] * 1000, 1)}
+            for stage, s in sorted(stages.items())
+        },
+        "llm_prompt_tokens": percentiles([t for r in ok for t in r["prompt_tokens"]]),
+        "caller_frames_late": sum(r["frames_late"] for r in results if r),
+        "caller_frames_dropped": sum(r["frames_dropped"] for r in results if r),
+        "cpu_s": round(cpu, 2),
+        "cpu_per_call_pct": round(cpu / wall / level * 100, 2),
+        "peak_rss_mb": round(peak_rss / 2 ** 20, 1),
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIR, capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(current, baseline, tolerance):
+    """Print metric changes per concurrency level; returns the regressions found"""
+    regressions = []
+    previous = {level["concurrency"]: level for level in baseline["levels"]}
+    checks = [
+        ("greeting_ttfa_ms", "p50", "ms"), ("greeting_ttfa_ms", "p95", "ms"),
+        ("turn_latency_ms", "p50", "ms"), ("turn_latency_ms", "p95", "ms"),
+        ("cpu_per_call_pct", None, "pct"),
+    ]
+    print(f"\nCompared with {baseline['meta'].get('git_revision') or 'baseline'} "
+          f"(tolerance {tolerance:.0%}):")
+    for level in current["levels"]:
+        old = previous.get(level["concurrency"])
+        if old is None:
+            continue
+        for metric, quantile, unit in checks:
+            new_value = level[metric] if quantile is None else level[metric].get(quantile)
+            old_value = old[metric] if quantile is None else old[metric].get(quantile)
+            if new_value is None or old_value is None:
+                continue
+            change = new_value - old_value
+            relative = change / old_value if old_value else 0.0
+            name = metric if quantile is None else f"{metric}.{quantile}"
+            flag = ""
+            if relative > tolerance and change > _NOISE_FLOOR[unit]:
+                flag = "  REGRESSION"
+                regressions.append((level["concurrency"], name, old_value, new_value))
+            print(f"  c={level['concurrency']:<3} {name:<24} {old_value:>9} -> {new_value:>9} ({relative:+.1%}){flag}")
+    return regressions
+
+
+def print_summary(levels):
+    print(f"\n{'calls':>5}  {'greet p50':>9}  {'turn p50':>8}  {'turn p95':>8}  "
+          f"{'cpu/call':>8}  {'rss MB':>7}  {'failed':>6}")
+    for level in levels:
+        greeting, turn = level["greeting_ttfa_ms"], level["turn_latency_ms"]
+        print(
+            f"{level['concurrency']:>5}  {greeting.get('p50', '-'):>9}  {turn.get('p50', '-'):>8}  "
+            f"{turn.get('p95', '-'):>8}  {level['cpu_per_call_pct']:>7}%  {level['peak_rss_mb']:>7}  "
+            f"{level['failed']:>6}"
+        )
+
+
+def main():
+    from fake_plugins import Profile
+
+    defaults = Profile()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,2,4", help="Comma-separated concurrency levels")
+    parser.add_argument("--script", help="JSON list of caller turns; defaults to a built-in three-turn call")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Results JSON from an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Relative slowdown counted as a regression")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--connect-ms", type=float, default=100.0, help="Time for ctx.connect()")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds to wait for any agent reply")
+    parser.add_argument("--quiet-s", type=float, default=1.5, help="Silence after which the agent's reply is over")
+    parser.add_argument("--cold-cache", action="store_true", help="Do not pre-synthesize the greeting")
+    parser.add_argument(
+        "--vad", choices=("fake", "silero", "ring", "service"), default="fake",
+        help="Energy-based fake VAD, or the Silero model through the plugin's stream, ring_vad's, "
+             "or ring_vad's with inference in vad_service's worker processes",
+    )
+    for name, value in defaults.to_dict().items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    logger.setLevel(logging.INFO)
+    # Keep the benchmark's cache, transcripts and health state away from the real ones
+    workdir = tempfile.mkdtemp(prefix="bench-pipeline-")
+    os.environ["TTS_CACHE_DIR"] = os.path.join(workdir, "tts-cache")
+    os.environ["TRANSCRIPT_DIR"] = os.path.join(workdir, "transcripts")
+    # The calls run on threads of this process, as under the thread executor
+    os.environ["AGENT_JOB_EXECUTOR"] = "thread"
+    os.environ.setdefault("AGENT_LOAD_THRESHOLD", "1.0")
+    os.environ["VAD_RING"] = "1" if args.vad in ("ring", "service") else "0"
+    if args.vad == "service":
+        os.environ.setdefault("VAD_SERVICE_WORKERS", "2")
+    else:
+        os.environ["VAD_SERVICE_WORKERS"] = "0"
+
+    import fake_plugins
+    import knowledge_store
+
+    profile = Profile(**{name: getattr(args, name) for name in defaults.to_dict()})
+    save_chatctx = _install_fakes(profile)
+    # The Silero model does not take the fake VAD's shaped noise for speech
+    turns = load_turns(args.script, args.seed, voiced=args.vad != "fake")
+    if args.vad == "fake":
+        vad = fake_plugins.FakeVAD(min_silence_ms=profile.vad_min_silence_ms)
+    else:
+        from livekit.plugins import silero
+
+        vad = silero.VAD.load(min_silence_duration=profile.vad_min_silence_ms / 1000)
+        if args.vad == "service":
+            import vad_service
+
+            # As the prewarm hook does, so the worker processes are up before the first call
+            vad_service.get(vad)
+    # What the prewarm hook leaves in every process's userdata
+    proc_userdata = {
+        "vad": vad,
+        "knowledge": knowledge_store.get_store(),
+        "prewarmed_at": time.monotonic(),
+    }
+    if not args.cold_cache:
+        import tts_cache
+
+        async def warm():
+            fake_plugins.current_call.set(fake_plugins.CallScript(profile=profile, turns=turns))
+            await tts_cache.warm(tts_cache.CachedTTS(
+                fake_plugins.FakeTTS(), [save_chatctx.GREETING], sentence_tokenizer=save_chatctx.SPEECH_CHUNKER,
+            ))
+
+        asyncio.run(warm())
+
+    levels = []
+    for level in [int(c) for c in args.concurrency.split(",")]:
+        logger.info(f"Running {level} concurrent calls")
+        levels.append(run_level(level, args, profile, turns, proc_userdata))
+    results = {
+        "meta": {
+            "benchmark": "save_chatctx",
+            "git_revision": _git_revision(),
+            "time": time.time(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "profile": profile.to_dict(),
+            "turns": [{"text": t.text, "tool": t.tool, "speech_s": len(t.samples) / 16000} for t in turns],
+            "warm_cache": not args.cold_cache,
+            "vad": args.vad,
+            "seed": args.seed,
+        },
+        "levels": levels,
+    }
+    print_summary(levels)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        logger.info(f"Results written to {args.output}")
+    status = 0 if all(level["failed"] == 0 for level in levels) else 1
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, SCRIPT_DIR)
+    sys.exit(main())
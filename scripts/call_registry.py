@@ -0,0 +1,177 @@
+import asyncio
+import collections
+import logging
+import os
+import threading
+import time
+
+import health_check
+
+logger = logging.getLogger("call_registry")
+logger.setLevel(logging.INFO)
+
+# A call is "waiting" from dispatch until the caller joins the room, then "active"
+STATES = ("waiting", "active")
+
+
+class CallRecord:
+    """One call handled by this worker"""
+
+    __slots__ = (
+        "room_name", "participant_identity", "caller_id", "state", "started_at", "_started", "_last_seen", "_loop",
+    )
+
+    def __init__(self, room_name, caller_id=None):
+        self.room_name = room_name
+        self.participant_identity = None
+        self.caller_id = caller_id
+        self.state = "waiting"
+        self.started_at = time.time()
+        self._started = time.monotonic()
+        self._last_seen = self._started
+        # The job's event loop; once it is closed the job is gone
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._loop = None
+
+    def duration(self):
+        return time.monotonic() - self._started
+
+    def job_gone(self, now, ttl):
+        """Whether the job behind this call has ended; without its loop, whether it is silent for over ttl"""
+        if self._loop is not None:
+            return self._loop.is_closed()
+        return now - self._last_seen > ttl
+
+    def to_dict(self):
+        return {
+            "room": self.room_name,
+            "participant": self.participant_identity,
+            "caller_id": self.caller_id,
+            "state": self.state,
+            "started_at": self.started_at,
+            "duration_s": round(self.duration(), 1),
+        }
+
+    def __str__(self):
+        return f"Call(room={self.room_name}, participant={self.participant_identity}, state={self.state})"
+
+
+class CallRegistry:
+    """Calls in progress across every job in the worker process.
+
+    Writers (call start, state change, end) update the record table and state
+    counts in place under a lock, in O(1). Readers such as the load function
+    just read the table's size, and snapshot() copies it under the lock. A
+    call whose job ended without running its shutdown callbacks is reaped:
+    its job's event loop is closed. Calls started outside an event loop are
+    reaped after `ttl` seconds without an update instead. A call that is
+    simply long is never reaped.
+    """
+
+    def __init__(self, ttl=6 * 3600.0, max_calls=1000, reap_interval=60.0):
+        self.ttl = ttl
+        self.max_calls = max_calls
+        self.reap_interval = reap_interval
+        self.started = 0
+        self.ended = 0
+        self.reaped = 0
+        self._lock = threading.Lock()
+        # Least recently updated first
+        self._records = collections.OrderedDict()
+        self._counts = dict.fromkeys(STATES, 0)
+        self._next_reap = time.monotonic() + reap_interval
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, room_name):
+        return room_name in self._records
+
+    def get(self, room_name):
+        return self._records.get(room_name)
+
+    def counts(self):
+        """Number of calls in each state"""
+        with self._lock:
+            return dict(self._counts)
+
+    def start(self, room_name, caller_id=None):
+        """Register a new call, replacing any stale record for the same room"""
+        self.reap()
+        record = CallRecord(room_name, caller_id)
+        with self._lock:
+            old = self._records.pop(room_name, None)
+            if old is not None:
+                self._counts[old.state] -= 1
+            if len(self._records) >= self.max_calls:
+                # Bounded: drop the least recently updated call rather than grow without limit
+                _, oldest = self._records.popitem(last=False)
+                self._counts[oldest.state] -= 1
+                self.reaped += 1
+                logger.warning(f"Call registry full, dropped {oldest}")
+            self._records[room_name] = record
+            self._counts[record.state] += 1
+            self.started += 1
+        return record
+
+    def set_state(self, record, state, participant_identity=None):
+        with self._lock:
+            if participant_identity is not None:
+                record.participant_identity = participant_identity
+            record._last_seen = time.monotonic()
+            registered = self._records.get(record.room_name) is record
+            if registered:
+                self._records.move_to_end(record.room_name)
+            if record.state == state:
+                return
+            if registered:
+                self._counts[record.state] -= 1
+                self._counts[state] += 1
+            record.state = state
+
+    def end(self, room_name):
+        """Remove a call; returns its record, or None if it was not registered"""
+        with self._lock:
+            record = self._records.pop(room_name, None)
+            if record is None:
+                return None
+            self._counts[record.state] -= 1
+            self.ended += 1
+        return record
+
+    def reap(self, force=False):
+        """Drop calls whose job is gone; cheap unless a reap is due"""
+        now = time.monotonic()
+        if not force and now < self._next_reap:
+            return 0
+        self._next_reap = now + self.reap_interval
+        reaped = []
+        with self._lock:
+            for record in [r for r in self._records.values() if r.job_gone(now, self.ttl)]:
+                del self._records[record.room_name]
+                self._counts[record.state] -= 1
+                self.reaped += 1
+                reaped.append(record)
+        for record in reaped:
+            logger.warning(f"Reaped {record} after {record.duration():.0f}s, its job ended without ending the call")
+        return len(reaped)
+
+    def snapshot(self):
+        self.reap()
+        with self._lock:
+            records = list(self._records.values())
+            counts = dict(self._counts)
+        return {
+            "active": len(records),
+            "by_state": counts,
+            "started": self.started,
+            "ended": self.ended,
+            "reaped": self.reaped,
+            "calls": [record.to_dict() for record in records],
+        }
+
+
+active_calls = CallRegistry(ttl=float(os.getenv("AGENT_CALL_TTL_S", str(6 * 3600))))
+health_check.register_stats("calls", active_calls.snapshot)
@@ -0,0 +1,360 @@
+"""What the receptionist remembers about returning callers, keyed by caller ID.
+
+Each caller has notes from their earlier calls and a few preferences, such as
+the name they gave. The notes keep only the caller's requests and questions,
+as transcribed, and the topics they asked about, up to CALLER_SUMMARY_CHARS per
+caller. Small talk and everything else they said is dropped. The notes are
+still the caller's own words, so the file must be protected like any other
+personal data.
+
+These are kept in a SQLite file. An LRU cache of recently seen callers sits in
+front of it, shared by every call in the worker process. Queries run in a
+worker thread, so a call can start its lookup alongside ctx.connect() and
+never waits on disk. Caller IDs are stored as an HMAC-SHA256 keyed with
+CALLER_STORE_KEY: phone numbers are few enough that a plain hash is easily
+reversed. Without the key, callers are not remembered at all. A caller who has
+not called for CALLER_TTL_DAYS is forgotten, both in the cache and in the file.
+
+The same file holds calls parked by session_resume, by room, for the few
+seconds until a new job claims them. Every job process can reach it, whichever
+job executor the worker uses.
+"""
+
+import asyncio
+import collections
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import company_knowledge
+
+logger = logging.getLogger("caller_store")
+logger.setLevel(logging.INFO)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS callers (
+    caller_key TEXT PRIMARY KEY,
+    summary TEXT NOT NULL,
+    preferences TEXT NOT NULL,
+    calls INTEGER NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL
+)
+"""
+_PARKED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS parked_calls (
+    room_name TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    parked_at REAL NOT NULL
+)
+"""
+# Expired callers are also deleted while the worker runs, at most this often
+PURGE_INTERVAL_S = 3600.0
+# Only the lead-in ignores case: the name itself must be capitalized, so "my name is not important" is no name
+_NAME = re.compile(r"\b(?i:my name is) ([A-Z][a-z]+(?: [A-Z][a-z]+)?)")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+# Sentences that ask for something even without a question mark, as transcripts often lack one
+_REQUEST = re.compile(
+    r"\b(?:i'?d like|i would like|i want|i need|i'?m (?:calling|looking|interested)|can you|could you|"
+    r"would you|please|tell me|wondering|how|what|when|where|who|which|is there|are there|do you|does)\b",
+    re.IGNORECASE,
+)
+
+
+def caller_key(caller_id, secret):
+    """The stored form of a caller ID, so the file holds no phone numbers"""
+    return hmac.new(secret, caller_id.encode(), hashlib.sha256).hexdigest()
+
+
+class CallerProfile:
+    """What is known about one caller from their earlier calls"""
+
+    __slots__ = ("summary", "preferences", "calls", "first_seen", "last_seen")
+
+    def __init__(self, summary="", preferences=None, calls=0, first_seen=None, last_seen=None):
+        self.summary = summary
+        self.preferences = preferences or {}
+        self.calls = calls
+        self.first_seen = first_seen or time.time()
+        self.last_seen = last_seen or self.first_seen
+
+    def instructions(self):
+        """A paragraph for the model's instructions, so it can treat the caller as a returning one"""
+        last = datetime.fromtimestamp(self.last_seen).strftime("%d %B %Y")
+        lines = [
+            f"This caller has called {self.calls} time{'s' if self.calls != 1 else ''} before, most recently on {last}."
+        ]
+        if self.preferences.get("name"):
+            lines.append(f"They gave their name as {self.preferences['name']}.")
+        if self.summary:
+            lines.append(f"Notes from their earlier calls: {self.summary}")
+        lines.append("Do not make them explain again what they already told you.")
+        return " ".join(lines)
+
+
+def caller_requests(user_texts):
+    """The sentences in which the caller asked for something, in order"""
+    requests = []
+    for text in user_texts:
+        for sentence in _SENTENCE_END.split(text.strip()):
+            if sentence.endswith("?") or _REQUEST.search(sentence):
+                requests.append(sentence)
+    return requests
+
+
+def summarize_call(previous, user_texts, max_chars):
+    """Previous notes plus the caller's requests and topics on this call, keeping the most recent max_chars"""
+    requests = caller_requests(user_texts)
+    scores = company_knowledge.score_topic(" ".join(user_texts))
+    topics = sorted(scores, key=scores.get, reverse=True)
+    if not requests and not topics:
+        return previous
+    note = f"On {datetime.now().strftime('%d %B %Y')}:"
+    if topics:
+        note += f" topics {', '.join(topics)}."
+    if requests:
+        note += f" Asked: {' / '.join(requests)}"
+    text = f"{previous} {note}".strip()
+    return text if len(text) <= max_chars else "..." + text[-max_chars:]
+
+
+def preferences_from(user_texts, preferences):
+    """Preferences updated from what the caller said: currently the name they gave"""
+    preferences = dict(preferences)
+    for text in user_texts:
+        match = _NAME.search(text)
+        if match:
+            preferences["name"] = match.group(1).title()
+    return preferences
+
+
+class CallerStore:
+    """SQLite-backed caller profiles behind an in-memory LRU cache; safe to share across jobs.
+
+    The file holds callers' requests in their own words; see the module docstring.
+    """
+
+    def __init__(self, path, secret, max_cached=1000, ttl=30 * 86400.0):
+        if not secret:
+            raise ValueError("CallerStore needs a secret to key caller IDs with")
+        self.path = path
+        self._secret = secret.encode() if isinstance(secret, str) else secret
+        self.max_cached = max_cached
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.saves = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+        # caller key -> CallerProfile, or None for a caller known not to be stored
+        self._cache = collections.OrderedDict()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(_SCHEMA)
+            self._db.execute(_PARKED_SCHEMA)
+            self._db.commit()
+            # Kept up to date as callers are added and deleted, so stats() never queries the file
+            self.stored = self._db.execute("SELECT COUNT(*) FROM callers").fetchone()[0]
+        self._next_purge = 0.0
+        self.purge_expired()
+
+    def _cached(self, key):
+        with self._lock:
+            if key not in self._cache:
+                return False, None
+            self._cache.move_to_end(key)
+            return True, self._cache[key]
+
+    def _remember(self, key, profile):
+        with self._lock:
+            self._cache[key] = profile
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+
+    def _fresh(self, profile):
+        return profile is not None and time.time() - profile.last_seen <= self.ttl
+
+    def _lookup(self, key):
+        found, profile = self._cached(key)
+        if not found:
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT summary, preferences, calls, first_seen, last_seen FROM callers WHERE caller_key = ?",
+                    (key,),
+                ).fetchone()
+            profile = None
+            if row is not None:
+                profile = CallerProfile(row[0], json.loads(row[1]), row[2], row[3], row[4])
+            self._remember(key, profile)
+        if profile is not None and not self._fresh(profile):
+            self._forget(key)
+            self.expired += 1
+            profile = None
+        return profile
+
+    def get(self, caller_id):
+        """The caller's profile, or None for a new caller; may query the file"""
+        profile = self._lookup(caller_key(caller_id, self._secret))
+        if profile is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return profile
+
+    async def load(self, caller_id):
+        """get() in a worker thread; None without a caller ID"""
+        if not caller_id:
+            return None
+        found, profile = self._cached(caller_key(caller_id, self._secret))
+        if found and (profile is None or self._fresh(profile)):
+            # Cached, so no need to leave the event loop
+            return self.get(caller_id)
+        return await asyncio.to_thread(self.get, caller_id)
+
+    def record_call(self, caller_id, user_texts, max_chars=None, resumed=False):
+        """Fold a finished call into the caller's profile and write it back.
+
+        A resumed call was already recorded when its first job ended, so it adds
+        what was said without counting as another call.
+        """
+        max_chars = max_chars or int(os.getenv("CALLER_SUMMARY_CHARS", "600"))
+        key = caller_key(caller_id, self._secret)
+        profile = self._lookup(key) or CallerProfile()
+        now = time.time()
+        updated = CallerProfile(
+            summarize_call(profile.summary, user_texts, max_chars),
+            preferences_from(user_texts, profile.preferences),
+            profile.calls + (0 if resumed else 1),
+            profile.first_seen,
+            now,
+        )
+        row = (updated.summary, json.dumps(updated.preferences), updated.calls, updated.first_seen, now, key)
+        with self._lock:
+            updated_rows = self._db.execute(
+                "UPDATE callers SET summary = ?, preferences = ?, calls = ?, first_seen = ?, last_seen = ? "
+                "WHERE caller_key = ?",
+                row,
+            ).rowcount
+            if not updated_rows:
+                self._db.execute(
+                    "INSERT INTO callers (summary, preferences, calls, first_seen, last_seen, caller_key) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    row,
+                )
+                self.stored += 1
+            self._db.commit()
+        self._remember(key, updated)
+        self.saves += 1
+        if time.monotonic() >= self._next_purge:
+            self.purge_expired()
+        return updated
+
+    async def save(self, caller_id, user_texts, resumed=False):
+        """record_call() in a worker thread"""
+        if caller_id:
+            return await asyncio.to_thread(self.record_call, caller_id, user_texts, resumed=resumed)
+
+    def _forget(self, key):
+        with self._lock:
+            self._cache.pop(key, None)
+            self.stored -= self._db.execute("DELETE FROM callers WHERE caller_key = ?", (key,)).rowcount
+            self._db.commit()
+
+    def purge_expired(self):
+        """Delete every caller not seen within the TTL; returns how many were deleted"""
+        cutoff = time.time() - self.ttl
+        self._next_purge = time.monotonic() + PURGE_INTERVAL_S
+        with self._lock:
+            deleted = self._db.execute("DELETE FROM callers WHERE last_seen < ?", (cutoff,)).rowcount
+            self.stored -= deleted
+            self._db.commit()
+            for key in [k for k, p in self._cache.items() if p is not None and p.last_seen < cutoff]:
+                del self._cache[key]
+        if deleted:
+            self.expired += deleted
+            logger.info(f"Forgot {deleted} callers not seen for {self.ttl / 86400:.0f} days")
+        return deleted
+
+    def park_call(self, room_name, data, max_age):
+        """Keep a call's resume state by room, for a job in any process to claim; returns how many expired"""
+        now = time.time()
+        with self._lock:
+            expired = self._db.execute("DELETE FROM parked_calls WHERE parked_at < ?", (now - max_age,)).rowcount
+            self._db.execute(
+                "INSERT OR REPLACE INTO parked_calls (room_name, data, parked_at) VALUES (?, ?, ?)",
+                (room_name, data, now),
+            )
+            self._db.commit()
+        return expired
+
+    def claim_parked_call(self, room_name):
+        """(data, parked_at) of a room's parked call, deleted in the same statement so only one job gets it"""
+        with self._lock:
+            row = self._db.execute(
+                "DELETE FROM parked_calls WHERE room_name = ? RETURNING data, parked_at", (room_name,),
+            ).fetchone()
+            self._db.commit()
+        return row
+
+    def parked_calls(self, max_age):
+        """Parked calls younger than max_age, in every process"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM parked_calls WHERE parked_at >= ?", (time.time() - max_age,),
+            ).fetchone()[0]
+
+    def stats(self):
+        """Counters for the health endpoint. "stored" counts this process's changes, not other processes'."""
+        with self._lock:
+            stored = self.stored
+            cached = len(self._cache)
+        return {
+            "stored": stored,
+            "cached": cached,
+            "hits": self.hits,
+            "misses": self.misses,
+            "saves": self.saves,
+            "expired": self.expired,
+        }
+
+
+_store = None
+_configured = False
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Process-wide store configured from the CALLER_* environment variables; None without CALLER_STORE_KEY"""
+    global _store, _configured
+    with _store_lock:
+        if not _configured:
+            _configured = True
+            secret = os.getenv("CALLER_STORE_KEY")
+            if not secret:
+                logger.warning("CALLER_STORE_KEY is not set, so returning callers are not remembered")
+            else:
+                _store = CallerStore(
+                    os.getenv("CALLER_STORE_PATH", "callers.sqlite3"),
+                    secret,
+                    max_cached=int(os.getenv("CALLER_CACHE_SIZE", "1000")),
+                    ttl=float(os.getenv("CALLER_TTL_DAYS", "30")) * 86400,
+                )
+        return _store
+
+
+def stats():
+    """The process-wide store's counters, for the health endpoint"""
+    store = get_store()
+    return store.stats() if store is not None else {"enabled": False}
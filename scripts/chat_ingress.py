@@ -0,0 +1,205 @@
+"""Queue for text chat messages: coalesces bursts and bounds the LLM requests they cause.
+
+Messages that arrive within CHAT_COALESCE_MS of each other are answered by one
+LLM request. Each room has at most CHAT_MAX_IN_FLIGHT_PER_ROOM replies in
+progress, and the worker at most CHAT_MAX_IN_FLIGHT across all its calls. A
+reply counts as in progress from its LLM request until it has been spoken.
+When newer messages arrive before a reply has started speaking, that reply is
+cancelled and its messages are answered together with the new ones.
+"""
+
+import asyncio
+import collections
+import logging
+import os
+import threading
+import time
+import weakref
+
+logger = logging.getLogger("chat_ingress")
+logger.setLevel(logging.INFO)
+
+_stats = {"messages": 0, "requests": 0, "coalesced": 0, "superseded": 0, "dropped": 0, "failed": 0}
+# Calls in other job threads update the same counters
+_stats_lock = threading.Lock()
+_rooms = weakref.WeakSet()
+
+
+def _count(name, n=1):
+    with _stats_lock:
+        _stats[name] += n
+
+
+class WorkerLimiter:
+    """Counting semaphore shared by every job in the process, each of which runs its own event loop"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._waiters = collections.deque()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.in_flight < self.limit and not self._waiters:
+                self.in_flight += 1
+                return
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                queued = waiter in self._waiters
+                if queued:
+                    self._waiters.remove(waiter)
+            # The slot was handed over just before the cancellation
+            if not queued and not waiter[1].cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            if not self._waiters:
+                self.in_flight -= 1
+                return
+            # The slot passes straight to the next waiter, on that waiter's loop
+            loop, future = self._waiters.popleft()
+        try:
+            loop.call_soon_threadsafe(self._grant, future)
+        except RuntimeError:
+            # That job's loop has closed
+            self.release()
+
+    def _grant(self, future):
+        if future.done():
+            self.release()
+        else:
+            future.set_result(None)
+
+
+worker_limiter = WorkerLimiter(int(os.getenv("CHAT_MAX_IN_FLIGHT", "8")))
+
+
+def stats():
+    """Process-wide counters and current queue state, for the health endpoint"""
+    rooms = list(_rooms)
+    with _stats_lock:
+        counters = dict(_stats)
+    return {
+        **counters,
+        "queue_depth": sum(len(room.pending) for room in rooms),
+        "in_flight": worker_limiter.in_flight,
+        "waiting_for_worker": worker_limiter.waiting,
+        "max_in_flight": worker_limiter.limit,
+    }
+
+
+class _Reply:
+    def __init__(self, texts):
+        self.texts = texts
+        self.created = time.monotonic()
+        self.speaking = False
+        self.handle = None
+        self.task = None
+
+
+class ChatIngress:
+    """Per-room chat queue; reply(text) makes the LLM request and returns the agent's SpeechHandle.
+
+    Call playout_started(handle) when the agent starts playing a speech.
+    """
+
+    def __init__(self, reply, room_name="", coalesce=None, max_wait=None, max_in_flight=None, max_pending=None):
+        self._reply = reply
+        self.room_name = room_name
+        # Seconds
+        self.coalesce = float(os.getenv("CHAT_COALESCE_MS", "400")) / 1000 if coalesce is None else coalesce
+        self.max_wait = float(os.getenv("CHAT_COALESCE_MAX_MS", "1500")) / 1000 if max_wait is None else max_wait
+        self.max_pending = max_pending or int(os.getenv("CHAT_MAX_PENDING", "20"))
+        self._slots = asyncio.Semaphore(max_in_flight or int(os.getenv("CHAT_MAX_IN_FLIGHT_PER_ROOM", "1")))
+        self.pending = []
+        self._first_pending_at = None
+        self._timer = None
+        self._replies = set()
+        _rooms.add(self)
+
+    def submit(self, text):
+        """Queue a message; it is answered once no other message follows within the coalescing window"""
+        _count("messages")
+        self.pending.append(text)
+        if len(self.pending) > self.max_pending:
+            self.pending.pop(0)
+            _count("dropped")
+            logger.warning(f"Chat queue full in {self.room_name}, dropped the oldest message")
+        now = time.monotonic()
+        if self._first_pending_at is None:
+            self._first_pending_at = now
+        if self._timer is not None:
+            self._timer.cancel()
+        delay = min(self.coalesce, self._first_pending_at + self.max_wait - now)
+        self._timer = asyncio.get_running_loop().call_later(max(0.0, delay), self.flush)
+
+    def playout_started(self, handle):
+        """The agent started playing a speech; once a reply's speech plays it is no longer superseded"""
+        for reply in self._replies:
+            if reply.handle is handle:
+                reply.speaking = True
+
+    def flush(self):
+        """Send the queued messages as one request, taking over those of replies not yet speaking"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._first_pending_at = None
+        if not self.pending:
+            return
+        texts = []
+        for reply in sorted(self._replies, key=lambda r: r.created):
+            if not reply.speaking:
+                reply.task.cancel()
+                # A queued speech still plays unless it is cancelled too
+                if reply.handle is not None:
+                    reply.handle.cancel()
+                self._replies.discard(reply)
+                texts.extend(reply.texts)
+                _count("superseded")
+        _count("coalesced", len(self.pending) - 1)
+        texts.extend(self.pending)
+        self.pending = []
+        reply = _Reply(texts)
+        reply.task = asyncio.create_task(self._run(reply))
+        self._replies.add(reply)
+
+    async def _run(self, reply):
+        try:
+            async with self._slots:
+                await worker_limiter.acquire()
+                try:
+                    _count("requests")
+                    reply.handle = await self._reply("\n".join(reply.texts))
+                    # Only queued for playout here; playout_started marks it as speaking
+                    await reply.handle.join()
+                finally:
+                    worker_limiter.release()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _count("failed")
+            logger.error(f"Chat reply failed in {self.room_name}: {e!r}")
+        finally:
+            self._replies.discard(reply)
+
+    async def aclose(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        tasks = [reply.task for reply in self._replies]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        _rooms.discard(self)
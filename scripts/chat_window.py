@@ -0,0 +1,188 @@
+"""Token-budgeted chat context for long calls.
+
+The agent's chat context would otherwise grow for the whole call, and every LLM
+request (and every copy the pipeline makes of it) would carry the full history.
+ChatWindow keeps it to the leading system messages, a running summary of the
+earlier conversation, and the most recent turns. Once the recent turns pass the
+budget, the oldest of them are summarized by a small model in the background
+and then replaced by the new summary, so a reply never waits for it.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from livekit.agents import llm
+
+logger = logging.getLogger("chat_window")
+logger.setLevel(logging.INFO)
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a phone call between a caller and a receptionist. "
+    "Given the summary so far and the next part of the transcript, write the updated summary. "
+    "Keep the caller's name, requests, and any details or commitments given to them. "
+    "Write plain sentences, at most {max_words} words."
+)
+SUMMARY_HEADER = "Summary of the call so far:\n"
+CHARS_PER_TOKEN = 4
+
+_stats = {"compactions": 0, "folded_messages": 0, "summary_failures": 0, "summary_ms_max": 0.0}
+# Calls in other job threads update the same counters
+_stats_lock = threading.Lock()
+
+
+def stats():
+    """Process-wide counters, for the health endpoint"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _count(name, n=1):
+    with _stats_lock:
+        _stats[name] += n
+
+
+def _text(message):
+    content = message.content
+    if isinstance(content, list):
+        return " ".join(part for part in content if isinstance(part, str))
+    return content or ""
+
+
+def estimate_tokens(message):
+    """Rough token count of a message: about four characters per token, plus the tool calls it carries"""
+    chars = len(_text(message))
+    for call in message.tool_calls or ():
+        chars += len(call.function_info.name) + len(call.raw_arguments or "")
+    return chars // CHARS_PER_TOKEN + 4
+
+
+class ChatWindow:
+    """Keeps a chat context within a token budget, folding older turns into a running summary.
+
+    The leading system messages of the context are the immutable prefix. They
+    stay first and are shared by reference by every prompt built from the
+    window, never copied.
+    """
+
+    def __init__(self, chat_ctx, summary_llm, room_name="", budget_tokens=None, keep_tokens=None, summary_words=None):
+        self.chat_ctx = chat_ctx
+        self.summary_llm = summary_llm
+        self.room_name = room_name
+        self.budget_tokens = budget_tokens or int(os.getenv("CHAT_CONTEXT_MAX_TOKENS", "3000"))
+        # After a compaction the recent turns fit in keep_tokens, so the next one is a while away
+        self.keep_tokens = keep_tokens or int(os.getenv("CHAT_CONTEXT_KEEP_TOKENS", str(self.budget_tokens // 2)))
+        self.summary_words = summary_words or int(os.getenv("CHAT_SUMMARY_WORDS", "150"))
+        self.summary_timeout = float(os.getenv("CHAT_SUMMARY_TIMEOUT", "20"))
+        self.prefix_len = 0
+        while self.prefix_len < len(chat_ctx.messages) and chat_ctx.messages[self.prefix_len].role == "system":
+            self.prefix_len += 1
+        self.summary = None
+        self._task = None
+
+    def attach(self, agent):
+        """Compact after each reply the agent commits to its chat context"""
+        agent.on("agent_speech_committed", lambda _: self.maybe_compact())
+        agent.on("agent_speech_interrupted", lambda _: self.maybe_compact())
+        return self
+
+    def _recent_start(self):
+        return self.prefix_len + (self.summary is not None)
+
+    def prompt(self, text):
+        """A chat context for one more user message, sharing this window's messages instead of copying them"""
+        return llm.ChatContext(messages=[*self.chat_ctx.messages, llm.ChatMessage.create(text=text, role="user")])
+
+    def maybe_compact(self):
+        """Start summarizing the oldest turns in the background if the recent ones are over budget"""
+        if self._task is not None and not self._task.done():
+            return
+        messages = self.chat_ctx.messages[self._recent_start():]
+        sizes = [estimate_tokens(message) for message in messages]
+        remaining = sum(sizes)
+        if remaining <= self.budget_tokens:
+            return
+        # Fold whole turns only, so a tool call is never separated from its result. The latest
+        # turn always stays verbatim, even when it alone is over keep_tokens
+        last_user = max((i for i, message in enumerate(messages) if message.role == "user"), default=0)
+        cut = 0
+        for i, size in enumerate(sizes):
+            if messages[i].role == "user" and (remaining <= self.keep_tokens or i == last_user):
+                break
+            remaining -= size
+            cut = i + 1
+        if cut == 0 or cut >= len(messages):
+            return
+        self._task = asyncio.create_task(self._compact(messages[:cut]))
+
+    async def _compact(self, folded):
+        started = time.perf_counter()
+        try:
+            summary = await asyncio.wait_for(self._summarize(folded), self.summary_timeout)
+        except Exception as e:
+            logger.warning(f"Chat summary failed in {self.room_name}, keeping a truncated transcript instead: {e!r}")
+            _count("summary_failures")
+            summary = self._fallback_summary(folded)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        # Messages may have been appended meanwhile; only the folded ones are removed
+        folded_ids = {id(message) for message in folded}
+        messages = self.chat_ctx.messages
+        summary_msg = llm.ChatMessage.create(text=SUMMARY_HEADER + summary, role="system")
+        messages[:] = [
+            *messages[:self.prefix_len],
+            summary_msg,
+            *(m for m in messages[self._recent_start():] if id(m) not in folded_ids),
+        ]
+        self.summary = summary
+        with _stats_lock:
+            _stats["compactions"] += 1
+            _stats["folded_messages"] += len(folded)
+            _stats["summary_ms_max"] = max(_stats["summary_ms_max"], round(elapsed_ms, 1))
+        logger.info(
+            f"Folded {len(folded)} messages into the summary for {self.room_name} in {elapsed_ms:.0f}ms, "
+            f"{len(messages)} messages left"
+        )
+
+    def _transcript(self, folded):
+        lines = []
+        for message in folded:
+            text = _text(message).strip()
+            if message.role == "tool":
+                lines.append(f"(looked up: {text})")
+            elif text and message.role in ("user", "assistant"):
+                lines.append(f"{'Caller' if message.role == 'user' else 'Receptionist'}: {text}")
+        return "\n".join(lines)
+
+    async def _summarize(self, folded):
+        request = llm.ChatContext().append(
+            role="system", text=SUMMARY_PROMPT.format(max_words=self.summary_words),
+        ).append(
+            role="user",
+            text=f"Summary so far:\n{self.summary or '(none)'}\n\nNext part of the call:\n{self._transcript(folded)}",
+        )
+        parts = []
+        stream = self.summary_llm.chat(chat_ctx=request)
+        try:
+            async for chunk in stream:
+                for choice in chunk.choices:
+                    if choice.delta.content:
+                        parts.append(choice.delta.content)
+        finally:
+            await stream.aclose()
+        summary = "".join(parts).strip()
+        if not summary:
+            raise ValueError("empty summary")
+        return summary
+
+    def _fallback_summary(self, folded):
+        """The previous summary and the folded transcript, keeping only the most recent part of it"""
+        text = f"{self.summary or ''}\n{self._transcript(folded)}".strip()
+        max_chars = self.summary_words * 6
+        return text if len(text) <= max_chars else "..." + text[-max_chars:]
+
+    async def aclose(self):
+        if self._task is not None:
+            self._task.cancel()
@@ -0,0 +1,151 @@
+"""Company information for the receptionist, indexed once at import for fast topic lookups"""
+
+import os
+import re
+import time
+from collections import defaultdict
+
+# Company information based on the website content, one markdown file per section
+KNOWLEDGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge")
+
+
+def join_lines(lines):
+    """Hard-wrapped lines as one line of text; a line ending in a hyphenated word ('voice-') joins the next without a space"""
+    text = ""
+    for line in lines:
+        line = " ".join(line.split())
+        if not line:
+            continue
+        if not text:
+            text = line
+        elif text.endswith("-") and text[-2:-1].isalnum():
+            text += line
+        else:
+            text += " " + line
+    return text
+
+
+def load_sections(knowledge_dir=KNOWLEDGE_DIR):
+    """Read each section file, keyed by its file name ('fortunes_told.md' -> 'fortunes told')"""
+    sections = {}
+    for name in sorted(os.listdir(knowledge_dir)):
+        if not name.endswith(".md"):
+            continue
+        with open(os.path.join(knowledge_dir, name), encoding="utf-8") as f:
+            lines = [line for line in f.read().splitlines() if not line.startswith("#")]
+        sections[name[:-3].replace("_", " ")] = join_lines(lines)
+    return sections
+
+
+DEFAULT_SECTION = "general"
+
+# Keyword (a word or short phrase) -> weight, per section.
+# Phrases outscore single words so "fortunes told" beats a stray "told".
+SECTION_KEYWORDS = {
+    "general": {
+        "company": 1, "studio": 1, "about": 1, "founder": 2, "founded": 2, "who": 1,
+        "history": 1, "lennon": 2, "david": 1, "background": 1, "overview": 1,
+    },
+    "fortunes told": {
+        "fortune": 2, "fortunes": 2, "fortunes told": 4, "book": 2, "books": 2, "tarot": 3,
+        "release": 1, "released": 1, "preorder": 2, "pre order": 3, "voyager": 3, "waterstones": 3,
+        "foyles": 3, "amazon": 2, "kindle": 2, "hardback": 2, "paperback": 2, "homeware": 2,
+        "companion app": 3, "app": 1, "nfc": 2, "june": 1, "blind box": 2, "merchandise": 1,
+    },
+    "ai research": {
+        "ai": 2, "research": 1, "ml": 2, "machine learning": 4, "storybook": 3, "llama": 3,
+        "model": 1, "models": 1, "screenwriter": 3, "writer": 1, "writers": 1, "technology": 1,
+        "tech": 1, "artificial intelligence": 4, "software": 1, "tools": 1,
+    },
+    "ethics": {
+        "ethic": 3, "ethics": 3, "ethical": 3, "sustainable": 3, "sustainability": 3,
+        "eula": 3, "attribution": 3, "jobs": 1, "replace": 1, "creators": 2, "compensation": 2,
+        "responsible": 2,
+    },
+    "animation": {
+        "animation": 3, "animations": 3, "animated": 3, "film": 2, "films": 2, "movie": 2,
+        "visual": 2, "storyboard": 2, "storyboarding": 2, "cartoon": 2,
+    },
+    "contact": {
+        "contact": 3, "email": 3, "e mail": 3, "phone": 2, "reach": 2, "website": 3, "github": 3,
+        "address": 2, "call back": 2, "get in touch": 3, "in touch": 3, "online": 1, "url": 2,
+    },
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """Lowercase word tokens, so 'ai' never matches inside 'email' or 'detail'"""
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _singular(token):
+    """'storyboards' -> 'storyboard', for plurals the keyword tables do not list"""
+    return token[:-1] if len(token) > 3 and token.endswith("s") and not token.endswith("ss") else token
+
+
+def _build_index(section_keywords):
+    """Map each keyword to the (section, weight) pairs it votes for"""
+    index = defaultdict(list)
+    for section, keywords in section_keywords.items():
+        for keyword, weight in keywords.items():
+            index[" ".join(tokenize(keyword))].append((section, weight))
+    return {keyword: tuple(entries) for keyword, entries in index.items()}
+
+
+def _max_phrase_len(index):
+    return max(len(keyword.split()) for keyword in index)
+
+
+SECTION_TEXT = load_sections()
+KEYWORD_INDEX = _build_index(SECTION_KEYWORDS)
+_MAX_PHRASE = _max_phrase_len(KEYWORD_INDEX)
+
+
+def score_topic(topic):
+    """Score every section for a topic in one pass over its tokens"""
+    tokens = tokenize(topic)
+    scores = {}
+    for n in range(1, _MAX_PHRASE + 1):
+        for i in range(len(tokens) - n + 1):
+            if n == 1:
+                entries = KEYWORD_INDEX.get(tokens[i]) or KEYWORD_INDEX.get(_singular(tokens[i]))
+            else:
+                entries = KEYWORD_INDEX.get(" ".join(tokens[i:i + n]))
+            if entries:
+                for section, weight in entries:
+                    scores[section] = scores.get(section, 0) + weight
+    return scores
+
+
+def lookup_sections(topic, max_sections=2):
+    """Return the best-scoring section keys for a topic, falling back to general info"""
+    scores = score_topic(topic)
+    if not scores:
+        return [DEFAULT_SECTION]
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    best = ranked[0][1]
+    # Keep runner-up sections only when they are nearly as relevant as the best match
+    return [section for section, score in ranked[:max_sections] if score >= best * 0.75]
+
+
+def lookup(topic, max_sections=2):
+    """Return the company information text for a topic"""
+    return "\n\n".join(SECTION_TEXT[section] for section in lookup_sections(topic, max_sections))
+
+
+if __name__ == "__main__":
+    # Microbenchmark: python company_knowledge.py
+    sample_topics = [
+        "fortunes told book", "when is the book released", "email address", "AI research",
+        "machine learning models", "ethics", "animation film", "contact details", "available formats",
+        "who founded the company", "something unrelated",
+    ]
+    iterations = 20000
+    for topic in sample_topics:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            lookup_sections(topic)
+        per_call_us = (time.perf_counter() - started) / iterations * 1e6
+        print(f"{topic!r:32} -> {lookup_sections(topic)!s:36} {per_call_us:6.2f}us/lookup")
@@ -0,0 +1,331 @@
+"""Deterministic stand-ins for the VAD, STT, LLM and TTS plugins.
+
+Every latency and streaming chunk size comes from a Profile, so two runs with
+the same profile and seed give the same timings. Jitter is opt-in and comes from
+a seeded generator. The plugins go through the real livekit base classes, so
+the voice pipeline, its metrics and the repo's wrappers (tts_cache.CachedTTS,
+latency_metrics.TurnTracker) all behave as they do with real providers.
+
+The entrypoints construct plugins without arguments (`openai.LLM()`), so per-call
+state is taken from the `current_call` context variable. Set it to a CallScript
+before the call's event loop starts.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import json
+import random
+import time
+from dataclasses import asdict, dataclass, field
+
+import numpy as np
+from livekit import rtc
+from livekit.agents import llm, stt, tts, utils, vad
+from livekit.agents.llm.function_context import _create_ai_function_info
+
+# Utterances below this RMS level count as silence
+SPEECH_RMS = 500.0
+
+
+@dataclass
+class Profile:
+    """Latencies in milliseconds and streaming chunk sizes of the fake providers"""
+
+    stt_final_ms: float = 150.0  # end of speech to final transcript
+    llm_ttft_ms: float = 350.0
+    llm_chars_per_s: float = 300.0
+    llm_chunk_chars: int = 12
+    tts_ttfb_ms: float = 250.0
+    tts_chunk_ms: int = 100
+    tts_rtf: float = 0.25  # synthesis time per second of audio
+    speech_words_per_s: float = 2.7
+    vad_min_silence_ms: float = 550.0
+    jitter: float = 0.0  # +/- fraction applied to every latency
+
+    def to_dict(self):
+        return asdict(self)
+
+
+@dataclass
+class Turn:
+    """One caller utterance and how the fake LLM answers it"""
+
+    text: str
+    samples: np.ndarray = None
+    tool: str | None = None  # topic for get_company_info, if the LLM should call it
+    reply: str | None = None
+    pause_s: float = 0.8
+
+
+@dataclass
+class CallScript:
+    """Per-call state shared by the fake plugins of one call"""
+
+    profile: Profile
+    turns: list
+    seed: int = 0
+    rng: random.Random = field(init=False)
+
+    def __post_init__(self):
+        self.rng = random.Random(self.seed)
+        self._next_transcript = 0
+        self._by_text = {turn.text: turn for turn in self.turns}
+
+    def delay(self, ms):
+        """A profile latency in seconds, with jitter if configured"""
+        if self.profile.jitter:
+            ms *= 1 + self.rng.uniform(-self.profile.jitter, self.profile.jitter)
+        return max(0.0, ms / 1000)
+
+    def next_transcript(self):
+        if self._next_transcript >= len(self.turns):
+            return ""
+        turn = self.turns[self._next_transcript]
+        self._next_transcript += 1
+        return turn.text
+
+    def turn_for(self, text):
+        return self._by_text.get(text)
+
+
+current_call = contextvars.ContextVar("current_call")
+
+DEFAULT_REPLY = (
+    "PI & Other Tales is a creative studio working on imaginative media and entertainment. "
+    "Fortunes Told comes out on June 19th, and you can pre-order it at Waterstones, Foyles and Amazon. "
+    "Is there anything else I can help you with?"
+)
+
+
+def _rms(frame):
+    samples = np.frombuffer(frame.data, dtype=np.int16)
+    return float(np.sqrt(np.mean(samples.astype(np.float32) ** 2))) if len(samples) else 0.0
+
+
+def _message_text(message):
+    if isinstance(message.content, str):
+        return message.content
+    if isinstance(message.content, list):
+        return " ".join(part for part in message.content if isinstance(part, str))
+    return "" if message.content is None else str(message.content)
+
+
+class FakeVAD(vad.VAD):
+    """Energy-threshold VAD with Silero's event pattern"""
+
+    def __init__(self, min_speech_ms=50.0, min_silence_ms=550.0):
+        super().__init__(capabilities=vad.VADCapabilities(update_interval=0.032))
+        self.min_speech = min_speech_ms / 1000
+        self.min_silence = min_silence_ms / 1000
+
+    def stream(self):
+        return _FakeVADStream(self)
+
+
+class _FakeVADStream(vad.VADStream):
+    async def _main_task(self):
+        speaking = False
+        speech = silence = 0.0
+        samples_index = 0
+        async for frame in self._input_ch:
+            if not isinstance(frame, rtc.AudioFrame):
+                continue
+            duration = frame.samples_per_channel / frame.sample_rate
+            samples_index += frame.samples_per_channel
+            voiced = _rms(frame) > SPEECH_RMS
+            if voiced:
+                speech += duration
+                silence = 0.0
+            else:
+                silence += duration
+                if not speaking:
+                    speech = 0.0
+
+            def event(type, **kwargs):
+                return vad.VADEvent(
+                    type=type, samples_index=samples_index, timestamp=time.time(),
+                    speech_duration=speech, silence_duration=silence, speaking=speaking, **kwargs,
+                )
+
+            self._event_ch.send_nowait(
+                event(vad.VADEventType.INFERENCE_DONE, probability=1.0 if voiced else 0.0, frames=[frame])
+            )
+            if not speaking and voiced and speech >= self._vad.min_speech:
+                speaking = True
+                self._event_ch.send_nowait(event(vad.VADEventType.START_OF_SPEECH))
+            elif speaking and silence >= self._vad.min_silence:
+                speaking = False
+                self._event_ch.send_nowait(event(vad.VADEventType.END_OF_SPEECH))
+                speech = 0.0
+
+
+class FakeSTT(stt.STT):
+    """Streaming STT that emits the script's next transcript a fixed delay after each utterance"""
+
+    def __init__(self, **_):
+        super().__init__(capabilities=stt.STTCapabilities(streaming=True, interim_results=False))
+        self._script = current_call.get()
+
+    async def _recognize_impl(self, buffer, *, language=None, conn_options=None):
+        await asyncio.sleep(self._script.delay(self._script.profile.stt_final_ms))
+        return _speech_event(stt.SpeechEventType.FINAL_TRANSCRIPT, self._script.next_transcript())
+
+    def stream(self, *, language=None, conn_options=None, **_):
+        from livekit.agents.types import DEFAULT_API_CONNECT_OPTIONS
+
+        return _FakeRecognizeStream(stt=self, conn_options=conn_options or DEFAULT_API_CONNECT_OPTIONS)
+
+
+def _speech_event(type, text=""):
+    alternatives = [stt.SpeechData(language="en", text=text, confidence=1.0)] if text else []
+    return stt.SpeechEvent(type=type, request_id=utils.shortuuid(), alternatives=alternatives)
+
+
+class _FakeRecognizeStream(stt.RecognizeStream):
+    # Silence after speech before the fake endpointer decides the utterance ended
+    ENDPOINT_S = 0.1
+
+    async def _run(self):
+        script = self._stt._script
+        speaking = False
+        silence = 0.0
+        pending = set()
+
+        async def finalize(delay):
+            await asyncio.sleep(delay)
+            text = script.next_transcript()
+            if text:
+                self._event_ch.send_nowait(_speech_event(stt.SpeechEventType.FINAL_TRANSCRIPT, text))
+            self._event_ch.send_nowait(_speech_event(stt.SpeechEventType.END_OF_SPEECH))
+
+        try:
+            async for frame in self._input_ch:
+                if not isinstance(frame, rtc.AudioFrame):
+                    continue
+                if _rms(frame) > SPEECH_RMS:
+                    silence = 0.0
+                    if not speaking:
+                        speaking = True
+                        self._event_ch.send_nowait(_speech_event(stt.SpeechEventType.START_OF_SPEECH))
+                    continue
+                silence += frame.samples_per_channel / frame.sample_rate
+                if speaking and silence >= self.ENDPOINT_S:
+                    speaking = False
+                    # The final transcript lands stt_final_ms after the speech actually ended
+                    delay = max(0.0, script.delay(script.profile.stt_final_ms) - silence)
+                    task = asyncio.create_task(finalize(delay))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending)
+        finally:
+            await utils.aio.gracefully_cancel(*pending)
+
+
+class FakeLLM(llm.LLM):
+    """Streams the scripted reply, or calls get_company_info first for turns with a tool topic"""
+
+    def __init__(self, **_):
+        super().__init__()
+        self._script = current_call.get()
+
+    def chat(self, *, chat_ctx, conn_options=None, fnc_ctx=None, **_):
+        from livekit.agents.types import DEFAULT_API_CONNECT_OPTIONS
+
+        return _FakeLLMStream(
+            self, chat_ctx=chat_ctx, fnc_ctx=fnc_ctx, conn_options=conn_options or DEFAULT_API_CONNECT_OPTIONS,
+        )
+
+
+class _FakeLLMStream(llm.LLMStream):
+    async def _run(self):
+        script = self._llm._script
+        profile = script.profile
+        request_id = utils.shortuuid()
+        messages = self._chat_ctx.messages
+        last = messages[-1] if messages else None
+        turn = None
+        for message in reversed(messages):
+            if message.role == "user":
+                turn = script.turn_for(_message_text(message))
+                break
+        prompt_chars = sum(len(_message_text(m)) for m in messages)
+
+        await asyncio.sleep(script.delay(profile.llm_ttft_ms))
+        if (
+            turn is not None and turn.tool and self._fnc_ctx is not None
+            and last is not None and last.role == "user"
+            and "get_company_info" in self._fnc_ctx.ai_functions
+        ):
+            call = _create_ai_function_info(
+                self._fnc_ctx, f"call_{request_id}", "get_company_info", json.dumps({"topic": turn.tool}),
+            )
+            self._function_calls_info.append(call)
+            self._event_ch.send_nowait(llm.ChatChunk(
+                request_id=request_id,
+                choices=[llm.Choice(delta=llm.ChoiceDelta(role="assistant", tool_calls=[call]))],
+            ))
+            return
+
+        reply = (turn.reply if turn is not None and turn.reply else None) or DEFAULT_REPLY
+        chunk_chars = max(1, profile.llm_chunk_chars)
+        for start in range(0, len(reply), chunk_chars):
+            if start:
+                await asyncio.sleep(chunk_chars / profile.llm_chars_per_s)
+            self._event_ch.send_nowait(llm.ChatChunk(
+                request_id=request_id,
+                choices=[llm.Choice(delta=llm.ChoiceDelta(role="assistant", content=reply[start:start + chunk_chars]))],
+            ))
+        completion_tokens = len(reply) // 4
+        prompt_tokens = prompt_chars // 4
+        self._event_ch.send_nowait(llm.ChatChunk(
+            request_id=request_id,
+            usage=llm.CompletionUsage(
+                completion_tokens=completion_tokens,
+                prompt_tokens=prompt_tokens,
+                total_tokens=completion_tokens + prompt_tokens,
+            ),
+        ))
+
+
+class FakeTTS(tts.TTS):
+    """Non-streaming TTS, like openai.TTS: audio arrives in chunks after a time to first byte"""
+
+    SAMPLE_RATE = 24000
+
+    def __init__(self, **_):
+        super().__init__(
+            capabilities=tts.TTSCapabilities(streaming=False), sample_rate=self.SAMPLE_RATE, num_channels=1,
+        )
+        self._script = current_call.get()
+        profile = self._script.profile
+        self._opts = type("Opts", (), {"voice": "fake", "model": f"fake-{profile.tts_chunk_ms}ms"})()
+        chunk_samples = self.SAMPLE_RATE * profile.tts_chunk_ms // 1000
+        t = np.arange(chunk_samples) / self.SAMPLE_RATE
+        self._chunk = (np.sin(2 * np.pi * 220 * t) * 3000).astype(np.int16).tobytes()
+
+    def synthesize(self, text, *, conn_options=None):
+        return _FakeChunkedStream(tts=self, input_text=text, conn_options=conn_options)
+
+
+class _FakeChunkedStream(tts.ChunkedStream):
+    async def _run(self):
+        script = self._tts._script
+        profile = script.profile
+        request_id = utils.shortuuid()
+        words = max(1, len(self.input_text.split()))
+        chunks = max(1, round(words / profile.speech_words_per_s * 1000 / profile.tts_chunk_ms))
+        chunk_samples = self._tts.SAMPLE_RATE * profile.tts_chunk_ms // 1000
+        await asyncio.sleep(script.delay(profile.tts_ttfb_ms))
+        for i in range(chunks):
+            if i:
+                await asyncio.sleep(profile.tts_chunk_ms / 1000 * profile.tts_rtf)
+            self._event_ch.send_nowait(tts.SynthesizedAudio(
+                request_id=request_id,
+                frame=rtc.AudioFrame(
+                    data=self._tts._chunk, sample_rate=self._tts.SAMPLE_RATE,
+                    num_channels=1, samples_per_channel=chunk_samples,
+                ),
+            ))
@@ -0,0 +1,430 @@
+"""In-process stand-ins for a LiveKit room and job, for running agent entrypoints offline.
+
+FakeJobContext has the parts of JobContext that the entrypoints use. It carries
+a FakeRoom that accepts track publications and transcriptions without any
+network. A Caller joins the room as a SIP participant and streams 16 kHz audio
+at real-time pace: silence, with utterances queued by the driver. The agent
+reads that audio through a stand-in for rtc.AudioStream. The agent's own output
+goes through a real rtc.AudioSource, which plays out locally at real-time pace,
+so audio timing matches a real call.
+
+Call install() once before starting the agent, so that the voice pipeline and
+the realtime agent read caller audio from FakeAudioStream instead of
+subscribing through the SFU.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+import types
+import wave
+
+import numpy as np
+from livekit import rtc
+from livekit.rtc._proto import participant_pb2
+from livekit.agents import utils
+
+logger = logging.getLogger("fake_room")
+logger.setLevel(logging.INFO)
+
+SAMPLE_RATE = 16000
+FRAME_MS = 10
+FRAME_SAMPLES = SAMPLE_RATE * FRAME_MS // 1000
+
+
+class FakeAudioTrack:
+    """A caller's microphone track; frames are fed to it by the Caller"""
+
+    def __init__(self, sid):
+        self.sid = sid
+        self.name = "microphone"
+        self.kind = rtc.TrackKind.KIND_AUDIO
+        self.source = rtc.TrackSource.SOURCE_MICROPHONE
+        self._queues = []
+
+    def _subscribe(self):
+        queue = asyncio.Queue()
+        self._queues.append(queue)
+        return queue
+
+    def _unsubscribe(self, queue):
+        if queue in self._queues:
+            self._queues.remove(queue)
+
+    def push(self, frame):
+        for queue in self._queues:
+            queue.put_nowait(frame)
+
+
+class FakeAudioStream:
+    """Replaces rtc.AudioStream for FakeAudioTracks; real tracks get the real stream"""
+
+    def __new__(cls, track, *args, **kwargs):
+        if not isinstance(track, FakeAudioTrack):
+            return _real_audio_stream(track, *args, **kwargs)
+        return super().__new__(cls)
+
+    def __init__(self, track, sample_rate=SAMPLE_RATE, num_channels=1, **_):
+        if num_channels != 1:
+            raise ValueError("fake tracks carry mono audio")
+        self._track = track
+        self._queue = track._subscribe()
+        # The SFU resamples for subscribers; the realtime agent reads 24 kHz
+        self._resampler = rtc.AudioResampler(SAMPLE_RATE, sample_rate) if sample_rate != SAMPLE_RATE else None
+        self._ready = []
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._ready:
+            frame = await self._queue.get()
+            if frame is None:
+                raise StopAsyncIteration
+            if self._resampler is None:
+                return rtc.AudioFrameEvent(frame=frame)
+            self._ready.extend(self._resampler.push(frame))
+        return rtc.AudioFrameEvent(frame=self._ready.pop(0))
+
+    async def aclose(self):
+        self._track._unsubscribe(self._queue)
+        self._queue.put_nowait(None)
+
+
+_real_audio_stream = rtc.AudioStream
+
+
+def install():
+    """Route the agents' microphone subscriptions through FakeAudioStream"""
+    from livekit.agents.multimodal import multimodal_agent
+    from livekit.agents.pipeline import human_input
+
+    patched = types.SimpleNamespace(**{name: getattr(rtc, name) for name in dir(rtc) if not name.startswith("__")})
+    patched.AudioStream = FakeAudioStream
+    for module in (human_input, multimodal_agent):
+        if not isinstance(module.rtc, types.SimpleNamespace):
+            module.rtc = patched
+
+
+class FakeTrackPublication:
+    def __init__(self, track, source):
+        self.sid = track.sid
+        self.track = track
+        self.source = source
+        self.kind = rtc.TrackKind.KIND_AUDIO
+        self.subscribed = True
+
+    def set_subscribed(self, subscribed):
+        self.subscribed = subscribed
+
+    async def wait_for_subscription(self):
+        # The caller's SIP leg subscribes to the agent's track as soon as it is published
+        pass
+
+
+class FakeRemoteParticipant(rtc.RemoteParticipant):
+    """A SIP participant; a real RemoteParticipant, minus the native handle"""
+
+    def __init__(self, identity, name="", attributes=None):
+        self._info = participant_pb2.ParticipantInfo(
+            sid=f"PA_{identity}", identity=identity, name=name,
+            kind=rtc.ParticipantKind.PARTICIPANT_KIND_SIP, attributes=attributes or {},
+        )
+        self._connection_quality = None
+        self._track_publications = {}
+
+
+class FakeLocalParticipant:
+    def __init__(self, identity):
+        self.identity = identity
+        self.sid = f"PA_{identity}"
+        self.attributes = {}
+        self.track_publications = {}
+        self.transcriptions = 0
+
+    async def publish_track(self, track, options=None):
+        publication = FakeTrackPublication(track, getattr(options, "source", rtc.TrackSource.SOURCE_UNKNOWN))
+        publication.sid = f"TR_{self.identity}_{len(self.track_publications)}"
+        self.track_publications[publication.sid] = publication
+        return publication
+
+    async def publish_transcription(self, transcription):
+        self.transcriptions += 1
+
+    async def set_attributes(self, attributes):
+        self.attributes.update(attributes)
+
+    async def publish_data(self, payload, **_):
+        pass
+
+
+class FakeRoom(rtc.EventEmitter):
+    """Enough of rtc.Room for the agents: participants, events, publications and text streams"""
+
+    def __init__(self, name, agent_identity="agent"):
+        super().__init__()
+        self.name = name
+        self.sid = f"RM_{name}"
+        self.metadata = ""
+        self.local_participant = FakeLocalParticipant(agent_identity)
+        self.remote_participants = {}
+        self.connection_state = rtc.ConnectionState.CONN_DISCONNECTED
+        self._text_stream_handlers = {}
+
+    def isconnected(self):
+        return self.connection_state == rtc.ConnectionState.CONN_CONNECTED
+
+    def register_text_stream_handler(self, topic, handler):
+        if topic in self._text_stream_handlers:
+            raise ValueError(f"text stream handler for topic '{topic}' already set")
+        self._text_stream_handlers[topic] = handler
+
+    def unregister_text_stream_handler(self, topic):
+        self._text_stream_handlers.pop(topic, None)
+
+    def send_chat(self, text, participant_identity):
+        """Deliver a chat message to the agent as if a participant typed it"""
+        handler = self._text_stream_handlers.get("lk.chat")
+        if handler is not None:
+            handler(_FakeTextReader(text), participant_identity)
+
+    def add_participant(self, participant):
+        self.remote_participants[participant.identity] = participant
+        self.emit("participant_connected", participant)
+
+    def publish_remote_track(self, participant, track):
+        publication = FakeTrackPublication(track, track.source)
+        participant.track_publications[publication.sid] = publication
+        self.emit("track_published", publication, participant)
+        self.emit("track_subscribed", track, publication, participant)
+        return publication
+
+    def remove_participant(self, identity):
+        participant = self.remote_participants.pop(identity, None)
+        if participant is not None:
+            self.emit("participant_disconnected", participant)
+
+    async def disconnect(self):
+        if self.isconnected():
+            self.connection_state = rtc.ConnectionState.CONN_DISCONNECTED
+            self.emit("disconnected", rtc.DisconnectReason.CLIENT_INITIATED)
+
+
+class _FakeTextReader:
+    def __init__(self, text):
+        self._text = text
+
+    async def read_all(self):
+        return self._text
+
+
+class FakeJobProcess:
+    def __init__(self, userdata=None):
+        self.pid = 0
+        self.userdata = userdata if userdata is not None else {}
+
+
+class FakeJobContext:
+    """The subset of JobContext used by the entrypoints, backed by a FakeRoom"""
+
+    def __init__(self, room_name, proc=None, metadata=None, connect_latency=0.0):
+        self.room = FakeRoom(room_name)
+        self.proc = proc or FakeJobProcess()
+        self.job = types.SimpleNamespace(
+            id=f"AJ_{room_name}",
+            metadata=json.dumps(metadata) if metadata is not None else "",
+            room=types.SimpleNamespace(name=room_name, sid=self.room.sid),
+        )
+        self.connect_latency = connect_latency
+        self.shutdown_reason = None
+        self._shutdown_callbacks = []
+        self._shutdown = asyncio.Event()
+
+    @property
+    def agent(self):
+        return self.room.local_participant
+
+    def add_shutdown_callback(self, callback):
+        self._shutdown_callbacks.append(callback)
+
+    async def connect(self, auto_subscribe=None, **_):
+        await asyncio.sleep(self.connect_latency)
+        self.room.connection_state = rtc.ConnectionState.CONN_CONNECTED
+        self.room.emit("connected")
+
+    async def wait_for_participant(self, *, identity=None, kind=None):
+        while True:
+            for participant in self.room.remote_participants.values():
+                if identity is None or participant.identity == identity:
+                    return participant
+            fut = asyncio.get_running_loop().create_future()
+
+            def _on_connected(participant, fut=fut):
+                if not fut.done():
+                    fut.set_result(participant)
+
+            self.room.on("participant_connected", _on_connected)
+            try:
+                await fut
+            finally:
+                self.room.off("participant_connected", _on_connected)
+
+    def shutdown(self, reason=""):
+        self.shutdown_reason = reason
+        self._shutdown.set()
+
+    async def wait_for_shutdown(self):
+        await self._shutdown.wait()
+
+    async def run_shutdown_callbacks(self):
+        """What the job executor does once the job ends: run each callback, logging failures"""
+        await self.room.disconnect()
+        for callback in self._shutdown_callbacks:
+            try:
+                await callback()
+            except Exception:
+                logger.exception(f"Shutdown callback failed in room {self.room.name}")
+
+
+def load_wav(path):
+    """16 kHz mono int16 samples from a WAV file, resampled and downmixed as needed"""
+    with wave.open(path, "rb") as f:
+        if f.getsampwidth() != 2:
+            raise ValueError(f"{path}: only 16-bit PCM WAV files are supported")
+        channels, rate = f.getnchannels(), f.getframerate()
+        samples = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    if rate != SAMPLE_RATE:
+        positions = np.arange(0, len(samples), rate / SAMPLE_RATE)
+        samples = np.interp(positions, np.arange(len(samples)), samples)
+    return samples.astype(np.int16)
+
+
+def synthetic_speech(seconds, seed=0):
+    """Noise shaped into syllable-like bursts, loud enough for an energy-based VAD"""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * SAMPLE_RATE)
+    t = np.arange(n) / SAMPLE_RATE
+    envelope = 0.55 + 0.45 * np.sin(2 * np.pi * 4.0 * t)
+    return (rng.normal(0, 2500, n) * envelope).clip(-32768, 32767).astype(np.int16)
+
+
+def voiced_speech(seconds, seed=0):
+    """A buzzing voice with vowel-like formants, which a model VAD such as Silero takes for speech"""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * SAMPLE_RATE)
+    t = np.arange(n) / SAMPLE_RATE
+    # Sawtooth glottal source around 120 Hz
+    f0 = 120 + 20 * np.sin(2 * np.pi * 0.7 * t)
+    source = (np.cumsum(f0 / SAMPLE_RATE) % 1.0) * 2 - 1
+    out = np.zeros(n)
+    syllable = int(0.2 * SAMPLE_RATE)
+    freqs = np.fft.rfftfreq(syllable, 1 / SAMPLE_RATE)
+    for i in range(0, n, syllable):
+        segment = source[i:i + syllable]
+        segment = np.pad(segment, (0, syllable - len(segment)))
+        f1, f2 = [(700, 1200), (300, 2300), (500, 900), (400, 2000)][rng.integers(4)]
+        shape = sum(np.exp(-0.5 * ((freqs - f) / bw) ** 2) for f, bw in ((f1, 80), (f2, 100), (2600, 150)))
+        out[i:i + syllable] = np.fft.irfft(np.fft.rfft(segment) * shape, syllable)[:n - i]
+    out *= 0.55 + 0.45 * np.sin(2 * np.pi * 4.0 * t)
+    return (out / max(np.abs(out).max(), 1e-9) * 8000).astype(np.int16)
+
+
+def frames_of(samples):
+    """Split samples into FRAME_MS frames, padding the last one with silence"""
+    pad = -len(samples) % FRAME_SAMPLES
+    if pad:
+        samples = np.concatenate([samples, np.zeros(pad, dtype=np.int16)])
+    return [
+        rtc.AudioFrame(
+            data=samples[i:i + FRAME_SAMPLES].tobytes(),
+            sample_rate=SAMPLE_RATE,
+            num_channels=1,
+            samples_per_channel=FRAME_SAMPLES,
+        )
+        for i in range(0, len(samples), FRAME_SAMPLES)
+    ]
+
+
+_SILENCE = None
+
+
+def _silence_frame():
+    global _SILENCE
+    if _SILENCE is None:
+        _SILENCE = frames_of(np.zeros(FRAME_SAMPLES, dtype=np.int16))[0]
+    return _SILENCE
+
+
+class Caller:
+    """A SIP caller: joins the room and streams microphone audio at real-time pace.
+
+    Silence is sent between utterances, as a phone line does. Frames the loop was
+    too busy to send on time are counted as late; frames that fall more than
+    `max_lag` behind are dropped to catch up, like a jitter buffer would.
+    """
+
+    def __init__(self, room, identity, max_lag=0.2):
+        self.room = room
+        self.identity = identity
+        self.max_lag = max_lag
+        self.participant = FakeRemoteParticipant(identity, name="Caller")
+        self.track = FakeAudioTrack(f"TR_{identity}_mic")
+        self.frames_sent = 0
+        self.frames_late = 0
+        self.frames_dropped = 0
+        self._pending = []
+        self._done = {}
+        self._task = None
+
+    def join(self):
+        self.room.add_participant(self.participant)
+        self.room.publish_remote_track(self.participant, self.track)
+        self._task = asyncio.create_task(self._stream(), name=f"caller_audio:{self.identity}")
+
+    async def say(self, samples):
+        """Queue an utterance; returns the time.perf_counter() at which its last frame was sent"""
+        done = asyncio.get_running_loop().create_future()
+        frames = frames_of(samples)
+        self._done[id(frames)] = done
+        self._pending.append(frames)
+        return await done
+
+    async def _stream(self):
+        interval = FRAME_MS / 1000
+        next_at = time.perf_counter()
+        current, index = None, 0
+        while True:
+            now = time.perf_counter()
+            behind = now - next_at
+            if behind > self.max_lag:
+                skipped = int(behind / interval)
+                self.frames_dropped += skipped
+                next_at += skipped * interval
+            elif behind > interval:
+                self.frames_late += 1
+            if current is None and self._pending:
+                current, index = self._pending.pop(0), 0
+            if current is not None:
+                self.track.push(current[index])
+                index += 1
+                if index == len(current):
+                    done = self._done.pop(id(current))
+                    if not done.done():
+                        done.set_result(time.perf_counter())
+                    current = None
+            else:
+                self.track.push(_silence_frame())
+            self.frames_sent += 1
+            next_at += interval
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+
+    async def hang_up(self):
+        if self._task is not None:
+            await utils.aio.gracefully_cancel(self._task)
+        self.track.push(None)
+        self.room.remove_participant(self.identity)
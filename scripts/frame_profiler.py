@@ -0,0 +1,365 @@
+"""Opt-in per-call profiling of the audio frame path (AGENT_PROFILE=1).
+
+Wraps the stages each audio frame goes through and records, per stage:
+
+- processing time per frame or call, as an HDR histogram
+- bytes of audio or text passed in and out
+- net memory allocated by every Nth call, measured with tracemalloc
+
+tracemalloc and the timing of published frames are process-wide, so they are
+only switched on while at least one call is being profiled.
+
+vad.push_frame, stt.push_frame and tts.push_text are the caller's side of each
+stream, vad.inference is Silero's own inference time, and tts.frame is the wait
+for each synthesized frame. publish.capture_frame copies outgoing audio to the
+room, and includes waiting while the room's playout queue is full. The realtime
+agent has no local VAD, STT or TTS, so realtime.push_audio (base64 encoding of
+caller audio) and realtime.audio_delta (decoding of model audio) are profiled
+instead.
+
+A sampler thread also records the job thread's Python stack every
+AGENT_PROFILE_INTERVAL_MS. When the job shuts down, the samples are written to
+AGENT_PROFILE_DIR as <room>-<time>.folded, in the folded format read by
+flamegraph.pl and speedscope, next to a .json file with the stage statistics and
+the top allocation sites.
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from livekit import rtc
+from livekit.agents import stt, tts, vad
+
+from latency_metrics import LatencyHistogram
+
+logger = logging.getLogger("frame_profiler")
+logger.setLevel(logging.INFO)
+
+ENABLED = os.getenv("AGENT_PROFILE", "0") == "1"
+PROFILE_DIR = os.getenv("AGENT_PROFILE_DIR", "profiles")
+
+# The profile of the call whose task is running, for stages shared by every call in the process
+_current = contextvars.ContextVar("frame_profile", default=None)
+# Profiled calls in progress; the process-wide hooks are installed while there are any
+_active = 0
+_install_lock = threading.Lock()
+# Undoes the hooks, last installed first
+_restore = []
+
+
+def _nbytes(frames):
+    if isinstance(frames, rtc.AudioFrame):
+        return frames.data.nbytes
+    return sum(frame.data.nbytes for frame in frames)
+
+
+class StageStats:
+    def __init__(self):
+        self.time = LatencyHistogram()
+        self.bytes = 0
+        self.alloc_samples = 0
+        self.alloc_bytes = 0
+
+    def snapshot(self):
+        return {
+            "calls": self.time.count,
+            "total_ms": round(self.time.total * 1000, 2),
+            **{f"{k}_us": round(v * 1e6, 1) for k, v in self.time.snapshot().items() if k != "count"},
+            "bytes": self.bytes,
+            "alloc_sampled_calls": self.alloc_samples,
+            "alloc_bytes_per_call": round(self.alloc_bytes / self.alloc_samples) if self.alloc_samples else None,
+        }
+
+
+class StackSampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval into folded-stack counts"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name="frame-profiler-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                # A function's first line rather than the current one, so its samples merge into one frame
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class CallProfile:
+    """Stage statistics and stack samples for one call"""
+
+    def __init__(self, room_name, thread_id=None, interval=None, alloc_every=None):
+        self.room_name = room_name
+        self.alloc_every = alloc_every or int(os.getenv("AGENT_PROFILE_ALLOC_EVERY", "50"))
+        self.started_at = time.time()
+        self.stages = {}
+        self.sampler = StackSampler(
+            thread_id or threading.get_ident(),
+            interval or float(os.getenv("AGENT_PROFILE_INTERVAL_MS", "10")) / 1000,
+        )
+        self.sampler.start()
+
+    def _stage(self, stage):
+        stats = self.stages.get(stage)
+        if stats is None:
+            stats = self.stages[stage] = StageStats()
+        return stats
+
+    def record(self, stage, seconds, nbytes=0):
+        stats = self._stage(stage)
+        stats.time.record(seconds)
+        stats.bytes += nbytes
+
+    def call(self, stage, nbytes, fn, *args):
+        """Run fn(*args), timing it, and every alloc_every-th call measuring what it allocated"""
+        stats = self._stage(stage)
+        sample = tracemalloc.is_tracing() and stats.time.count % self.alloc_every == 0
+        if sample:
+            before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            stats.time.record(time.perf_counter() - started)
+            stats.bytes += nbytes
+            if sample:
+                stats.alloc_samples += 1
+                stats.alloc_bytes += max(0, tracemalloc.get_traced_memory()[0] - before)
+
+    def snapshot(self):
+        return {
+            "room": self.room_name,
+            "started_at": self.started_at,
+            "duration_s": round(time.time() - self.started_at, 1),
+            "stack_samples": sum(self.sampler.stacks.values()),
+            "stages": {stage: stats.snapshot() for stage, stats in sorted(self.stages.items())},
+        }
+
+    def dump(self, directory=None):
+        """Write <room>-<time>.folded and .json; returns the path prefix"""
+        directory = directory or PROFILE_DIR
+        os.makedirs(directory, exist_ok=True)
+        prefix = os.path.join(directory, f"{self.room_name}-{time.strftime('%Y%m%d-%H%M%S')}")
+        with open(prefix + ".folded", "w", encoding="utf-8") as f:
+            for stack, count in self.sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        report = self.snapshot()
+        if tracemalloc.is_tracing():
+            # Allocation sites of the whole process; calls share the interpreter
+            top = tracemalloc.take_snapshot().statistics("lineno")[:20]
+            report["top_allocations"] = [
+                {"site": str(stat.traceback), "kib": round(stat.size / 1024, 1), "blocks": stat.count} for stat in top
+            ]
+        with open(prefix + ".json", "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        return prefix
+
+    async def aclose(self):
+        self.sampler.stop()
+        try:
+            prefix = await asyncio.to_thread(self.dump)
+        finally:
+            _release()
+        logger.info(f"Wrote frame profile for {self.room_name} to {prefix}.folded/.json")
+
+
+def _install():
+    """Process-wide hooks: tracemalloc, and timing of every frame published to a room"""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(int(os.getenv("AGENT_PROFILE_TRACEMALLOC_DEPTH", "1")))
+        _restore.append(tracemalloc.stop)
+    capture_frame = rtc.AudioSource.capture_frame
+
+    async def profiled_capture_frame(self, frame):
+        profile = _current.get()
+        if profile is None:
+            return await capture_frame(self, frame)
+        started = time.perf_counter()
+        try:
+            return await capture_frame(self, frame)
+        finally:
+            profile.record("publish.capture_frame", time.perf_counter() - started, frame.data.nbytes)
+
+    rtc.AudioSource.capture_frame = profiled_capture_frame
+    _restore.append(lambda: setattr(rtc.AudioSource, "capture_frame", capture_frame))
+
+
+def _acquire():
+    global _active
+    with _install_lock:
+        _active += 1
+        if _active == 1:
+            _install()
+
+
+def _release():
+    """Once the last profiled call has ended, stop tracemalloc and restore the patched methods"""
+    global _active
+    with _install_lock:
+        _active -= 1
+        if _active == 0:
+            while _restore:
+                _restore.pop()()
+
+
+def start(ctx):
+    """Profile this call if AGENT_PROFILE=1; returns None otherwise. The profile is written on shutdown."""
+    if not ENABLED:
+        return None
+    _acquire()
+    profile = CallProfile(ctx.room.name)
+    # Tasks the agent creates from here on inherit the profile
+    _current.set(profile)
+    ctx.add_shutdown_callback(profile.aclose)
+    logger.info(f"Profiling audio frames for {ctx.room.name}")
+    return profile
+
+
+class _ProfiledStream:
+    """Forwards to a VAD, STT or TTS stream, timing what passes through it"""
+
+    def __init__(self, stream, profile, stage):
+        self._stream = stream
+        self._profile = profile
+        self._stage = stage
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def push_frame(self, frame):
+        self._profile.call(f"{self._stage}.push_frame", frame.data.nbytes, self._stream.push_frame, frame)
+
+    def push_text(self, text):
+        self._profile.call(f"{self._stage}.push_text", len(text.encode()), self._stream.push_text, text)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        started = time.perf_counter()
+        ev = await self._stream.__anext__()
+        waited = time.perf_counter() - started
+        if isinstance(ev, vad.VADEvent):
+            if ev.type == vad.VADEventType.INFERENCE_DONE:
+                self._profile.record("vad.inference", ev.inference_duration, _nbytes(ev.frames))
+        elif isinstance(ev, tts.SynthesizedAudio):
+            self._profile.record("tts.frame", waited, ev.frame.data.nbytes)
+        return ev
+
+    async def aclose(self):
+        await self._stream.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+
+class ProfiledVAD(vad.VAD):
+    def __init__(self, wrapped, profile):
+        super().__init__(capabilities=wrapped.capabilities)
+        self._wrapped = wrapped
+        self._profile = profile
+        wrapped.on("metrics_collected", lambda m: self.emit("metrics_collected", m))
+
+    def stream(self):
+        return _ProfiledStream(self._wrapped.stream(), self._profile, "vad")
+
+
+class ProfiledSTT(stt.STT):
+    def __init__(self, wrapped, profile):
+        super().__init__(capabilities=wrapped.capabilities)
+        self._wrapped = wrapped
+        self._profile = profile
+        wrapped.on("metrics_collected", lambda m: self.emit("metrics_collected", m))
+
+    async def _recognize_impl(self, buffer, *, language, conn_options):
+        return await self._wrapped.recognize(buffer, language=language, conn_options=conn_options)
+
+    async def recognize(self, buffer, *, language=None, **kwargs):
+        # The wrapped STT reports its own metrics, so the base class's recognize is bypassed
+        started = time.perf_counter()
+        try:
+            return await self._wrapped.recognize(buffer, language=language, **kwargs)
+        finally:
+            self._profile.record("stt.recognize", time.perf_counter() - started, _nbytes(buffer))
+
+    def stream(self, *, language=None, **kwargs):
+        return _ProfiledStream(self._wrapped.stream(language=language, **kwargs), self._profile, "stt")
+
+    async def aclose(self):
+        await self._wrapped.aclose()
+
+
+class ProfiledTTS(tts.TTS):
+    def __init__(self, wrapped, profile):
+        super().__init__(
+            capabilities=wrapped.capabilities, sample_rate=wrapped.sample_rate, num_channels=wrapped.num_channels,
+        )
+        self._wrapped = wrapped
+        self._profile = profile
+        wrapped.on("metrics_collected", lambda m: self.emit("metrics_collected", m))
+
+    def synthesize(self, text, **kwargs):
+        self._profile.record("tts.synthesize_text", 0.0, len(text.encode()))
+        return _ProfiledStream(self._wrapped.synthesize(text, **kwargs), self._profile, "tts")
+
+    def stream(self, **kwargs):
+        return _ProfiledStream(self._wrapped.stream(**kwargs), self._profile, "tts")
+
+    def prewarm(self):
+        self._wrapped.prewarm()
+
+    async def aclose(self):
+        await self._wrapped.aclose()
+
+
+def wrap_vad(vad_, profile):
+    return vad_ if profile is None else ProfiledVAD(vad_, profile)
+
+
+def wrap_stt(stt_, profile):
+    return stt_ if profile is None else ProfiledSTT(stt_, profile)
+
+
+def wrap_tts(tts_, profile):
+    return tts_ if profile is None else ProfiledTTS(tts_, profile)
+
+
+def profile_realtime_session(session, profile):
+    """Time the realtime session's encoding of caller audio and decoding of model audio"""
+    if profile is None:
+        return
+    push_audio = session._push_audio
+    handle_audio_delta = session._handle_response_audio_delta
+
+    def profiled_push_audio(frame):
+        profile.call("realtime.push_audio", frame.data.nbytes, push_audio, frame)
+
+    def profiled_audio_delta(event):
+        profile.call("realtime.audio_delta", len(event["delta"]), handle_audio_delta, event)
+
+    # The agent and the session's receive loop look these up on the instance
+    session._push_audio = profiled_push_audio
+    session._handle_response_audio_delta = profiled_audio_delta
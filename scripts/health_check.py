@@ -1,45 +1,182 @@
-import http.server
-import socketserver
-import threading
-import logging
-import os
-
-# Configure logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger("health_check")
-
-# Get port from environment variable or use default
-PORT = int(os.environ.get("PORT", 8080))
-
-class HealthCheckHandler(http.server.SimpleHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == '/health' or self.path == '/':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/plain')
-            self.end_headers()
-            self.wfile.write(b'OK')
-        else:
-            self.send_response(404)
-            self.send_header('Content-type', 'text/plain')
-            self.end_headers()
-            self.wfile.write(b'Not Found')
-    
-    def log_message(self, format, *args):
-        logger.info("%s - - [%s] %s" % (self.client_address[0], self.log_date_time_string(), format % args))
-
-def start_health_server():
-    handler = HealthCheckHandler
-    with socketserver.TCPServer(("", PORT), handler) as httpd:
-        logger.info(f"Health check server started at port {PORT}")
-        httpd.serve_forever()
-
-def run_health_server():
-    # Start the health check server in a separate thread
-    health_thread = threading.Thread(target=start_health_server, daemon=True)
-    health_thread.start()
-    return health_thread
-
-# Allow direct execution
-if __name__ == "__main__":
-    # Start the health server directly
-    start_health_server()
+import asyncio
+import json
+import logging
+import os
+import time
+
+from aiohttp import web
+
+import latency_metrics
+import loop_watchdog
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("health_check")
+
+# Get port from environment variable or use default
+PORT = int(os.environ.get("PORT", 8080))
+
+# name -> zero-argument callable returning a JSON-serializable dict, merged into /stats
+stats_providers = {}
+
+
+def register_stats(name, provider):
+    """Add a section to /stats; providers are called on the server's loop and must not block"""
+    stats_providers[name] = provider
+
+
+class WorkerStatus:
+    """What the worker last reported to LiveKit, updated from the worker's load function"""
+
+    def __init__(self):
+        self.worker_id = None
+        self.load = 0.0
+        self.load_threshold = 0.75
+        self.draining = False
+        self.updated_at = None
+
+    def update(self, worker, load):
+        self.worker_id = worker.id
+        # livekit only exposes draining state privately; it flips on SIGTERM
+        self.draining = getattr(worker, "_draining", False)
+        self.load = load
+        self.updated_at = time.monotonic()
+
+    @property
+    def registered(self):
+        return self.worker_id not in (None, "unregistered")
+
+    def ready(self):
+        return self.registered and not self.draining and self.load < self.load_threshold
+
+    def snapshot(self):
+        return {
+            "worker_id": self.worker_id,
+            "registered": self.registered,
+            "draining": self.draining,
+            "load": round(self.load, 3),
+            "load_threshold": self.load_threshold,
+            "seconds_since_update": (
+                round(time.monotonic() - self.updated_at, 1) if self.updated_at is not None else None
+            ),
+        }
+
+
+worker_status = WorkerStatus()
+
+
+class HealthServer:
+    """Health, readiness, stats and metrics endpoints served from the worker's own event loop"""
+
+    def __init__(self, host="0.0.0.0", port=PORT):
+        self.host = host
+        self.port = port
+        self.started_at = time.monotonic()
+        # Where job processes send their latencies, when they run in their own processes
+        self.relay_socket = None
+        # Set once the server is accepting connections
+        self.listening = asyncio.Event()
+        self._app = web.Application()
+        self._app.add_routes([
+            web.get("/", self.health),
+            web.get("/health", self.health),
+            web.get("/ready", self.ready),
+            web.get("/stats", self.stats),
+            web.get("/metrics", self.metrics),
+        ])
+
+    async def health(self, request):
+        return web.Response(text="OK")
+
+    async def ready(self, request):
+        if worker_status.ready():
+            return web.Response(text="READY")
+        return web.Response(status=503, text="NOT READY")
+
+    async def stats(self, request):
+        body = {
+            "uptime_s": round(time.monotonic() - self.started_at, 1),
+            "worker": worker_status.snapshot(),
+            "event_loop": loop_watchdog.watchdog.snapshot(),
+        }
+        for name, provider in list(stats_providers.items()):
+            try:
+                body[name] = provider()
+            except Exception as e:
+                body[name] = {"error": str(e)}
+        return web.Response(text=json.dumps(body, indent=2, default=str), content_type="application/json")
+
+    async def metrics(self, request):
+        return web.Response(
+            text=latency_metrics.latency.render_prometheus() + loop_watchdog.watchdog.render_prometheus(),
+            content_type="text/plain",
+            headers={"X-Content-Type-Options": "nosniff"},
+        )
+
+    async def run(self):
+        runner = web.AppRunner(self._app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, self.host, self.port)
+        try:
+            await site.start()
+            logger.info(f"Health check server started at port {self.port}")
+            self.listening.set()
+        except OSError as e:
+            logger.error(f"Health check server could not start on port {self.port}: {e}")
+            await runner.cleanup()
+            return
+        loop = asyncio.get_running_loop()
+        loop_watchdog.watchdog.watch(loop, "worker")
+        if self.relay_socket is not None:
+            loop.add_reader(self.relay_socket, latency_metrics.latency.receive, self.relay_socket)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            if self.relay_socket is not None:
+                loop.remove_reader(self.relay_socket)
+            loop_watchdog.watchdog.unwatch(loop)
+            await runner.cleanup()
+
+
+_server = None
+
+
+def start_in_worker_loop():
+    """Schedule the health server on the event loop the agent worker is about to run.
+
+    livekit's `start` command runs the worker on the main thread's current event loop,
+    so the server task starts with the worker and is cancelled with it. Only one
+    server is started however often this is called; it is returned. The server
+    also collects the latencies of job processes started after this call.
+    """
+    global _server
+    if _server is not None:
+        return _server
+    try:
+        loop = asyncio.get_event_loop()
+    except RuntimeError:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+    _server = HealthServer()
+    try:
+        _server.relay_socket = latency_metrics.latency.listen()
+    except OSError as e:
+        logger.warning(f"Latencies of job processes will not reach /metrics: {e}")
+    _server.task = loop.create_task(_server.run(), name="health_server")
+    return _server
+
+
+def serve_forever():
+    """Serve health checks until the process is stopped, reusing the started server if its loop is usable"""
+    if _server is not None and not _server.task.done():
+        loop = _server.task.get_loop()
+        if not loop.is_closed() and not loop.is_running():
+            loop.run_until_complete(_server.task)
+            return
+    asyncio.run(HealthServer().run())
+
+
+# Allow direct execution
+if __name__ == "__main__":
+    # Start the health server directly
+    asyncio.run(HealthServer().run())
@@ -0,0 +1,333 @@
+"""Local retrieval over the company knowledge directory.
+
+Source files are chunked and embedded offline with a hashed TF-IDF embedding,
+so no network or model download is needed. Embeddings are kept in a
+memory-mapped NumPy matrix and queried with cosine similarity. When a source
+file changes, only that file is re-chunked and re-tokenized before the matrix
+is rebuilt.
+
+The index is written under the temporary directory by default, or to
+KNOWLEDGE_INDEX_DIR, so a read-only image still works. If it cannot be
+written, it is kept in memory and rebuilt by each process.
+"""
+
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import zlib
+
+import numpy as np
+
+import company_knowledge
+from company_knowledge import KNOWLEDGE_DIR
+
+logger = logging.getLogger("knowledge_store")
+logger.setLevel(logging.INFO)
+
+SOURCE_EXTENSIONS = (".md", ".txt")
+# Below this cosine similarity a retrieval hit is treated as noise and the keyword index answers instead
+MIN_SCORE = 0.15
+# Bumped whenever chunking changes, so indexes built the old way are rebuilt
+INDEX_VERSION = 2
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def chunk_text(text, max_chars=600):
+    """Split text into paragraph-aligned chunks of at most max_chars, breaking on sentences"""
+    chunks = []
+    heading = ""
+    for paragraph in re.split(r"\n\s*\n", text):
+        lines = []
+        for line in paragraph.splitlines():
+            if line.lstrip().startswith("#"):
+                heading = line.strip("# \t")
+            else:
+                lines.append(line)
+        paragraph = company_knowledge.join_lines(lines)
+        if not paragraph:
+            continue
+        # Each chunk carries its section heading so short queries like 'ethics' still match
+        prefix = f"{heading}: " if heading else ""
+        current = ""
+        for sentence in _SENTENCE_RE.split(paragraph):
+            if current and len(current) + len(sentence) + 1 > max_chars:
+                chunks.append(prefix + current)
+                current = sentence
+            else:
+                current = f"{current} {sentence}" if current else sentence
+        if current:
+            chunks.append(prefix + current)
+    return chunks
+
+
+class HashedTfidfEmbedder:
+    """Deterministic embedding: hashed word, word-bigram and character n-gram counts weighted by IDF"""
+
+    def __init__(self, dim=512):
+        self.dim = dim
+
+    def features(self, text):
+        """Sparse hashed term frequencies for one text, as (indices, values) arrays"""
+        tokens = _TOKEN_RE.findall(text.lower())
+        terms = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        # Character n-grams let 'released' match 'release' and 'ethics' match 'ethical'
+        for token in tokens:
+            padded = f"<{token}>"
+            terms.extend(padded[i:i + 4] for i in range(len(padded) - 3))
+        counts = {}
+        for term in terms:
+            h = zlib.crc32(term.encode())
+            # The top bit picks a sign so that hash collisions tend to cancel out
+            index = h % self.dim
+            sign = -1.0 if h & 0x80000000 else 1.0
+            counts[index] = counts.get(index, 0.0) + sign
+        indices = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+        values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        # Sublinear term frequency keeps long chunks from dominating
+        values = np.sign(values) * (1.0 + np.log(np.maximum(np.abs(values), 1.0)))
+        return indices, values.astype(np.float32)
+
+    def idf(self, rows):
+        """Inverse document frequency per hashed feature over all chunk rows"""
+        df = np.zeros(self.dim, dtype=np.float32)
+        for indices, _ in rows:
+            df[indices] += 1.0
+        return (np.log((1.0 + len(rows)) / (1.0 + df)) + 1.0).astype(np.float32)
+
+    def embed_rows(self, rows, idf):
+        """Dense, L2-normalized embeddings for sparse rows"""
+        matrix = np.zeros((len(rows), self.dim), dtype=np.float32)
+        for i, (indices, values) in enumerate(rows):
+            matrix[i, indices] = values
+        matrix *= idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+
+def default_index_dir(source_dir):
+    """A writable directory for the index of source_dir, separate from other source directories"""
+    key = zlib.crc32(os.path.abspath(source_dir).encode())
+    return os.path.join(tempfile.gettempdir(), f"reception-knowledge-index-{key:08x}")
+
+
+class KnowledgeStore:
+    """Chunked, embedded view of a directory of knowledge files"""
+
+    def __init__(self, source_dir=KNOWLEDGE_DIR, index_dir=None, dim=512, max_chars=600, check_interval=5.0):
+        self.source_dir = source_dir
+        self.index_dir = index_dir or default_index_dir(source_dir)
+        self.embedder = HashedTfidfEmbedder(dim)
+        self.max_chars = max_chars
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+        self._files = {}
+        self._rows = None
+        # Replaced as a whole on rebuild so readers never see a half-built index
+        self._state = (np.zeros((0, dim), dtype=np.float32), [], np.ones(dim, dtype=np.float32))
+
+    def __len__(self):
+        return len(self._state[1])
+
+    def _index_path(self, name):
+        return os.path.join(self.index_dir, name)
+
+    def _scan_sources(self):
+        sources = {}
+        if not os.path.isdir(self.source_dir):
+            return sources
+        for entry in os.scandir(self.source_dir):
+            if entry.is_file() and entry.name.endswith(SOURCE_EXTENSIONS):
+                stat = entry.stat()
+                sources[entry.name] = [stat.st_mtime_ns, stat.st_size]
+        return sources
+
+    def _load_index(self):
+        """Load a previously built index from disk, if it matches this configuration"""
+        try:
+            with open(self._index_path("manifest.json"), encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("version") != INDEX_VERSION or manifest.get("dim") != self.embedder.dim:
+                return
+            with open(self._index_path("chunks.json"), encoding="utf-8") as f:
+                chunks = json.load(f)
+            csr = np.load(self._index_path("features.npz"))
+            offsets, indices, values = csr["offsets"], csr["indices"], csr["values"]
+            matrix = np.load(self._index_path("matrix.npy"), mmap_mode="r")
+            idf = np.load(self._index_path("idf.npy"))
+        except (OSError, ValueError, KeyError):
+            return
+        self._files = manifest["files"]
+        self._rows = [
+            (chunk, (indices[offsets[i]:offsets[i + 1]], values[offsets[i]:offsets[i + 1]]))
+            for i, chunk in enumerate(chunks)
+        ]
+        self._state = (matrix, chunks, idf)
+
+    def _write_index(self, chunks, rows, matrix, idf):
+        """Write the index files atomically so concurrent readers always see a complete set"""
+        os.makedirs(self.index_dir, exist_ok=True)
+        suffix = f".tmp{os.getpid()}.{threading.get_ident()}"
+
+        def write(name, writer):
+            tmp_path = self._index_path(name + suffix)
+            with open(tmp_path, "wb") as f:
+                writer(f)
+            os.replace(tmp_path, self._index_path(name))
+
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        for i, (indices, _) in enumerate(rows):
+            offsets[i + 1] = offsets[i] + len(indices)
+        write("features.npz", lambda f: np.savez(
+            f,
+            offsets=offsets,
+            indices=np.concatenate([r[0] for r in rows]) if rows else np.zeros(0, dtype=np.int32),
+            values=np.concatenate([r[1] for r in rows]) if rows else np.zeros(0, dtype=np.float32),
+        ))
+        write("matrix.npy", lambda f: np.save(f, matrix))
+        write("idf.npy", lambda f: np.save(f, idf))
+        write("chunks.json", lambda f: f.write(json.dumps(chunks).encode("utf-8")))
+        # The manifest goes last: it is what marks the other files as current
+        manifest = {"version": INDEX_VERSION, "dim": self.embedder.dim, "files": self._files}
+        write("manifest.json", lambda f: f.write(json.dumps(manifest, indent=2).encode("utf-8")))
+
+    def refresh(self, force=False):
+        """Re-embed changed source files; returns True if the index was rebuilt"""
+        now = time.monotonic()
+        if not force and now - self._last_check < self.check_interval:
+            return False
+        with self._lock:
+            self._last_check = now
+            sources = self._scan_sources()
+            if self._rows is None:
+                self._load_index()
+            if self._rows is not None and {n: m[:2] for n, m in self._files.items()} == sources:
+                return False
+
+            started = time.perf_counter()
+            unchanged = {name for name, meta in self._files.items() if sources.get(name) == meta[:2]}
+            cached = {}
+            for chunk, row in self._rows or []:
+                if chunk["source"] in unchanged:
+                    cached.setdefault(chunk["source"], []).append((chunk, row))
+
+            rows, files = [], {}
+            for name in sorted(sources):
+                if name in cached:
+                    entries = cached[name]
+                else:
+                    with open(os.path.join(self.source_dir, name), encoding="utf-8") as f:
+                        entries = [
+                            ({"source": name, "text": text}, self.embedder.features(text))
+                            for text in chunk_text(f.read(), self.max_chars)
+                        ]
+                files[name] = sources[name] + [len(entries)]
+                rows.extend(entries)
+
+            chunks = [chunk for chunk, _ in rows]
+            features = [row for _, row in rows]
+            idf = self.embedder.idf(features)
+            matrix = self.embedder.embed_rows(features, idf)
+            self._files, self._rows = files, rows
+            try:
+                self._write_index(chunks, features, matrix, idf)
+                matrix = np.load(self._index_path("matrix.npy"), mmap_mode="r")
+            except OSError as e:
+                logger.warning(f"Could not write the knowledge index to {self.index_dir}, keeping it in memory: {e!r}")
+            self._state = (matrix, chunks, idf)
+            logger.info(
+                f"Indexed {len(chunks)} chunks from {len(sources)} files "
+                f"({len(sources) - len(cached)} re-embedded) in {(time.perf_counter() - started) * 1000:.1f}ms"
+            )
+            return True
+
+    def embed_queries(self, queries, idf):
+        rows = [self.embedder.features(query) for query in queries]
+        return self.embedder.embed_rows(rows, idf)
+
+    def search_many(self, queries, k=3):
+        """Top-k (score, chunk) matches for each query, scored together in one matrix product"""
+        self.refresh()
+        matrix, chunks, idf = self._state
+        if not chunks or not queries:
+            return [[] for _ in queries]
+        scores = self.embed_queries(queries, idf) @ matrix.T
+        k = min(k, len(chunks))
+        results = []
+        for row in scores:
+            top = np.argpartition(-row, k - 1)[:k] if k < len(row) else np.arange(len(row))
+            top = top[np.argsort(-row[top])]
+            results.append([(float(row[i]), chunks[i]) for i in top])
+        return results
+
+    def search(self, query, k=3):
+        """Top-k (score, chunk) matches for a single query"""
+        return self.search_many([query], k)[0]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Process-wide store over KNOWLEDGE_DIR (or the bundled knowledge directory)"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = KnowledgeStore(
+                source_dir=os.getenv("KNOWLEDGE_DIR", KNOWLEDGE_DIR),
+                index_dir=os.getenv("KNOWLEDGE_INDEX_DIR") or None,
+            )
+            _store.refresh(force=True)
+    return _store
+
+
+def lookup_many(topics, k=2):
+    """lookup() for several topics, scored together in one matrix product"""
+    texts = []
+    for topic, matches in zip(topics, get_store().search_many(topics, k)):
+        results = [(score, chunk) for score, chunk in matches if score >= MIN_SCORE]
+        if not results:
+            texts.append(company_knowledge.lookup(topic))
+        else:
+            texts.append("\n\n".join(chunk["text"] for _, chunk in results))
+    return texts
+
+
+def lookup(topic, k=2):
+    """Best matching knowledge text for a topic, using the keyword index when retrieval is unsure"""
+    return lookup_many([topic], k)[0]
+
+
+if __name__ == "__main__":
+    # Benchmark: python knowledge_store.py [num_chunks]
+    import sys
+    import tempfile
+
+    logging.basicConfig(level=logging.INFO)
+    num_chunks = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    words = open(os.path.join(KNOWLEDGE_DIR, "fortunes_told.md")).read().split()
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        for file_index in range(num_chunks // 100):
+            paragraphs = [" ".join(rng.choice(words, 60)) + "." for _ in range(100)]
+            with open(os.path.join(tmp, f"doc{file_index}.txt"), "w") as f:
+                f.write("\n\n".join(paragraphs))
+        store = KnowledgeStore(tmp)
+        store.refresh(force=True)
+        with open(os.path.join(tmp, "doc0.txt"), "a") as f:
+            f.write("\n\nA newly added paragraph about tarot readings.")
+        store.refresh(force=True)
+        store.search("when is the book released")
+        iterations = 200
+        started = time.perf_counter()
+        for _ in range(iterations):
+            store.search("when is the book released")
+        print(f"{len(store)} chunks: {(time.perf_counter() - started) / iterations * 1000:.3f}ms/query")
@@ -0,0 +1,348 @@
+from __future__ import annotations
+
+import atexit
+import json
+import logging
+import math
+import os
+import socket
+import tempfile
+import threading
+import time
+
+log = logging.getLogger("latency_metrics")
+log.setLevel(logging.INFO)
+
+WORKER_LABEL = os.getenv("WORKER_NAME") or f"{socket.gethostname()}-{os.getpid()}"
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Set by the worker process to the socket its job processes send their latencies to
+RELAY_SOCKET_ENV = "LATENCY_RELAY_SOCKET"
+_UNSET = object()
+
+# Turn stages, in pipeline order
+STAGES = (
+    "eos_to_stt_final",
+    "stt_final_to_llm_first_token",
+    "llm_first_token_to_tts_first_byte",
+    "function_call",
+    "realtime_first_audio",
+    "turn_total",
+)
+
+
+class LatencyHistogram:
+    """HDR-style histogram: log2 buckets split into linear sub-buckets.
+
+    Values are recorded in microseconds. With 32 sub-buckets per power of two,
+    reported quantiles are within about 3% of the true value. Memory use is
+    fixed, and recording is O(1).
+    """
+
+    SUB_BUCKETS = 32
+    MAX_EXPONENT = 40  # about 12 days in microseconds
+
+    def __init__(self):
+        self._counts = [0] * (self.MAX_EXPONENT * self.SUB_BUCKETS)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def _index(self, value_us):
+        if value_us < 1:
+            return 0
+        mantissa, exponent = math.frexp(value_us)  # value = mantissa * 2**exponent, 0.5 <= mantissa < 1
+        exponent = min(exponent, self.MAX_EXPONENT)
+        sub = min(int((mantissa - 0.5) * 2 * self.SUB_BUCKETS), self.SUB_BUCKETS - 1)
+        return (exponent - 1) * self.SUB_BUCKETS + sub
+
+    def _bucket_value(self, index):
+        exponent, sub = divmod(index, self.SUB_BUCKETS)
+        # Midpoint of the bucket
+        return (0.5 + (sub + 0.5) / (2 * self.SUB_BUCKETS)) * 2.0 ** (exponent + 1)
+
+    def record(self, seconds):
+        if seconds < 0:
+            return
+        value_us = seconds * 1e6
+        index = self._index(value_us)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def quantiles(self, quantiles=QUANTILES):
+        """Quantile values in seconds, in the same order as requested"""
+        with self._lock:
+            counts = list(self._counts)
+            count = self.count
+        if not count:
+            return [0.0 for _ in quantiles]
+        targets = [max(1, math.ceil(q * count)) for q in quantiles]
+        results = [None] * len(quantiles)
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            if not bucket_count:
+                continue
+            seen += bucket_count
+            for i, target in enumerate(targets):
+                if results[i] is None and seen >= target:
+                    results[i] = self._bucket_value(index) / 1e6
+            if all(r is not None for r in results):
+                break
+        return results
+
+    def snapshot(self):
+        p50, p95, p99 = self.quantiles()
+        return {"count": self.count, "p50": p50, "p95": p95, "p99": p99, "max": self.max}
+
+
+class _RelaySender:
+    """Sends a job process's latencies to the worker process, dropping them rather than ever blocking"""
+
+    def __init__(self, path):
+        self.path = path
+        self.dropped = 0
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+    def send(self, message):
+        try:
+            self._socket.sendto(json.dumps(message).encode(), self.path)
+        except OSError:
+            self.dropped += 1
+
+
+class LatencyRegistry:
+    """Latency histograms by stage, for the whole worker and for each live room.
+
+    Under the process job executor, each job process also relays what it records
+    to the worker process, whose registry is the one the health server serves.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._worker = {}
+        self._rooms = {}
+        self._relay = _UNSET
+        # Rooms whose latencies came from job processes
+        self._relayed_rooms = set()
+
+    def _relay_sender(self):
+        if self._relay is _UNSET:
+            path = os.getenv(RELAY_SOCKET_ENV)
+            self._relay = _RelaySender(path) if path else None
+        return self._relay
+
+    def _histogram(self, table, key):
+        histogram = table.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = table.setdefault(key, LatencyHistogram())
+        return histogram
+
+    def record(self, stage, room_name, seconds):
+        self._histogram(self._worker, stage).record(seconds)
+        self._histogram(self._rooms, (room_name, stage)).record(seconds)
+        relay = self._relay_sender()
+        if relay is not None:
+            relay.send(["record", stage, room_name, seconds])
+
+    def end_room(self, room_name):
+        """Drop a finished room's series so label cardinality stays bounded"""
+        with self._lock:
+            for key in [key for key in self._rooms if key[0] == room_name]:
+                del self._rooms[key]
+            self._relayed_rooms.discard(room_name)
+        relay = self._relay_sender()
+        if relay is not None:
+            relay.send(["end_room", room_name])
+
+    def listen(self):
+        """Receive the latencies of this process's job processes; returns the socket to read with receive()
+
+        Call it in the worker process before jobs start: it sets RELAY_SOCKET_ENV,
+        which the job processes inherit.
+        """
+        path = os.path.join(tempfile.gettempdir(), f"reception-latency-{os.getpid()}.sock")
+        if os.path.exists(path):
+            os.unlink(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(path)
+        sock.setblocking(False)
+        atexit.register(_unlink, path)
+        os.environ[RELAY_SOCKET_ENV] = path
+        # This process receives, so it never relays to itself
+        self._relay = None
+        return sock
+
+    def receive(self, sock):
+        """Apply every latency waiting on the socket; for loop.add_reader"""
+        while True:
+            try:
+                data = sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                return
+            try:
+                message = json.loads(data)
+                if message[0] == "record":
+                    _, stage, room_name, seconds = message
+                    self._histogram(self._worker, stage).record(float(seconds))
+                    self._histogram(self._rooms, (room_name, stage)).record(float(seconds))
+                    with self._lock:
+                        self._relayed_rooms.add(room_name)
+                elif message[0] == "end_room":
+                    self.end_room(message[1])
+            except (ValueError, TypeError, IndexError) as e:
+                log.warning(f"Ignoring a malformed relayed latency: {e!r}")
+
+    def retain_relayed_rooms(self, live_rooms):
+        """End the relayed series of rooms no longer live, as when a job process died before ending its room"""
+        with self._lock:
+            if not self._relayed_rooms:
+                return
+            relayed = set(self._relayed_rooms)
+        for room_name in relayed - set(live_rooms):
+            self.end_room(room_name)
+
+    def snapshot(self):
+        with self._lock:
+            worker = dict(self._worker)
+            rooms = dict(self._rooms)
+        return {
+            "worker": {stage: h.snapshot() for stage, h in worker.items()},
+            "rooms": {f"{room}/{stage}": h.snapshot() for (room, stage), h in rooms.items()},
+        }
+
+    def render_prometheus(self):
+        """Prometheus text exposition of all latency summaries"""
+        with self._lock:
+            worker = sorted(self._worker.items())
+            rooms = sorted(self._rooms.items())
+        lines = [
+            "# HELP reception_turn_latency_seconds Voice pipeline stage latency across all calls in this worker",
+            "# TYPE reception_turn_latency_seconds summary",
+        ]
+        for stage, histogram in worker:
+            _summary_lines(lines, "reception_turn_latency_seconds", f'worker="{WORKER_LABEL}",stage="{stage}"', histogram)
+        lines += [
+            "# HELP reception_room_turn_latency_seconds Voice pipeline stage latency per active room",
+            "# TYPE reception_room_turn_latency_seconds summary",
+        ]
+        for (room_name, stage), histogram in rooms:
+            labels = f'worker="{WORKER_LABEL}",room="{_escape(room_name)}",stage="{stage}"'
+            _summary_lines(lines, "reception_room_turn_latency_seconds", labels, histogram)
+        return "\n".join(lines) + "\n"
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _summary_lines(lines, name, labels, histogram):
+    for q, value in zip(QUANTILES, histogram.quantiles()):
+        lines.append(f'{name}{{{labels},quantile="{q}"}} {value:.6f}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram.total:.6f}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+
+latency = LatencyRegistry()
+
+
+class TurnTracker:
+    """Turns agent events and metrics into per-turn stage latencies.
+
+    Works with both VoicePipelineAgent and MultimodalAgent. Stage boundaries are
+    rebuilt from the pipeline metrics, which all carry wall-clock timestamps.
+    Each stage is recorded as soon as both of its endpoints are known.
+    """
+
+    def __init__(self, room_name, registry=None):
+        self.room_name = room_name
+        self.registry = registry or latency
+        self._user_stopped_at = None
+        self._turns = {}
+        self._function_calls_started = None
+
+    def attach(self, agent):
+        agent.on("user_stopped_speaking", self._on_user_stopped_speaking)
+        agent.on("agent_started_speaking", self._on_agent_started_speaking)
+        agent.on("function_calls_collected", self._on_function_calls_collected)
+        agent.on("function_calls_finished", self._on_function_calls_finished)
+        agent.on("metrics_collected", self._on_metrics_collected)
+        return self
+
+    def close(self):
+        self.registry.end_room(self.room_name)
+
+    def _record(self, stage, seconds):
+        self.registry.record(stage, self.room_name, seconds)
+
+    def _on_user_stopped_speaking(self, *_):
+        self._user_stopped_at = time.time()
+
+    def _on_agent_started_speaking(self, *_):
+        if self._user_stopped_at is not None:
+            self._record("turn_total", time.time() - self._user_stopped_at)
+            self._user_stopped_at = None
+
+    def _on_function_calls_collected(self, *_):
+        self._function_calls_started = time.perf_counter()
+
+    def _on_function_calls_finished(self, *_):
+        if self._function_calls_started is not None:
+            self._record("function_call", time.perf_counter() - self._function_calls_started)
+            self._function_calls_started = None
+
+    def _turn(self, sequence_id):
+        turn = self._turns.get(sequence_id)
+        if turn is None:
+            turn = self._turns[sequence_id] = {}
+            # Only a handful of turns can be in flight; forget the oldest ones
+            while len(self._turns) > 8:
+                del self._turns[next(iter(self._turns))]
+        return turn
+
+    def _on_metrics_collected(self, m):
+        # Imported here so the health server can load this module without livekit.agents
+        from livekit.agents import metrics as agent_metrics
+
+        if isinstance(m, agent_metrics.PipelineEOUMetrics):
+            self._record("eos_to_stt_final", m.transcription_delay)
+            turn = self._turn(m.sequence_id)
+            turn["stt_final_at"] = m.timestamp - m.end_of_utterance_delay + m.transcription_delay
+        elif isinstance(m, agent_metrics.PipelineLLMMetrics):
+            turn = self._turn(m.sequence_id)
+            if "llm_first_token_at" not in turn and m.ttft >= 0:
+                turn["llm_first_token_at"] = m.timestamp - m.duration + m.ttft
+        elif isinstance(m, agent_metrics.PipelineTTSMetrics):
+            turn = self._turn(m.sequence_id)
+            if "tts_first_byte_at" not in turn and m.ttfb >= 0:
+                turn["tts_first_byte_at"] = m.timestamp - m.duration + m.ttfb
+        elif isinstance(m, agent_metrics.MultimodalLLMMetrics):
+            # The realtime model does STT, LLM and TTS in one hop; its TTFT is time to first audio
+            if m.ttft >= 0:
+                self._record("realtime_first_audio", m.ttft)
+            return
+        else:
+            return
+        self._complete_stages(turn)
+
+    def _complete_stages(self, turn):
+        if "stt_final_at" in turn and "llm_first_token_at" in turn and "stt_llm" not in turn:
+            turn["stt_llm"] = True
+            self._record("stt_final_to_llm_first_token", turn["llm_first_token_at"] - turn["stt_final_at"])
+        if "llm_first_token_at" in turn and "tts_first_byte_at" in turn and "llm_tts" not in turn:
+            turn["llm_tts"] = True
+            self._record("llm_first_token_to_tts_first_byte", turn["tts_first_byte_at"] - turn["llm_first_token_at"])
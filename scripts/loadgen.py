@@ -0,0 +1,482 @@
+"""Load generator for the realtime receptionist (agent.py): how many concurrent calls can one worker take?
+
+Synthetic pi-receptionist jobs arrive at a rate that ramps through a schedule.
+Each job carries caller_id metadata, as SIP dispatch does. Each job goes through
+the worker's real admission control, and accepted jobs run the real main_entry
+on their own thread and event loop, as under the thread executor. Rooms and
+participants come from fake_room. The OpenAI Realtime API is replaced by
+mock_realtime, which is started as a subprocess, so that its CPU is not counted
+as the worker's. Nothing leaves the machine.
+
+Each call's fake caller is already in the room when the job arrives. It streams
+microphone audio at real-time pace, waits for the greeting, speaks a few turns
+and hangs up. For every step of the schedule the generator records:
+
+- offered, accepted and rejected jobs, and jobs shed while the worker reported itself full
+- join latency, from dispatch to the agent being connected to the room
+- greeting latency, from dispatch to the first audio the caller hears
+- reply latency, from the end of the caller's speech to the agent's first audio
+- caller frames sent late or dropped, and late audio at the model
+- worker CPU, RSS, concurrent calls and event-loop lag
+
+With --redial-s, each caller dials the same room again that long after hanging
+up, as after a dropped line, and speaks the same turns without waiting for a
+greeting. The time until each call was ready to talk is printed for calls that
+started cold and for calls resumed by session_resume.
+
+    python loadgen.py --schedule 0.1:60,0.2:60,0.4:60 --output load.json
+
+The schedule is a comma-separated list of arrivals per second and step length
+in seconds. Arrivals are Poisson with a fixed seed. The callers' audio runs on
+the job threads, so it is part of the CPU figure; a caller costs far less than
+the agent it is talking to.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import aiohttp
+import psutil
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+logger = logging.getLogger("loadgen")
+logger.setLevel(logging.INFO)
+
+
+def parse_schedule(text):
+    """[(arrivals per second, seconds), ...] from "0.1:60,0.2:60" """
+    steps = []
+    for part in text.split(","):
+        rate, _, seconds = part.partition(":")
+        steps.append((float(rate), float(seconds)))
+    return steps
+
+
+class FakeWorker:
+    def __init__(self):
+        self.id = "loadgen-worker"
+        self.active_jobs = []
+
+
+class FakeJobRequest:
+    def __init__(self, room_name):
+        self.room = type("Room", (), {"name": room_name})()
+        self.answer = None
+
+    async def accept(self, **_):
+        self.answer = "accepted"
+
+    async def reject(self):
+        self.answer = "rejected"
+
+
+class Call:
+    def __init__(self, index, step):
+        self.index = index
+        self.step = step
+        self.caller_id = f"+44700{index:06d}"
+        self.room_name = f"call-_{self.caller_id}_loadgen"
+        # Shaped like the worker's RunningJobInfo, for admission control
+        self.job = type("Job", (), {"room": type("Room", (), {"name": self.room_name})()})()
+        self.offered_at = time.perf_counter()
+        self.result = {"replies_ms": [], "redial_replies_ms": [], "error": None}
+
+
+_observers = threading.local()
+
+
+def _install_fakes():
+    """Route microphone audio through fake_room and observe every MultimodalAgent agent.py creates"""
+    import agent
+    import fake_room
+
+    fake_room.install()
+    # Older openai plugins predate the playout_complete property newer MultimodalAgents read,
+    # and without it playout events fail before agent_started_speaking is emitted
+    from livekit.plugins.openai.realtime import RealtimeSession
+
+    if not hasattr(RealtimeSession, "playout_complete"):
+        RealtimeSession.playout_complete = None
+
+    class ObservedAgent(agent.MultimodalAgent):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            _observers.current.attach(self)
+
+    agent.MultimodalAgent = ObservedAgent
+    return agent
+
+
+async def run_call(call, args, turns, proc_userdata, redial=False):
+    import agent
+    import fake_room
+    from bench_pipeline import AgentObserver
+    from livekit.agents.utils import http_context
+
+    # What the job executor sets up around every entrypoint
+    http_context._new_session_ctx()
+    observer = _observers.current = AgentObserver()
+    result = call.result
+    offered_at = time.perf_counter() if redial else call.offered_at
+    ctx = fake_room.FakeJobContext(
+        call.room_name,
+        proc=fake_room.FakeJobProcess(proc_userdata),
+        metadata={"caller_id": call.caller_id},
+        connect_latency=args.connect_ms / 1000,
+    )
+    connect = ctx.connect
+
+    async def timed_connect(**kwargs):
+        await connect(**kwargs)
+        if not redial:
+            result["join_ms"] = (time.perf_counter() - offered_at) * 1000
+
+    ctx.connect = timed_connect
+    caller = fake_room.Caller(ctx.room, f"sip_{call.caller_id}", max_lag=args.max_lag_ms / 1000)
+    # The SIP participant is already in the room when the job is dispatched
+    caller.join()
+    try:
+        await agent.main_entry(ctx)
+        if not redial:
+            first = await observer.first_audio_after(0, args.timeout)
+            result["greeting_ms"] = (first - offered_at) * 1000
+            await observer.wait_quiet(args.quiet_s, args.timeout)
+        for samples in turns:
+            await asyncio.sleep(args.pause_s)
+            spoken = len(observer.started_at)
+            speech_end = await caller.say(samples)
+            reply = await observer.first_audio_after(spoken, args.timeout)
+            result["redial_replies_ms" if redial else "replies_ms"].append((reply - speech_end) * 1000)
+            await observer.wait_quiet(args.quiet_s, args.timeout)
+    except Exception as e:
+        result["error"] = f"{'redial: ' if redial else ''}{type(e).__name__}: {e}"
+        logger.error(f"Call {call.room_name} failed: {result['error']}")
+    finally:
+        for counter in ("frames_sent", "frames_late", "frames_dropped"):
+            result[counter] = result.get(counter, 0) + getattr(caller, counter)
+        await caller.hang_up()
+        if observer.agent is not None:
+            await observer.agent._session.aclose()
+        await ctx.run_shutdown_callbacks()
+        await http_context._close_http_ctx()
+        result["duration_s"] = time.perf_counter() - call.offered_at
+
+
+def _job_thread(call, args, turns, proc_userdata, worker):
+    worker.active_jobs.append(call)
+    try:
+        asyncio.run(run_call(call, args, turns, proc_userdata))
+        if args.redial_s > 0 and not call.result["error"]:
+            # Redispatch to the same room goes straight to this worker, without admission
+            time.sleep(args.redial_s)
+            asyncio.run(run_call(call, args, turns, proc_userdata, redial=True))
+    finally:
+        worker.active_jobs.remove(call)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def start_mock_realtime(args):
+    """Run mock_realtime in a subprocess; returns the process and its base URL"""
+    port = _free_port()
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(SCRIPT_DIR, "mock_realtime.py"), "--port", str(port),
+         "--ttfa-ms", str(args.ttfa_ms), "--rtf", str(args.rtf)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    async with aiohttp.ClientSession() as session:
+        for _ in range(100):
+            try:
+                async with session.get(f"{base_url}/stats"):
+                    return proc, base_url
+            except aiohttp.ClientError:
+                await asyncio.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("mock_realtime did not start")
+
+
+async def realtime_stats(base_url):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{base_url}/stats") as resp:
+            return await resp.json()
+
+
+class Sampler:
+    """Worker CPU, memory, calls and load, sampled once a second"""
+
+    def __init__(self, worker, admission):
+        self.worker = worker
+        self.admission = admission
+        self.process = psutil.Process()
+        self.samples = []
+
+    async def run(self, current_step):
+        import loop_watchdog
+
+        self.process.cpu_percent()
+        while True:
+            await asyncio.sleep(1.0)
+            self.samples.append({
+                "t": time.perf_counter(),
+                "step": current_step(),
+                "cpu_pct": self.process.cpu_percent(),
+                "rss_mb": self.process.memory_info().rss / 2 ** 20,
+                "calls": len(self.worker.active_jobs),
+                "load": self.admission.load(),
+                "loop_lag_ms": loop_watchdog.watchdog.max_recent_lag() * 1000,
+            })
+
+
+async def generate(args, turns):
+    import loop_watchdog
+    from worker_setup import admission
+
+    worker = FakeWorker()
+    loop_watchdog.watch_current_loop("loadgen")
+    proc_userdata = {"prewarmed_at": time.monotonic(), "prewarm_ms": 0.0, "jobs_served": 0}
+    schedule = parse_schedule(args.schedule)
+    rng = random.Random(args.seed)
+    calls, threads = [], []
+    state = {"step": 0, "available": True, "shed": [0] * len(schedule)}
+    rejected = [0] * len(schedule)
+    realtime_by_step = []
+
+    async def report_load():
+        # Like the LiveKit server, stop offering jobs while the worker reports itself full
+        loop = asyncio.get_running_loop()
+        while True:
+            load = await loop.run_in_executor(None, admission.load_fnc, worker)
+            state["available"] = load < admission.load_threshold
+            await asyncio.sleep(args.update_interval)
+
+    sampler = Sampler(worker, admission)
+    background = [
+        asyncio.create_task(report_load()),
+        asyncio.create_task(sampler.run(lambda: state["step"])),
+    ]
+    try:
+        for step, (rate, seconds) in enumerate(schedule):
+            state["step"] = step
+            logger.info(f"Step {step + 1}/{len(schedule)}: {rate:g} calls/s for {seconds:g}s")
+            step_end = time.perf_counter() + seconds
+            while True:
+                wait = rng.expovariate(rate) if rate > 0 else seconds
+                if time.perf_counter() + wait >= step_end:
+                    await asyncio.sleep(max(0.0, step_end - time.perf_counter()))
+                    break
+                await asyncio.sleep(wait)
+                call = Call(len(calls), step)
+                calls.append(call)
+                if not state["available"]:
+                    call.result["error"] = "shed"
+                    state["shed"][step] += 1
+                    continue
+                req = FakeJobRequest(call.room_name)
+                await admission.request_fnc(req)
+                call.result["accept_ms"] = (time.perf_counter() - call.offered_at) * 1000
+                if req.answer != "accepted":
+                    call.result["error"] = "rejected"
+                    rejected[step] += 1
+                    continue
+                thread = threading.Thread(
+                    target=_job_thread, args=(call, args, turns, proc_userdata, worker),
+                    name=f"job_{call.index}", daemon=True,
+                )
+                thread.start()
+                threads.append(thread)
+            realtime_by_step.append(await realtime_stats(args.realtime_url))
+        logger.info(f"Schedule done, waiting for {len(worker.active_jobs)} calls to finish")
+        deadline = time.perf_counter() + args.drain_s
+        while any(t.is_alive() for t in threads) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.5)
+    finally:
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+    return schedule, calls, sampler.samples, state["shed"], rejected, realtime_by_step
+
+
+def summarize(schedule, calls, samples, shed, rejected, realtime_by_step, args):
+    from bench_pipeline import percentiles
+
+    steps = []
+    previous_rt = {"appends": 0, "late_appends": 0}
+    for step, (rate, seconds) in enumerate(schedule):
+        offered = [c for c in calls if c.step == step]
+        ran = [c for c in offered if c.result["error"] not in ("shed", "rejected")]
+        ok = [c for c in ran if not c.result["error"]]
+        step_samples = [s for s in samples if s["step"] == step] or [{}]
+        rt = realtime_by_step[step] if step < len(realtime_by_step) else previous_rt
+        frames_sent = sum(c.result.get("frames_sent", 0) for c in ran)
+        dropped = sum(c.result.get("frames_dropped", 0) for c in ran)
+        steps.append({
+            "rate_per_s": rate,
+            "seconds": seconds,
+            "offered": len(offered),
+            "accepted": len(ran),
+            "rejected": rejected[step],
+            "shed": shed[step],
+            "failed": len(ran) - len(ok),
+            "errors": sorted({c.result["error"] for c in ran if c.result["error"]}),
+            "peak_calls": max(s.get("calls", 0) for s in step_samples),
+            "accept_ms": percentiles([c.result["accept_ms"] for c in ran if "accept_ms" in c.result]),
+            "join_ms": percentiles([c.result["join_ms"] for c in ran if "join_ms" in c.result]),
+            "greeting_ms": percentiles([c.result["greeting_ms"] for c in ok]),
+            "reply_ms": percentiles([ms for c in ok for ms in c.result["replies_ms"]]),
+            "redial_reply_ms": percentiles([ms for c in ok for ms in c.result["redial_replies_ms"]]),
+            "caller_frames_late": sum(c.result.get("frames_late", 0) for c in ran),
+            "caller_frames_dropped": dropped,
+            "caller_frames_dropped_pct": round(dropped / frames_sent * 100, 3) if frames_sent else 0.0,
+            "model_audio_appends": rt["appends"] - previous_rt["appends"],
+            "model_late_appends": rt["late_appends"] - previous_rt["late_appends"],
+            "cpu_pct_avg": round(sum(s.get("cpu_pct", 0) for s in step_samples) / len(step_samples), 1),
+            "cpu_pct_max": round(max(s.get("cpu_pct", 0) for s in step_samples), 1),
+            "rss_mb_peak": round(max(s.get("rss_mb", 0) for s in step_samples), 1),
+            "loop_lag_ms_max": round(max(s.get("loop_lag_ms", 0) for s in step_samples), 1),
+        })
+        previous_rt = rt
+
+    # Calls sustained: the busiest step whose accepted calls all met the targets
+    healthy = [
+        s for s in steps
+        if s["accepted"] and not s["failed"]
+        and s["caller_frames_dropped_pct"] <= args.max_dropped_pct
+        and s["greeting_ms"].get("p95", 0) <= args.greeting_slo_ms
+        and s["reply_ms"].get("p95", 0) <= args.reply_slo_ms
+    ]
+    return steps, max((s["peak_calls"] for s in healthy), default=0)
+
+
+def session_ready():
+    """Time until calls were ready to talk, for calls started cold and calls resumed, in ms"""
+    from latency_metrics import latency
+
+    stages = latency.snapshot()["worker"]
+    return {
+        kind: {k: round(v * 1000, 1) if k != "count" else v for k, v in stages[f"session_ready_{kind}"].items()}
+        for kind in ("cold", "resumed") if f"session_ready_{kind}" in stages
+    }
+
+
+def print_summary(steps, sustained):
+    print(f"\n{'rate/s':>6}  {'calls':>5}  {'peak':>4}  {'rej+shed':>8}  {'failed':>6}  {'join p95':>8}  "
+          f"{'greet p95':>9}  {'reply p95':>9}  {'dropped':>7}  {'cpu avg':>7}  {'rss MB':>7}")
+    for s in steps:
+        print(
+            f"{s['rate_per_s']:>6g}  {s['accepted']:>5}  {s['peak_calls']:>4}  {s['rejected'] + s['shed']:>8}  "
+            f"{s['failed']:>6}  {s['join_ms'].get('p95', '-'):>8}  {s['greeting_ms'].get('p95', '-'):>9}  "
+            f"{s['reply_ms'].get('p95', '-'):>9}  {s['caller_frames_dropped']:>7}  {s['cpu_pct_avg']:>6}%  "
+            f"{s['rss_mb_peak']:>7}"
+        )
+    print(f"\nSustained {sustained} concurrent calls within the latency and audio targets")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--schedule", default="0.1:60,0.2:60,0.4:60",
+                        help="Comma-separated steps of arrivals-per-second:seconds")
+    parser.add_argument("--turns", type=int, default=2, help="Utterances per caller after the greeting")
+    parser.add_argument("--speech-s", type=float, default=1.5, help="Length of each utterance")
+    parser.add_argument("--pause-s", type=float, default=0.8, help="Caller's pause before speaking")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--connect-ms", type=float, default=150.0, help="Time for ctx.connect()")
+    parser.add_argument("--max-lag-ms", type=float, default=200.0,
+                        help="How far a caller's audio may fall behind before frames are dropped")
+    parser.add_argument("--ttfa-ms", type=float, default=300.0, help="Mock realtime time to first audio")
+    parser.add_argument("--rtf", type=float, default=0.2, help="Mock realtime generation time per second of audio")
+    parser.add_argument("--realtime-url", help="Use an already running mock_realtime instead of starting one")
+    parser.add_argument("--max-calls", type=int, default=0,
+                        help="AGENT_MAX_CONCURRENT_CALLS for the run; 0 removes the limit")
+    parser.add_argument("--load-threshold", type=float, default=0.75)
+    parser.add_argument("--update-interval", type=float, default=2.5, help="How often load is reported")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds to wait for any agent reply")
+    parser.add_argument("--quiet-s", type=float, default=1.0, help="Silence after which the agent's reply is over")
+    parser.add_argument("--drain-s", type=float, default=120.0, help="How long to wait for calls after the schedule")
+    parser.add_argument("--greeting-slo-ms", type=float, default=2000.0)
+    parser.add_argument("--reply-slo-ms", type=float, default=1500.0)
+    parser.add_argument("--max-dropped-pct", type=float, default=0.1)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--redial-s", type=float, default=0.0,
+                        help="Dial each call's room again this long after it hangs up (0: never)")
+    parser.add_argument("--verbose", action="store_true", help="Keep the agent's per-call log lines")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    logger.setLevel(logging.INFO)
+    # Keep transcripts and cached audio away from the real ones
+    workdir = tempfile.mkdtemp(prefix="loadgen-")
+    os.environ["TTS_CACHE_DIR"] = os.path.join(workdir, "tts-cache")
+    os.environ["TRANSCRIPT_DIR"] = os.path.join(workdir, "transcripts")
+    os.environ["CALLER_STORE_PATH"] = os.path.join(workdir, "callers.sqlite3")
+    os.environ["CALLER_STORE_KEY"] = "loadgen"
+    os.environ["OPENAI_API_KEY"] = "loadgen"
+    # The calls run on threads of this process, as under the thread executor
+    os.environ["AGENT_JOB_EXECUTOR"] = "thread"
+    os.environ["AGENT_MAX_CONCURRENT_CALLS"] = str(args.max_calls)
+    os.environ["AGENT_LOAD_THRESHOLD"] = str(args.load_threshold)
+
+    import fake_room
+
+    mock = None
+    if not args.realtime_url:
+        mock, args.realtime_url = asyncio.run(start_mock_realtime(args))
+    os.environ["OPENAI_BASE_URL"] = f"{args.realtime_url}/v1"
+    try:
+        _install_fakes()
+        if not args.verbose:
+            for name in ("voice_agent", "worker_setup", "transcripts"):
+                logging.getLogger(name).setLevel(logging.WARNING)
+        turns = [fake_room.synthetic_speech(args.speech_s, seed=args.seed + i) for i in range(args.turns)]
+        schedule, calls, samples, shed, rejected, realtime_by_step = asyncio.run(generate(args, turns))
+    finally:
+        if mock is not None:
+            mock.terminate()
+            mock.wait(timeout=10)
+
+    steps, sustained = summarize(schedule, calls, samples, shed, rejected, realtime_by_step, args)
+    print_summary(steps, sustained)
+    ready = session_ready()
+    for kind, snapshot in ready.items():
+        print(f"Ready to talk, {kind}: {snapshot['count']} calls, p50 {snapshot['p50']}ms, p95 {snapshot['p95']}ms")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "meta": {
+                    "agent": "agent.main_entry",
+                    "time": time.time(),
+                    "cpus": os.cpu_count(),
+                    "schedule": args.schedule,
+                    "turns": args.turns,
+                    "mock_ttfa_ms": args.ttfa_ms,
+                    "seed": args.seed,
+                },
+                "sustained_calls": sustained,
+                "steps": steps,
+                "session_ready_ms": ready,
+                "samples": [{**s, "t": round(s["t"] - samples[0]["t"], 1)} for s in samples] if samples else [],
+            }, f, indent=2)
+        logger.info(f"Results written to {args.output}")
+    return 0 if all(not s["failed"] for s in steps) else 1
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, SCRIPT_DIR)
+    sys.exit(main())
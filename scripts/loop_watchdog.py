@@ -0,0 +1,266 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+import latency_metrics
+
+logger = logging.getLogger("loop_watchdog")
+logger.setLevel(logging.INFO)
+
+# Frames from these files are event-loop plumbing, not the code that blocked the loop
+_PLUMBING = (
+    os.sep + "asyncio" + os.sep,
+    os.sep + "selectors.py",
+    os.sep + "threading.py",
+    os.sep + "loop_watchdog.py",
+)
+
+
+class _WatchedLoop:
+    __slots__ = ("name", "loop", "thread_id", "expected_at", "lag", "stalls", "stall_site", "handle", "peaks")
+
+    def __init__(self, name, loop):
+        self.name = name
+        self.loop = loop
+        self.thread_id = None
+        self.expected_at = None
+        self.lag = latency_metrics.LatencyHistogram()
+        self.stalls = 0
+        self.stall_site = None
+        self.handle = None
+        # (time, lag) of recent beats with decreasing lags: the first one is the window's maximum
+        self.peaks = deque()
+
+
+class SlowSite:
+    __slots__ = ("site", "count", "total_s", "worst_s", "stack")
+
+    def __init__(self, site, stack):
+        self.site = site
+        self.count = 0
+        self.total_s = 0.0
+        self.worst_s = 0.0
+        self.stack = stack
+
+
+def _lag_summary(watched):
+    snapshot = watched.lag.snapshot()
+    summary = {"beats": snapshot.pop("count"), "stalls": watched.stalls}
+    summary.update({f"{key}_ms": round(value * 1000, 2) for key, value in snapshot.items()})
+    return summary
+
+
+class LoopWatchdog:
+    """Measures event-loop lag and names the code responsible for long stalls.
+
+    Each watched loop runs a heartbeat callback every `interval` seconds, and
+    the lag is how late that callback fires. A single monitor thread checks the
+    heartbeats. When one is more than `threshold` seconds overdue, it captures
+    the stack of the loop's thread while it is still blocked, and attributes
+    the stall to the innermost frame outside asyncio. The cost is one callback
+    per interval per loop, plus one short thread wakeup.
+
+    max_recent_lag() is the worst lag over the last `window` seconds, so a
+    stall that has just ended still counts until the window has passed.
+    """
+
+    def __init__(self, interval=0.1, threshold=0.1, max_sites=50, window=2.0):
+        self.interval = interval
+        self.threshold = threshold
+        self.window = window
+        self.max_sites = max_sites
+        self._loops = {}
+        self._sites = {}
+        self._recent = deque(maxlen=20)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def watch(self, loop, name):
+        """Start watching a loop; call from a coroutine or callback running on it"""
+        watched = _WatchedLoop(name, loop)
+        with self._lock:
+            self._loops[id(loop)] = watched
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._monitor, daemon=True, name="loop_watchdog")
+                self._thread.start()
+        watched.thread_id = threading.get_ident()
+        watched.expected_at = time.perf_counter() + self.interval
+        watched.handle = loop.call_later(self.interval, self._beat, watched)
+        return watched
+
+    def unwatch(self, loop):
+        with self._lock:
+            watched = self._loops.pop(id(loop), None)
+        if watched is not None and watched.handle is not None:
+            watched.handle.cancel()
+
+    def _beat(self, watched):
+        now = time.perf_counter()
+        lag = max(0.0, now - watched.expected_at)
+        watched.lag.record(lag)
+        with self._lock:
+            peaks = watched.peaks
+            while peaks and peaks[-1][1] <= lag:
+                peaks.pop()
+            peaks.append((now, lag))
+        site = watched.stall_site
+        if site is not None:
+            watched.stall_site = None
+            with self._lock:
+                slow = self._sites.get(site)
+                if slow is not None:
+                    slow.total_s += lag
+                    slow.worst_s = max(slow.worst_s, lag)
+            logger.warning(f"Event loop '{watched.name}' was blocked for {lag * 1000:.0f}ms at {site}")
+        if self._loops.get(id(watched.loop)) is watched:
+            watched.expected_at = now + self.interval
+            watched.handle = watched.loop.call_later(self.interval, self._beat, watched)
+
+    def _monitor(self):
+        while True:
+            time.sleep(self.interval / 2)
+            now = time.perf_counter()
+            with self._lock:
+                loops = list(self._loops.values())
+            for watched in loops:
+                if watched.loop.is_closed():
+                    self.unwatch(watched.loop)
+                elif (
+                    watched.stall_site is None
+                    and watched.expected_at is not None
+                    and now - watched.expected_at > self.threshold
+                ):
+                    self._capture(watched)
+
+    def _capture(self, watched):
+        expected_at = watched.expected_at
+        frame = sys._current_frames().get(watched.thread_id)
+        if frame is None:
+            return
+        stack = traceback.extract_stack(frame)
+        culprit = next(
+            (f for f in reversed(stack) if not any(p in f.filename for p in _PLUMBING)),
+            stack[-1] if stack else None,
+        )
+        if culprit is None:
+            return
+        site = f"{os.path.basename(culprit.filename)}:{culprit.lineno} in {culprit.name}"
+        if watched.expected_at != expected_at:
+            # The heartbeat ran while the stack was being read, so the stall is already over
+            return
+        watched.stalls += 1
+        watched.stall_site = site
+        stack_text = "".join(traceback.format_list(stack[-12:]))
+        with self._lock:
+            slow = self._sites.get(site)
+            if slow is None:
+                if len(self._sites) >= self.max_sites:
+                    # Make room by forgetting the least frequent site
+                    del self._sites[min(self._sites.values(), key=lambda s: s.count).site]
+                slow = self._sites[site] = SlowSite(site, stack_text)
+            slow.count += 1
+            self._recent.append({"loop": watched.name, "site": site, "at": time.time()})
+
+    def max_recent_lag(self):
+        """Worst lag of any watched loop within the window, including a stall still in progress"""
+        now = time.perf_counter()
+        cutoff = now - self.window
+        worst = 0.0
+        with self._lock:
+            for watched in self._loops.values():
+                peaks = watched.peaks
+                while peaks and peaks[0][0] < cutoff:
+                    peaks.popleft()
+                if peaks:
+                    worst = max(worst, peaks[0][1])
+                if watched.expected_at is not None:
+                    worst = max(worst, now - watched.expected_at)
+        return worst
+
+    def snapshot(self, top=10):
+        with self._lock:
+            loops = list(self._loops.values())
+            sites = sorted(self._sites.values(), key=lambda s: s.total_s, reverse=True)[:top]
+            recent = list(self._recent)
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "loops": {w.name: _lag_summary(w) for w in loops},
+            "top_slow_sites": [
+                {
+                    "site": s.site,
+                    "count": s.count,
+                    "total_ms": round(s.total_s * 1000, 1),
+                    "worst_ms": round(s.worst_s * 1000, 1),
+                    "stack": s.stack,
+                }
+                for s in sites
+            ],
+            "recent_stalls": recent,
+        }
+
+    def render_prometheus(self):
+        with self._lock:
+            loops = list(self._loops.values())
+        lines = [
+            "# HELP reception_event_loop_lag_seconds How late event-loop heartbeats fire",
+            "# TYPE reception_event_loop_lag_seconds summary",
+        ]
+        for watched in loops:
+            labels = f'worker="{latency_metrics.WORKER_LABEL}",loop="{latency_metrics._escape(watched.name)}"'
+            latency_metrics._summary_lines(lines, "reception_event_loop_lag_seconds", labels, watched.lag)
+        lines += [
+            "# HELP reception_event_loop_stalls_total Heartbeats more than the stall threshold late",
+            "# TYPE reception_event_loop_stalls_total counter",
+        ]
+        for watched in loops:
+            labels = f'worker="{latency_metrics.WORKER_LABEL}",loop="{latency_metrics._escape(watched.name)}"'
+            lines.append(f"reception_event_loop_stalls_total{{{labels}}} {watched.stalls}")
+        return "\n".join(lines) + "\n"
+
+
+watchdog = LoopWatchdog(
+    interval=float(os.getenv("LOOP_WATCHDOG_INTERVAL_MS", "100")) / 1000,
+    threshold=float(os.getenv("LOOP_WATCHDOG_STALL_MS", "100")) / 1000,
+    window=float(os.getenv("LOOP_WATCHDOG_WINDOW_S", "2")),
+)
+
+
+def watch_current_loop(name):
+    """Watch the running event loop under the given name"""
+    return watchdog.watch(asyncio.get_running_loop(), name)
+
+
+if __name__ == "__main__":
+    # Demo and overhead check: python loop_watchdog.py
+    import json
+
+    logging.basicConfig(level=logging.INFO)
+
+    def busy_wait(seconds):
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            pass
+
+    async def spin(iterations):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            busy_wait(0.001)
+            await asyncio.sleep(0)
+        return time.perf_counter() - started
+
+    async def main():
+        baseline = await spin(2000)
+        watch_current_loop("demo")
+        watched = await spin(2000)
+        print(f"overhead: {(watched - baseline) / baseline * 100:.2f}%")
+        await asyncio.sleep(0.2)
+        busy_wait(0.3)
+        await asyncio.sleep(0.2)
+        print(json.dumps(watchdog.snapshot(), indent=2))
+
+    asyncio.run(main())
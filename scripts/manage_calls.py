@@ -1,199 +1,328 @@
-# filepath: c:\Users\DavidJamesLennon\Documents\GitHub\livekit-voice-ai-agent-setup\scripts\manage_calls.py
-
-import argparse
-import json
-import os
-import sys
-import logging
-from dotenv import load_dotenv
-import subprocess
-from datetime import datetime, timezone
-
-def setup_logging():
-    """Set up logging configuration"""
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.StreamHandler(sys.stdout)
-        ]
-    )
-    return logging.getLogger("call_manager")
-
-def get_active_rooms(livekit_url, livekit_api_key, livekit_api_secret):
-    """Get all active rooms from LiveKit"""
-    try:
-        # Use lk CLI to list active rooms
-        result = subprocess.run(
-            [
-                'lk', 'room', 'list', 
-                '--url', livekit_url.replace("wss", "https"), 
-                '--api-key', livekit_api_key, 
-                '--api-secret', livekit_api_secret,
-                '--json'
-            ],
-            capture_output=True,
-            text=True
-        )
-        
-        if result.returncode != 0:
-            logging.error(f"Error executing room list command: {result.stderr}")
-            return []
-        
-        # Parse the JSON output
-        try:
-            rooms = json.loads(result.stdout)
-            # Filter for call rooms (those starting with "call-")
-            call_rooms = [room for room in rooms if room.get('name', '').startswith('call-')]
-            return call_rooms
-        except json.JSONDecodeError:
-            logging.error(f"Failed to parse room list output: {result.stdout}")
-            return []
-            
-    except Exception as e:
-        logging.error(f"Error getting active rooms: {str(e)}")
-        return []
-
-def get_room_participants(room_name, livekit_url, livekit_api_key, livekit_api_secret):
-    """Get participants in a specific room"""
-    try:
-        # Use lk CLI to list participants in the room
-        result = subprocess.run(
-            [
-                'lk', 'room', 'list-participants', 
-                '--room', room_name,
-                '--url', livekit_url.replace("wss", "https"), 
-                '--api-key', livekit_api_key, 
-                '--api-secret', livekit_api_secret,
-                '--json'
-            ],
-            capture_output=True,
-            text=True
-        )
-        
-        if result.returncode != 0:
-            logging.error(f"Error getting participants for room {room_name}: {result.stderr}")
-            return []
-        
-        # Parse the JSON output
-        try:
-            participants = json.loads(result.stdout)
-            return participants
-        except json.JSONDecodeError:
-            logging.error(f"Failed to parse participant list output: {result.stdout}")
-            return []
-            
-    except Exception as e:
-        logging.error(f"Error getting room participants: {str(e)}")
-        return []
-
-def end_call(room_name, livekit_url, livekit_api_key, livekit_api_secret):
-    """End a call by deleting the room"""
-    try:
-        # Use lk CLI to delete the room
-        result = subprocess.run(
-            [
-                'lk', 'room', 'delete', 
-                '--room', room_name,
-                '--url', livekit_url.replace("wss", "https"), 
-                '--api-key', livekit_api_key, 
-                '--api-secret', livekit_api_secret
-            ],
-            capture_output=True,
-            text=True
-        )
-        
-        if result.returncode != 0:
-            logging.error(f"Error ending call in room {room_name}: {result.stderr}")
-            return False
-        
-        logging.info(f"Successfully ended call in room {room_name}")
-        return True
-            
-    except Exception as e:
-        logging.error(f"Error ending call: {str(e)}")
-        return False
-
-def list_active_calls(livekit_url, livekit_api_key, livekit_api_secret):
-    """List all active calls"""
-    logger = logging.getLogger("call_manager")
-    rooms = get_active_rooms(livekit_url, livekit_api_key, livekit_api_secret)
-    
-    if not rooms:
-        logger.info("No active calls found")
-        return
-    
-    logger.info(f"Found {len(rooms)} active calls:")
-    for i, room in enumerate(rooms):
-        room_name = room.get('name')
-        created_at = room.get('created_at')
-        
-        # Get participants
-        participants = get_room_participants(room_name, livekit_url, livekit_api_key, livekit_api_secret)
-        participant_count = len(participants)
-        
-        # Format created time
-        try:
-            created_time = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-            time_str = created_time.strftime("%Y-%m-%d %H:%M:%S")
-        except (ValueError, AttributeError):
-            time_str = "Unknown"
-        
-        logger.info(f"{i+1}. Room: {room_name}")
-        logger.info(f"   Created: {time_str}")
-        logger.info(f"   Participants: {participant_count}")
-        
-        # Show participant details
-        for p in participants:
-            identity = p.get('identity', 'Unknown')
-            joined_at = p.get('joined_at', 'Unknown')
-            
-            # Format joined time
-            try:
-                joined_time = datetime.fromisoformat(joined_at.replace('Z', '+00:00'))
-                joined_str = joined_time.strftime("%Y-%m-%d %H:%M:%S")
-            except (ValueError, AttributeError):
-                joined_str = "Unknown"
-                
-            logger.info(f"   - {identity} (joined: {joined_str})")
-        
-        logger.info("---")
-
-def main():
-    """Main entry point for the call management script"""
-    load_dotenv()
-    logger = setup_logging()
-    
-    # Parse command line arguments
-    parser = argparse.ArgumentParser(description='Manage LiveKit voice agent calls')
-    parser.add_argument('action', choices=['list', 'end'], help='Action to perform (list or end calls)')
-    parser.add_argument('--room', help='Room name for the "end" action')
-    
-    args = parser.parse_args()
-    
-    # Get LiveKit credentials from environment
-    livekit_url = os.getenv("LIVEKIT_URL")
-    livekit_api_key = os.getenv("LIVEKIT_API_KEY")
-    livekit_api_secret = os.getenv("LIVEKIT_API_SECRET")
-    
-    if not all([livekit_url, livekit_api_key, livekit_api_secret]):
-        logger.error("Missing LiveKit credentials in environment variables")
-        sys.exit(1)
-        
-    # Execute the requested action
-    if args.action == 'list':
-        list_active_calls(livekit_url, livekit_api_key, livekit_api_secret)
-    elif args.action == 'end':
-        if not args.room:
-            logger.error("Room name is required for 'end' action")
-            sys.exit(1)
-        
-        success = end_call(args.room, livekit_url, livekit_api_key, livekit_api_secret)
-        if success:
-            logger.info(f"Successfully ended call in room {args.room}")
-        else:
-            logger.error(f"Failed to end call in room {args.room}")
-            sys.exit(1)
-
-if __name__ == "__main__":
-    main()
+# filepath: c:\Users\DavidJamesLennon\Documents\GitHub\livekit-voice-ai-agent-setup\scripts\manage_calls.py
+
+import argparse
+import asyncio
+import fnmatch
+import json
+import os
+import shutil
+import sys
+import logging
+import time
+from datetime import datetime, timezone
+
+import aiohttp
+from dotenv import load_dotenv
+from livekit import api
+
+# Rooms created by the SIP dispatch rule for inbound calls
+CALL_ROOM_PREFIX = "call-"
+DEFAULT_CONCURRENCY = 10
+
+
+def setup_logging():
+    """Set up logging configuration"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+    return logging.getLogger("call_manager")
+
+
+def format_timestamp(seconds):
+    if not seconds:
+        return "Unknown"
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class CallManager:
+    """LiveKit room service client sharing one pooled HTTP session for all requests.
+
+    At most `concurrency` requests are in flight at once, so listing hundreds of
+    calls fans out without flooding the server.
+    """
+
+    def __init__(self, livekit_url, livekit_api_key, livekit_api_secret,
+                 concurrency=DEFAULT_CONCURRENCY, timeout=10.0):
+        self.livekit_url = livekit_url
+        self.livekit_api_key = livekit_api_key
+        self.livekit_api_secret = livekit_api_secret
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.logger = logging.getLogger("call_manager")
+        self._session = None
+        self._semaphore = None
+        self.api = None
+
+    async def __aenter__(self):
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.api = api.LiveKitAPI(
+            self.livekit_url, self.livekit_api_key, self.livekit_api_secret, session=self._session
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._session.close()
+
+    async def get_active_rooms(self, names=None):
+        """Get all active call rooms (those starting with "call-")"""
+        try:
+            async with self._semaphore:
+                response = await self.api.room.list_rooms(api.ListRoomsRequest(names=names or []))
+        except (api.TwirpError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.logger.error(f"Error getting active rooms: {e}")
+            return None
+        return [room for room in response.rooms if room.name.startswith(CALL_ROOM_PREFIX)]
+
+    async def get_room_participants(self, room_name):
+        """Get participants in a specific room"""
+        try:
+            async with self._semaphore:
+                response = await self.api.room.list_participants(api.ListParticipantsRequest(room=room_name))
+        except (api.TwirpError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.logger.error(f"Error getting participants for room {room_name}: {e}")
+            return []
+        return list(response.participants)
+
+    async def list_active_calls(self):
+        """Every active call with its participants, fetched concurrently; None if rooms could not be listed"""
+        rooms = await self.get_active_rooms()
+        if rooms is None:
+            return None
+        participants = await asyncio.gather(*(self.get_room_participants(room.name) for room in rooms))
+        return [call_to_dict(room, p) for room, p in zip(rooms, participants)]
+
+    async def end_call(self, room_name):
+        """End a call by deleting the room"""
+        try:
+            async with self._semaphore:
+                await self.api.room.delete_room(api.DeleteRoomRequest(room=room_name))
+        except (api.TwirpError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.logger.error(f"Error ending call in room {room_name}: {e}")
+            return False
+        self.logger.info(f"Successfully ended call in room {room_name}")
+        return True
+
+    async def end_calls(self, room_names):
+        """End several calls concurrently; returns {room_name: ended}"""
+        results = await asyncio.gather(*(self.end_call(name) for name in room_names))
+        return dict(zip(room_names, results))
+
+
+def call_to_dict(room, participants):
+    return {
+        "room": room.name,
+        "sid": room.sid,
+        "created_at": room.creation_time,
+        "duration_s": max(0, int(time.time()) - room.creation_time) if room.creation_time else None,
+        "num_participants": len(participants),
+        "participants": [
+            {"identity": p.identity, "name": p.name, "joined_at": p.joined_at}
+            for p in participants
+        ],
+    }
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "-"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+class CallWatcher:
+    """Keeps an up-to-date view of active calls with as few API requests as possible.
+
+    Each poll lists rooms once. Participants are re-fetched only for rooms that
+    are new or whose participant count or server-side version changed since the
+    previous poll, so a quiet system costs one request per interval.
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.calls = {}
+        self._versions = {}
+        self.polls = 0
+        self.requests = 0
+
+    @staticmethod
+    def _room_version(room):
+        return (room.num_participants, room.version.unix_micro, room.version.ticks)
+
+    async def poll(self):
+        """Refresh the view; returns (started, ended, changed) room names, or None if listing failed"""
+        rooms = await self.manager.get_active_rooms()
+        self.requests += 1
+        if rooms is None:
+            return None
+        self.polls += 1
+        current = {room.name: room for room in rooms}
+        ended = [name for name in self.calls if name not in current]
+        for name in ended:
+            del self.calls[name]
+            del self._versions[name]
+        stale = [room for room in rooms if self._versions.get(room.name) != self._room_version(room)]
+        participants = await asyncio.gather(*(self.manager.get_room_participants(room.name) for room in stale))
+        self.requests += len(stale)
+        started, changed = [], []
+        for room, room_participants in zip(stale, participants):
+            (changed if room.name in self.calls else started).append(room.name)
+            self.calls[room.name] = call_to_dict(room, room_participants)
+            self._versions[room.name] = self._room_version(room)
+        return started, ended, changed
+
+    def render(self, width=100):
+        """Terminal table of calls, longest running first"""
+        now = time.time()
+        lines = [
+            f"{len(self.calls)} active calls   polls {self.polls}   API requests {self.requests}   "
+            f"{datetime.now().strftime('%H:%M:%S')}",
+            "",
+            f"{'DURATION':>9}  {'PARTS':>5}  {'ROOM':<44}  PARTICIPANTS",
+        ]
+        for call in sorted(self.calls.values(), key=lambda c: c["created_at"] or now):
+            duration = now - call["created_at"] if call["created_at"] else None
+            identities = ", ".join(p["identity"] for p in call["participants"])
+            line = f"{format_duration(duration):>9}  {call['num_participants']:>5}  {call['room']:<44}  {identities}"
+            lines.append(line[:width])
+        return "\n".join(lines)
+
+
+async def watch_calls(manager, interval, as_json):
+    """Poll until interrupted, redrawing the table or emitting one JSON line per change"""
+    watcher = CallWatcher(manager)
+    while True:
+        started_at = time.monotonic()
+        diff = await watcher.poll()
+        if diff is not None:
+            started, ended, changed = diff
+            if as_json:
+                if started or ended or changed or watcher.polls == 1:
+                    print(json.dumps({
+                        "time": time.time(),
+                        "started": [watcher.calls[name] for name in started],
+                        "ended": ended,
+                        "changed": [watcher.calls[name] for name in changed],
+                        "active": len(watcher.calls),
+                    }), flush=True)
+            else:
+                width = shutil.get_terminal_size().columns
+                # Clear the screen and redraw from the top left
+                sys.stdout.write("\x1b[H\x1b[2J" + watcher.render(width) + "\n")
+                sys.stdout.flush()
+        await asyncio.sleep(max(0.0, interval - (time.monotonic() - started_at)))
+
+
+def print_calls(calls, logger):
+    """Log a human-readable listing of calls"""
+    if not calls:
+        logger.info("No active calls found")
+        return
+
+    logger.info(f"Found {len(calls)} active calls:")
+    for i, call in enumerate(calls):
+        logger.info(f"{i+1}. Room: {call['room']}")
+        logger.info(f"   Created: {format_timestamp(call['created_at'])}")
+        logger.info(f"   Participants: {call['num_participants']}")
+
+        # Show participant details
+        for p in call["participants"]:
+            logger.info(f"   - {p['identity'] or 'Unknown'} (joined: {format_timestamp(p['joined_at'])})")
+
+        logger.info("---")
+
+
+async def run(args, livekit_url, livekit_api_key, livekit_api_secret):
+    logger = logging.getLogger("call_manager")
+    async with CallManager(livekit_url, livekit_api_key, livekit_api_secret, args.concurrency) as manager:
+        if args.action == 'watch':
+            try:
+                await watch_calls(manager, args.interval, args.json)
+            except asyncio.CancelledError:
+                pass
+            return 0
+
+        if args.action == 'list':
+            calls = await manager.list_active_calls()
+            if calls is None:
+                return 1
+            if args.json:
+                print(json.dumps(calls, indent=2))
+            else:
+                print_calls(calls, logger)
+            return 0
+
+        # end: explicit rooms, or every call room matching a filter
+        room_names = list(args.room or [])
+        if args.filter or args.all:
+            rooms = await manager.get_active_rooms()
+            if rooms is None:
+                return 1
+            pattern = args.filter or "*"
+            room_names += [room.name for room in rooms if fnmatch.fnmatchcase(room.name, pattern)]
+        room_names = list(dict.fromkeys(room_names))
+        if not room_names:
+            logger.info("No matching calls to end")
+            return 0
+
+        results = await manager.end_calls(room_names)
+        failed = [name for name, ended in results.items() if not ended]
+        if args.json:
+            print(json.dumps({"ended": [n for n, ok in results.items() if ok], "failed": failed}, indent=2))
+        else:
+            logger.info(f"Ended {len(results) - len(failed)} of {len(results)} calls")
+            for name in failed:
+                logger.error(f"Failed to end call in room {name}")
+        return 1 if failed else 0
+
+
+def main():
+    """Main entry point for the call management script"""
+    load_dotenv()
+    logger = setup_logging()
+
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(description='Manage LiveKit voice agent calls')
+    parser.add_argument('action', choices=['list', 'watch', 'end'],
+                        help='Action to perform (list calls once, watch them live, or end calls)')
+    parser.add_argument('--room', action='append', help='Room name for the "end" action (repeatable)')
+    parser.add_argument('--filter', help='End every call whose room name matches this glob pattern')
+    parser.add_argument('--all', action='store_true', help='End every active call')
+    parser.add_argument('--json', action='store_true', help='Print machine-readable JSON to stdout')
+    parser.add_argument('--interval', type=float, default=2.0, help='Seconds between polls for "watch"')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help='Maximum API requests in flight at once')
+
+    args = parser.parse_args()
+    if args.json:
+        # Keep stdout clean for the JSON document
+        logging.getLogger().handlers[0].setStream(sys.stderr)
+
+    # Get LiveKit credentials from environment
+    livekit_url = os.getenv("LIVEKIT_URL")
+    livekit_api_key = os.getenv("LIVEKIT_API_KEY")
+    livekit_api_secret = os.getenv("LIVEKIT_API_SECRET")
+
+    if not all([livekit_url, livekit_api_key, livekit_api_secret]):
+        logger.error("Missing LiveKit credentials in environment variables")
+        sys.exit(1)
+
+    if args.action == 'end' and not (args.room or args.filter or args.all):
+        logger.error("The 'end' action needs --room, --filter or --all")
+        sys.exit(1)
+
+    try:
+        sys.exit(asyncio.run(run(args, livekit_url, livekit_api_key, livekit_api_secret)))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
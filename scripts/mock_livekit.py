@@ -0,0 +1,200 @@
+"""Local stand-in for the LiveKit RoomService API, for exercising the ops scripts offline.
+
+Serves the Twirp endpoints manage_calls.py uses (ListRooms, ListParticipants,
+DeleteRoom) and the SIP trunk and dispatch rule endpoints trunk.py uses. All
+responses are protobuf. Rooms are synthetic calls, and every request gets an
+artificial latency. Any API key and secret are accepted. The server counts
+requests per method, so a client's API usage can be measured.
+
+    python mock_livekit.py --rooms 50 --latency-ms 20 --port 7880
+    LIVEKIT_URL=http://localhost:7880 LIVEKIT_API_KEY=dev LIVEKIT_API_SECRET=dev python manage_calls.py list
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+from livekit import api
+
+logger = logging.getLogger("mock_livekit")
+logger.setLevel(logging.INFO)
+
+_PREFIX = "/twirp/livekit.RoomService/"
+_SIP_PREFIX = "/twirp/livekit.SIP/"
+
+
+class MockLiveKit:
+    """In-memory rooms and participants behind a Twirp RoomService"""
+
+    def __init__(self, rooms=10, latency=0.0, churn=0.0):
+        self.latency = latency
+        self.churn = churn
+        self.requests = Counter()
+        self.rooms = {}
+        self.participants = {}
+        self._next_room = 0
+        self.inbound_trunks = {}
+        self.dispatch_rules = {}
+        self._next_sip_id = 0
+        for _ in range(rooms):
+            self.add_call()
+
+    def add_call(self):
+        """Create a call room with a SIP caller and the agent in it"""
+        self._next_room += 1
+        name = f"call-_+4470000{self._next_room:05d}_{random.randrange(16 ** 8):08x}"
+        now = int(time.time()) - random.randrange(0, 600)
+        self.rooms[name] = api.Room(
+            sid=f"RM_{self._next_room}", name=name, creation_time=now, num_participants=2,
+        )
+        self.participants[name] = [
+            api.ParticipantInfo(identity=f"sip_+4470000{self._next_room:05d}", joined_at=now + 1, name="Caller"),
+            api.ParticipantInfo(identity=f"agent-AJ_{self._next_room}", joined_at=now + 1, name="pi-receptionist"),
+        ]
+        return name
+
+    def tick(self):
+        """Randomly end, start and update calls so that pollers see changes"""
+        for name in list(self.rooms):
+            if random.random() < self.churn:
+                self.delete(name)
+                self.add_call()
+            elif random.random() < self.churn:
+                # Someone joined or left: the participant count and room version change
+                room = self.rooms[name]
+                room.num_participants = 3 if room.num_participants == 2 else 2
+                room.version.unix_micro = int(time.time() * 1e6)
+                room.version.ticks += 1
+
+    def delete(self, name):
+        self.rooms.pop(name, None)
+        self.participants.pop(name, None)
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        self.requests[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        body = await request.read()
+        if method == "ListRooms":
+            req = api.ListRoomsRequest.FromString(body)
+            rooms = [r for n, r in self.rooms.items() if not req.names or n in req.names]
+            resp = api.ListRoomsResponse(rooms=rooms)
+        elif method == "ListParticipants":
+            req = api.ListParticipantsRequest.FromString(body)
+            resp = api.ListParticipantsResponse(participants=self.participants.get(req.room, []))
+        elif method == "DeleteRoom":
+            req = api.DeleteRoomRequest.FromString(body)
+            if req.room not in self.rooms:
+                return _twirp_error(404, "not_found", "requested room does not exist")
+            self.delete(req.room)
+            resp = api.DeleteRoomResponse()
+        else:
+            return _twirp_error(404, "bad_route", f"no handler for {method}")
+        return web.Response(body=resp.SerializeToString(), content_type="application/protobuf")
+
+    def _sip_id(self, prefix):
+        self._next_sip_id += 1
+        return f"{prefix}_{self._next_sip_id:08d}"
+
+    async def handle_sip(self, request):
+        method = request.match_info["method"]
+        self.requests[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        body = await request.read()
+        if method == "ListSIPInboundTrunk":
+            req = api.ListSIPInboundTrunkRequest.FromString(body)
+            items = [t for i, t in self.inbound_trunks.items() if not req.trunk_ids or i in req.trunk_ids]
+            resp = api.ListSIPInboundTrunkResponse(items=items)
+        elif method == "CreateSIPInboundTrunk":
+            trunk = api.CreateSIPInboundTrunkRequest.FromString(body).trunk
+            trunk.sip_trunk_id = self._sip_id("ST")
+            trunk.created_at.GetCurrentTime()
+            self.inbound_trunks[trunk.sip_trunk_id] = resp = trunk
+        elif method == "UpdateSIPInboundTrunk":
+            req = api.UpdateSIPInboundTrunkRequest.FromString(body)
+            if req.sip_trunk_id not in self.inbound_trunks:
+                return _twirp_error(404, "not_found", "requested trunk does not exist")
+            self.inbound_trunks[req.sip_trunk_id] = resp = req.replace
+        elif method == "DeleteSIPTrunk":
+            req = api.DeleteSIPTrunkRequest.FromString(body)
+            if self.inbound_trunks.pop(req.sip_trunk_id, None) is None:
+                return _twirp_error(404, "not_found", "requested trunk does not exist")
+            resp = api.SIPTrunkInfo(sip_trunk_id=req.sip_trunk_id)
+        elif method == "ListSIPDispatchRule":
+            req = api.ListSIPDispatchRuleRequest.FromString(body)
+            items = [
+                r for i, r in self.dispatch_rules.items()
+                if not req.dispatch_rule_ids or i in req.dispatch_rule_ids
+            ]
+            resp = api.ListSIPDispatchRuleResponse(items=items)
+        elif method == "CreateSIPDispatchRule":
+            rule = api.CreateSIPDispatchRuleRequest.FromString(body).dispatch_rule
+            rule.sip_dispatch_rule_id = self._sip_id("SDR")
+            rule.created_at.GetCurrentTime()
+            self.dispatch_rules[rule.sip_dispatch_rule_id] = resp = rule
+        elif method == "UpdateSIPDispatchRule":
+            req = api.UpdateSIPDispatchRuleRequest.FromString(body)
+            if req.sip_dispatch_rule_id not in self.dispatch_rules:
+                return _twirp_error(404, "not_found", "requested dispatch rule does not exist")
+            self.dispatch_rules[req.sip_dispatch_rule_id] = resp = req.replace
+        elif method == "DeleteSIPDispatchRule":
+            req = api.DeleteSIPDispatchRuleRequest.FromString(body)
+            resp = self.dispatch_rules.pop(req.sip_dispatch_rule_id, None)
+            if resp is None:
+                return _twirp_error(404, "not_found", "requested dispatch rule does not exist")
+        else:
+            return _twirp_error(404, "bad_route", f"no handler for {method}")
+        return web.Response(body=resp.SerializeToString(), content_type="application/protobuf")
+
+    async def stats(self, request):
+        return web.json_response({
+            "rooms": len(self.rooms),
+            "inbound_trunks": len(self.inbound_trunks),
+            "dispatch_rules": len(self.dispatch_rules),
+            "requests": dict(self.requests),
+        })
+
+    def app(self):
+        app = web.Application()
+        app.add_routes([
+            web.post(_PREFIX + "{method}", self.handle),
+            web.post(_SIP_PREFIX + "{method}", self.handle_sip),
+            web.get("/mock/stats", self.stats),
+        ])
+        return app
+
+    async def serve(self, host="127.0.0.1", port=7880, tick_interval=1.0):
+        runner = web.AppRunner(self.app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info(f"Mock LiveKit serving {len(self.rooms)} rooms at http://{host}:{port}")
+        try:
+            while True:
+                await asyncio.sleep(tick_interval)
+                self.tick()
+        finally:
+            await runner.cleanup()
+
+
+def _twirp_error(status, code, msg):
+    return web.Response(status=status, text=json.dumps({"code": code, "msg": msg}), content_type="application/json")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Added to every API request")
+    parser.add_argument("--churn", type=float, default=0.0, help="Chance per room per second that the call ends")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7880)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    mock = MockLiveKit(rooms=args.rooms, latency=args.latency_ms / 1000, churn=args.churn)
+    asyncio.run(mock.serve(args.host, args.port))
@@ -0,0 +1,333 @@
+"""Local stand-in for the OpenAI Realtime API, for running the realtime agent offline.
+
+Speaks enough of the realtime websocket protocol for the livekit openai plugin:
+session updates, input audio with an energy-based server VAD, input
+transcription, conversation items, and responses whose audio is streamed back as
+a tone after a configurable time to first audio. Any API key is accepted.
+
+Every session counts the audio it receives. Gaps between input audio appends
+that are much longer than the client's chunk size mean that the worker fell
+behind in forwarding the caller's audio. /stats reports these totals.
+
+    python mock_realtime.py --port 8765 --ttfa-ms 300
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=dev python agent.py dev
+"""
+
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import logging
+import time
+
+import numpy as np
+from aiohttp import WSMsgType, web
+
+logger = logging.getLogger("mock_realtime")
+logger.setLevel(logging.INFO)
+
+SAMPLE_RATE = 24000
+# Input audio chunks quieter than this RMS level count as silence
+SPEECH_RMS = 500.0
+# Appends further apart than this are late; the plugin sends 100ms chunks
+LATE_APPEND_S = 0.25
+
+DEFAULT_REPLY = (
+    "Hello, you've reached PI and Other Tales. Fortunes Told is out on June 19th, "
+    "and you can pre-order it now at Waterstones, Foyles and Amazon."
+)
+
+_ids = itertools.count(1)
+
+
+def _id(prefix):
+    return f"{prefix}_{next(_ids):08d}"
+
+
+class MockRealtime:
+    """Realtime sessions, their settings and the totals served on /stats"""
+
+    def __init__(self, ttfa=0.3, transcription=0.2, reply=DEFAULT_REPLY, words_per_s=2.7,
+                 chunk_ms=100, rtf=0.2):
+        self.ttfa = ttfa
+        self.transcription = transcription
+        self.reply = reply
+        self.words_per_s = words_per_s
+        self.chunk_ms = chunk_ms
+        self.rtf = rtf
+        t = np.arange(SAMPLE_RATE * chunk_ms // 1000) / SAMPLE_RATE
+        tone = (np.sin(2 * np.pi * 220 * t) * 3000).astype(np.int16).tobytes()
+        self.audio_chunk = base64.b64encode(tone).decode()
+        self.stats = {
+            "sessions": 0, "active_sessions": 0, "responses": 0, "responses_cancelled": 0,
+            "audio_in_s": 0.0, "appends": 0, "late_appends": 0, "max_append_gap_ms": 0.0,
+        }
+
+    async def handle(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        session = Session(self, ws, request.query.get("model", "gpt-4o-realtime-preview"))
+        self.stats["sessions"] += 1
+        self.stats["active_sessions"] += 1
+        try:
+            await session.run()
+        finally:
+            self.stats["active_sessions"] -= 1
+        return ws
+
+    async def handle_stats(self, request):
+        return web.json_response({**self.stats, "audio_in_s": round(self.stats["audio_in_s"], 2)})
+
+
+class Session:
+    def __init__(self, server, ws, model):
+        self.server = server
+        self.ws = ws
+        self.id = _id("sess")
+        self.settings = {
+            "id": self.id, "object": "realtime.session", "model": model,
+            "modalities": ["text", "audio"], "instructions": "", "voice": "alloy",
+            "input_audio_format": "pcm16", "output_audio_format": "pcm16",
+            "input_audio_transcription": None,
+            "turn_detection": {
+                "type": "server_vad", "threshold": 0.5, "prefix_padding_ms": 300,
+                "silence_duration_ms": 500, "create_response": True,
+            },
+            "tools": [], "tool_choice": "auto", "temperature": 0.8, "max_response_output_tokens": "inf",
+        }
+        self.last_item_id = None
+        self.item_id = None
+        self.response_task = None
+        self.tasks = set()
+        # Server VAD state, in seconds of input audio
+        self.audio_pos = 0.0
+        self.speaking = False
+        self.speech_started_at = 0.0
+        self.silence = 0.0
+        self.last_append = None
+
+    async def send(self, event):
+        event.setdefault("event_id", _id("event"))
+        if not self.ws.closed:
+            await self.ws.send_json(event)
+
+    def spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def run(self):
+        await self.send({"type": "session.created", "session": self.settings})
+        try:
+            async for msg in self.ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                event = json.loads(msg.data)
+                handler = getattr(self, "on_" + event["type"].replace(".", "_"), None)
+                if handler is None:
+                    await self.send({"type": "error", "error": {
+                        "type": "invalid_request_error", "code": "unknown_event",
+                        "message": f"Unsupported event {event['type']}", "param": None,
+                    }})
+                    continue
+                await handler(event)
+        finally:
+            for task in list(self.tasks):
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def on_session_update(self, event):
+        self.settings.update({k: v for k, v in event["session"].items() if k in self.settings})
+        await self.send({"type": "session.updated", "session": self.settings})
+
+    async def on_input_audio_buffer_append(self, event):
+        now = time.perf_counter()
+        stats = self.server.stats
+        if self.last_append is not None:
+            gap = now - self.last_append
+            stats["max_append_gap_ms"] = max(stats["max_append_gap_ms"], round(gap * 1000, 1))
+            if gap > LATE_APPEND_S:
+                stats["late_appends"] += 1
+        self.last_append = now
+        samples = np.frombuffer(base64.b64decode(event["audio"]), dtype=np.int16)
+        duration = len(samples) / SAMPLE_RATE
+        stats["appends"] += 1
+        stats["audio_in_s"] += duration
+        self.audio_pos += duration
+
+        vad = self.settings["turn_detection"]
+        if vad is None:
+            return
+        voiced = len(samples) and float(np.sqrt(np.mean(samples.astype(np.float32) ** 2))) > SPEECH_RMS
+        if voiced:
+            self.silence = 0.0
+            if not self.speaking:
+                self.speaking = True
+                self.speech_started_at = self.audio_pos - duration
+                self.item_id = _id("item")
+                await self.send({
+                    "type": "input_audio_buffer.speech_started",
+                    "audio_start_ms": int(self.speech_started_at * 1000), "item_id": self.item_id,
+                })
+        elif self.speaking:
+            self.silence += duration
+            if self.silence * 1000 >= vad["silence_duration_ms"]:
+                self.speaking = False
+                await self.end_of_speech(vad)
+
+    async def end_of_speech(self, vad):
+        item_id, self.item_id = self.item_id or _id("item"), None
+        await self.send({
+            "type": "input_audio_buffer.speech_stopped",
+            "audio_end_ms": int(self.audio_pos * 1000), "item_id": item_id,
+        })
+        previous, self.last_item_id = self.last_item_id, item_id
+        await self.send({"type": "input_audio_buffer.committed", "previous_item_id": previous, "item_id": item_id})
+        await self.send({
+            "type": "conversation.item.created", "previous_item_id": previous,
+            "item": {
+                "id": item_id, "object": "realtime.item", "type": "message", "status": "completed",
+                "role": "user", "content": [{"type": "input_audio", "transcript": None}],
+            },
+        })
+        if self.settings["input_audio_transcription"] is not None:
+            self.spawn(self.transcribe(item_id, self.audio_pos - self.speech_started_at))
+        if vad.get("create_response", True):
+            self.start_response()
+
+    async def transcribe(self, item_id, speech_s):
+        await asyncio.sleep(self.server.transcription)
+        await self.send({
+            "type": "conversation.item.input_audio_transcription.completed",
+            "item_id": item_id, "content_index": 0,
+            "transcript": f"(caller speech, {speech_s:.1f}s)",
+        })
+
+    async def on_input_audio_buffer_clear(self, event):
+        self.speaking = False
+        await self.send({"type": "input_audio_buffer.cleared"})
+
+    async def on_input_audio_buffer_commit(self, event):
+        self.speaking = False
+        await self.end_of_speech({"create_response": False})
+
+    async def on_conversation_item_create(self, event):
+        item = dict(event["item"])
+        item.setdefault("id", _id("item"))
+        previous = event.get("previous_item_id") or self.last_item_id
+        self.last_item_id = item["id"]
+        await self.send({"type": "conversation.item.created", "previous_item_id": previous, "item": item})
+
+    async def on_conversation_item_truncate(self, event):
+        await self.send({
+            "type": "conversation.item.truncated", "item_id": event["item_id"],
+            "content_index": event["content_index"], "audio_end_ms": event["audio_end_ms"],
+        })
+
+    async def on_conversation_item_delete(self, event):
+        await self.send({"type": "conversation.item.deleted", "item_id": event["item_id"]})
+
+    async def on_response_create(self, event):
+        self.start_response()
+
+    async def on_response_cancel(self, event):
+        if self.response_task is not None and not self.response_task.done():
+            self.response_task.cancel()
+
+    def start_response(self):
+        if self.response_task is not None and not self.response_task.done():
+            # Like the real API, one response at a time per session
+            self.spawn(self.send({"type": "error", "error": {
+                "type": "invalid_request_error", "code": "conversation_already_has_active_response",
+                "message": "Conversation already has an active response", "param": None,
+            }}))
+            return
+        self.response_task = self.spawn(self.respond())
+
+    async def respond(self):
+        server = self.server
+        server.stats["responses"] += 1
+        response_id, item_id = _id("resp"), _id("item")
+        response = {"id": response_id, "object": "realtime.response", "status": "in_progress",
+                    "status_details": None, "output": [], "usage": None}
+        await self.send({"type": "response.created", "response": response})
+        pointer = {"response_id": response_id, "item_id": item_id, "output_index": 0, "content_index": 0}
+        item = {"id": item_id, "object": "realtime.item", "type": "message", "status": "in_progress",
+                "role": "assistant", "content": []}
+        words = server.reply.split()
+        chunks = max(1, round(len(words) / server.words_per_s * 1000 / server.chunk_ms))
+        sent_words = 0
+        status = "completed"
+        started = False
+        try:
+            await asyncio.sleep(server.ttfa)
+            await self.send({"type": "response.output_item.added", "response_id": response_id,
+                             "output_index": 0, "item": item})
+            previous, self.last_item_id = self.last_item_id, item_id
+            await self.send({"type": "conversation.item.created", "previous_item_id": previous, "item": item})
+            await self.send({"type": "response.content_part.added", **pointer,
+                             "part": {"type": "audio", "transcript": ""}})
+            started = True
+            for i in range(chunks):
+                if i:
+                    await asyncio.sleep(server.chunk_ms / 1000 * server.rtf)
+                await self.send({"type": "response.audio.delta", **pointer, "delta": server.audio_chunk})
+                upto = round((i + 1) * len(words) / chunks)
+                if upto > sent_words:
+                    text = " ".join(words[sent_words:upto])
+                    await self.send({"type": "response.audio_transcript.delta", **pointer,
+                                     "delta": (" " if sent_words else "") + text})
+                    sent_words = upto
+        except asyncio.CancelledError:
+            status = "cancelled"
+            server.stats["responses_cancelled"] += 1
+        transcript = " ".join(words[:sent_words])
+        item = {**item, "status": "completed" if status == "completed" else "incomplete",
+                "content": [{"type": "audio", "transcript": transcript}]}
+        if started:
+            await self.send({"type": "response.audio.done", **pointer})
+            await self.send({"type": "response.audio_transcript.done", **pointer, "transcript": transcript})
+            await self.send({"type": "response.content_part.done", **pointer,
+                             "part": {"type": "audio", "transcript": transcript}})
+            await self.send({"type": "response.output_item.done", "response_id": response_id,
+                             "output_index": 0, "item": item})
+        output_tokens = sent_words * 2
+        await self.send({"type": "response.done", "response": {
+            **response, "status": status,
+            "status_details": {"type": status, "reason": "client_cancelled"} if status == "cancelled" else None,
+            "output": [item] if started else [],
+            "usage": {"total_tokens": 200 + output_tokens, "input_tokens": 200, "output_tokens": output_tokens,
+                      "input_token_details": {"text_tokens": 200, "audio_tokens": 0, "cached_tokens": 0},
+                      "output_token_details": {"text_tokens": sent_words, "audio_tokens": sent_words}},
+        }})
+
+
+def build_app(mock):
+    app = web.Application()
+    app.router.add_get("/v1/realtime", mock.handle)
+    app.router.add_get("/stats", mock.handle_stats)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ttfa-ms", type=float, default=300.0, help="Time from response.create to first audio")
+    parser.add_argument("--transcription-ms", type=float, default=200.0)
+    parser.add_argument("--reply", default=DEFAULT_REPLY, help="Text of every response; sets its audio length")
+    parser.add_argument("--rtf", type=float, default=0.2, help="Generation time per second of reply audio")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    mock = MockRealtime(
+        ttfa=args.ttfa_ms / 1000, transcription=args.transcription_ms / 1000, reply=args.reply, rtf=args.rtf,
+    )
+    logger.info(f"Serving a mock realtime API on ws://{args.host}:{args.port}/v1/realtime")
+    web.run_app(build_app(mock), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
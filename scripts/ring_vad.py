@@ -0,0 +1,422 @@
+"""Silero VAD over a preallocated ring buffer of int16 samples.
+
+The Silero plugin's stream combines the pending frames into new frames for every
+32ms inference window. It copies the window into a speech buffer, turns the
+leftovers back into frames, and hops to a thread of its own for each inference.
+RingVADStream writes each incoming frame once into a preallocated ring and
+works on views of it from then on:
+
+- Inference windows are read straight from the ring and scaled to float32 in
+  place. When the input rate differs from the model's, for example 8 kHz
+  telephony audio, they are resampled with vectorized linear interpolation.
+- All the windows available when the stream gets to run are inferred in one
+  executor call, so under load there is one thread hop per batch of windows.
+- Speech segments are positions in the ring. Their audio is only copied out
+  when a START_OF_SPEECH or END_OF_SPEECH event needs it, and INFERENCE_DONE
+  events carry no audio.
+
+Events follow the Silero plugin's rules and options. One difference is that the
+model's recurrent state is carried from one window to the next.
+
+    python ring_vad.py [calls] [seconds]   # CPU and GC comparison with silero.VAD
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from livekit import rtc
+from livekit.agents import utils, vad
+from livekit.agents.utils.aio.channel import ChanClosed, ChanEmpty
+
+logger = logging.getLogger("ring_vad")
+logger.setLevel(logging.INFO)
+
+ENABLED = os.getenv("VAD_RING", "1") != "0"
+# Windows inferred per executor call at most; more stay queued for the next call
+MAX_BATCH_WINDOWS = int(os.getenv("VAD_MAX_BATCH_WINDOWS", "16"))
+# Seconds of input beyond max_buffered_speech and the prefix padding that the ring holds
+RING_SLACK_S = 2.0
+INT16_SCALE = 1.0 / 32768.0
+
+# Inference for every stream in the process; onnxruntime sessions can be run from several threads
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("VAD_INFERENCE_THREADS", str(min(4, os.cpu_count() or 1)))),
+    thread_name_prefix="ring-vad",
+)
+
+
+class AudioRing:
+    """Preallocated int16 ring holding the most recent samples, addressed by absolute sample position"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity, dtype=np.int16)
+        self.end = 0  # absolute position just past the newest sample
+
+    @property
+    def start(self):
+        """Oldest position still in the ring"""
+        return max(0, self.end - self.capacity)
+
+    def write(self, data):
+        """Copy int16 samples in, from any buffer (an AudioFrame's data is a memoryview)"""
+        samples = np.frombuffer(data, dtype=np.int16)
+        n = len(samples)
+        if n > self.capacity:
+            self.end += n - self.capacity
+            samples = samples[-self.capacity:]
+            n = self.capacity
+        i = self.end % self.capacity
+        first = min(n, self.capacity - i)
+        self.buffer[i:i + first] = samples[:first]
+        self.buffer[:n - first] = samples[first:]
+        self.end += n
+
+    def scaled(self, start, out):
+        """Samples from position start into out, a float32 array, scaled to [-1, 1)"""
+        n = len(out)
+        i = start % self.capacity
+        first = min(n, self.capacity - i)
+        np.multiply(self.buffer[i:i + first], INT16_SCALE, out=out[:first])
+        if first < n:
+            np.multiply(self.buffer[:n - first], INT16_SCALE, out=out[first:])
+
+    def frame(self, start, stop, sample_rate):
+        """An AudioFrame of the samples in [start, stop)"""
+        start = max(start, self.start)
+        i, n = start % self.capacity, max(0, stop - start)
+        if i + n <= self.capacity:
+            data = self.buffer[i:i + n].tobytes()
+        else:
+            data = self.buffer[i:].tobytes() + self.buffer[:n - (self.capacity - i)].tobytes()
+        return rtc.AudioFrame(data=data, sample_rate=sample_rate, num_channels=1, samples_per_channel=n)
+
+
+class WindowReader:
+    """Reads model-rate float32 windows out of an input-rate AudioRing"""
+
+    def __init__(self, input_rate, model_rate, window):
+        self.window = window
+        self.step = input_rate / model_rate
+        self.position = 0.0  # absolute input position of the next window's first sample
+        if self.step != 1.0:
+            # Scratch space for the interpolation, allocated once per stream
+            self._offsets = np.arange(window, dtype=np.float64) * self.step
+            self._pos = np.empty(window, dtype=np.float64)
+            self._floor = np.empty(window, dtype=np.float64)
+            self._index = np.empty(window, dtype=np.int64)
+            self._wrapped = np.empty(window, dtype=np.int64)
+            self._left = np.empty(window, dtype=np.int16)
+            self._right = np.empty(window, dtype=np.int16)
+            self._frac = np.empty(window, dtype=np.float32)
+            self._delta = np.empty(window, dtype=np.float32)
+
+    def available(self, ring):
+        """Whole windows that can be read with the samples written so far"""
+        if self.step == 1.0:
+            return int(ring.end - self.position) // self.window
+        # The last sample of a window interpolates towards the one after it
+        span = (self.window - 1) * self.step + 1
+        ahead = ring.end - 1 - span - self.position
+        return 0 if ahead < 0 else int(ahead // (self.window * self.step)) + 1
+
+    def read(self, ring, out):
+        """Fill out with the next window and advance"""
+        if self.step == 1.0:
+            ring.scaled(int(self.position), out)
+        else:
+            np.add(self._offsets, self.position, out=self._pos)
+            np.floor(self._pos, out=self._floor)
+            np.subtract(self._pos, self._floor, out=self._pos)
+            self._frac[:] = self._pos
+            self._index[:] = self._floor
+            np.remainder(self._index, ring.capacity, out=self._wrapped)
+            np.take(ring.buffer, self._wrapped, out=self._left)
+            np.add(self._index, 1, out=self._wrapped)
+            np.remainder(self._wrapped, ring.capacity, out=self._wrapped)
+            np.take(ring.buffer, self._wrapped, out=self._right)
+            np.multiply(self._left, INT16_SCALE, out=out)
+            np.multiply(self._right, INT16_SCALE, out=self._delta)
+            np.subtract(self._delta, out, out=self._delta)
+            np.multiply(self._delta, self._frac, out=self._delta)
+            np.add(out, self._delta, out=out)
+        self.position += self.window * self.step
+
+    @property
+    def input_position(self):
+        """Input samples consumed by the windows read so far"""
+        return int(self.position)
+
+
+class _Model:
+    """One stream's Silero state: the previous window's tail and the recurrent state"""
+
+    def __init__(self, session, sample_rate):
+        self.session = session
+        self.window = 512 if sample_rate == 16000 else 256
+        self.context = 64 if sample_rate == 16000 else 32
+        self.input = np.zeros((1, self.context + self.window), dtype=np.float32)
+        self.state = np.zeros((2, 1, 128), dtype=np.float32)
+        self.sample_rate = np.array(sample_rate, dtype=np.int64)
+
+    def next_input(self, window):
+        """Make window the model's next input, after the tail of the previous one"""
+        self.input[0, :self.context] = self.input[0, -self.context:]
+        self.input[0, self.context:] = window
+
+    def run_input(self):
+        """Infer the current input, carrying the recurrent state; returns the speech probability"""
+        out, self.state = self.session.run(None, {"input": self.input, "state": self.state, "sr": self.sample_rate})
+        return out.item()
+
+    def run(self, windows, count, probabilities):
+        """Infer windows[:count] in order, writing into probabilities; runs on the executor"""
+        for j in range(count):
+            self.next_input(windows[j])
+            probabilities[j] = self.run_input()
+
+    async def infer(self, windows, count, probabilities):
+        await asyncio.get_running_loop().run_in_executor(_executor, self.run, windows, count, probabilities)
+
+
+class RingVAD(vad.VAD):
+    """Silero VAD whose streams work on a preallocated ring; shares a loaded silero.VAD's model and options.
+
+    With a service (vad_service.VADService), inference runs in its worker
+    processes instead of on this process's threads.
+    """
+
+    def __init__(self, silero_vad, max_batch=None, service=None):
+        super().__init__(capabilities=silero_vad.capabilities)
+        self._session = silero_vad._onnx_session
+        self._opts = silero_vad._opts
+        self.max_batch = max_batch or MAX_BATCH_WINDOWS
+        self.service = service
+
+    def _new_model(self):
+        if self.service is not None:
+            return self.service.model(self._session, self._opts.sample_rate)
+        return _Model(self._session, self._opts.sample_rate)
+
+    def stream(self):
+        return RingVADStream(self, self._opts, self.max_batch)
+
+
+def wrap(vad_, service=None):
+    """A RingVAD over a Silero VAD, unless VAD_RING=0; other VADs are returned as they are"""
+    if not ENABLED or not hasattr(vad_, "_onnx_session"):
+        return vad_
+    return RingVAD(vad_, service=service)
+
+
+class RingVADStream(vad.VADStream):
+    def __init__(self, vad_, opts, max_batch):
+        self._opts = opts
+        self._max_batch = max_batch
+        super().__init__(vad_)
+
+    def _drain(self, ring):
+        """Write every frame already queued, without waiting; False once the input has ended"""
+        while True:
+            try:
+                frame = self._input_ch.recv_nowait()
+            except ChanEmpty:
+                return True
+            except ChanClosed:
+                return False
+            if isinstance(frame, rtc.AudioFrame):
+                ring.write(frame.data)
+
+    @utils.log_exceptions(logger=logger)
+    async def _main_task(self):
+        opts = self._opts
+        model = self._vad._new_model()
+        window_duration = model.window / opts.sample_rate
+        windows = np.empty((self._max_batch, model.window), dtype=np.float32)
+        probabilities = np.empty(self._max_batch, dtype=np.float64)
+        exp_filter = utils.ExpFilter(alpha=0.35)
+
+        ring = reader = None
+        input_rate = 0
+        padding = max_speech = 0
+        # Start of the current speech segment, prefix padding included, as a ring position
+        segment_start = 0
+        clipped = False
+
+        speaking = False
+        speech_duration = silence_duration = 0.0
+        speech_threshold = silence_threshold = 0.0
+        samples_index = 0
+        timestamp = 0.0
+        extra_inference_time = 0.0
+
+        async for frame in self._input_ch:
+            if not isinstance(frame, rtc.AudioFrame):
+                continue
+            if ring is None:
+                input_rate = frame.sample_rate
+                padding = int(opts.prefix_padding_duration * input_rate)
+                max_speech = int(opts.max_buffered_speech * input_rate) + padding
+                ring = AudioRing(max_speech + int(RING_SLACK_S * input_rate))
+                reader = WindowReader(input_rate, opts.sample_rate, model.window)
+            elif frame.sample_rate != input_rate:
+                logger.error("a frame with another sample rate was already pushed")
+                continue
+            ring.write(frame.data)
+            # Frames that queued up while the last batch was inferred join this batch
+            open_input = self._drain(ring)
+
+            while (count := min(reader.available(ring), self._max_batch)) > 0:
+                for j in range(count):
+                    reader.read(ring, windows[j])
+                started = time.perf_counter()
+                await model.infer(windows, count, probabilities)
+                inference_duration = (time.perf_counter() - started) / count
+                extra_inference_time = max(0.0, extra_inference_time + (inference_duration - window_duration) * count)
+                if inference_duration > 0.2:
+                    logger.warning("inference is slower than realtime", extra={"delay": extra_inference_time})
+
+                # Input position reached by each window of the batch
+                batch_end = reader.input_position
+                window_input = model.window * reader.step
+                for j in range(count):
+                    p = exp_filter.apply(exp=1.0, sample=float(probabilities[j]))
+                    position = int(batch_end - (count - 1 - j) * window_input)
+                    samples_index += model.window
+                    timestamp += window_duration
+                    if speaking:
+                        speech_duration += window_duration
+                    else:
+                        silence_duration += window_duration
+
+                    self._event_ch.send_nowait(vad.VADEvent(
+                        type=vad.VADEventType.INFERENCE_DONE,
+                        samples_index=samples_index,
+                        timestamp=timestamp,
+                        silence_duration=silence_duration,
+                        speech_duration=speech_duration,
+                        probability=p,
+                        inference_duration=inference_duration,
+                        speaking=speaking,
+                        raw_accumulated_silence=silence_threshold,
+                        raw_accumulated_speech=speech_threshold,
+                    ))
+
+                    if position - segment_start > max_speech and not clipped:
+                        clipped = True
+                        logger.warning("max_buffered_speech reached, keeping the most recent speech")
+
+                    if p >= opts.activation_threshold:
+                        speech_threshold += window_duration
+                        silence_threshold = 0.0
+                        if not speaking and speech_threshold >= opts.min_speech_duration:
+                            speaking = True
+                            silence_duration = 0.0
+                            speech_duration = speech_threshold
+                            self._event_ch.send_nowait(vad.VADEvent(
+                                type=vad.VADEventType.START_OF_SPEECH,
+                                samples_index=samples_index,
+                                timestamp=timestamp,
+                                silence_duration=silence_duration,
+                                speech_duration=speech_duration,
+                                frames=[ring.frame(max(segment_start, position - max_speech), position, input_rate)],
+                                speaking=True,
+                            ))
+                    else:
+                        silence_threshold += window_duration
+                        speech_threshold = 0.0
+                        if speaking and silence_threshold >= opts.min_silence_duration:
+                            speaking = False
+                            speech_duration = 0.0
+                            silence_duration = silence_threshold
+                            self._event_ch.send_nowait(vad.VADEvent(
+                                type=vad.VADEventType.END_OF_SPEECH,
+                                samples_index=samples_index,
+                                timestamp=timestamp,
+                                silence_duration=silence_duration,
+                                speech_duration=speech_duration,
+                                frames=[ring.frame(max(segment_start, position - max_speech), position, input_rate)],
+                                speaking=False,
+                            ))
+                        if not speaking:
+                            # Only the prefix padding before the next speech is kept
+                            segment_start = max(0, position - padding)
+                            clipped = False
+
+            if not open_input:
+                break
+
+
+async def _run_call(vad_, samples, events):
+    """Push a call's audio through a VAD stream as fast as it is taken, counting the events"""
+    import fake_room
+
+    stream = vad_.stream()
+
+    async def push():
+        for frame in fake_room.frames_of(samples):
+            stream.push_frame(frame)
+            await asyncio.sleep(0)
+        stream.end_input()
+
+    pusher = asyncio.create_task(push())
+    async for ev in stream:
+        if ev.type != vad.VADEventType.INFERENCE_DONE:
+            events.append((ev.type.value, round(ev.timestamp, 2), sum(f.samples_per_channel for f in ev.frames)))
+    await pusher
+    await stream.aclose()
+
+
+def _benchmark(vad_, calls, samples):
+    import gc
+
+    events = []
+    collections = [0]
+    gc.collect()
+
+    def count(phase, info):
+        if phase == "start":
+            collections[0] += 1
+
+    gc.callbacks.append(count)
+    cpu, started = time.process_time(), time.perf_counter()
+    try:
+        async def run():
+            await asyncio.gather(*(_run_call(vad_, samples, events if i == 0 else []) for i in range(calls)))
+
+        asyncio.run(run())
+    finally:
+        gc.callbacks.remove(count)
+    return time.process_time() - cpu, time.perf_counter() - started, collections[0], events
+
+
+if __name__ == "__main__":
+    import sys
+
+    import fake_room
+    from livekit.plugins import silero
+
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 30.0
+    # Alternating speech and pauses, like a caller's side of a call
+    pause = np.zeros(int(1.5 * fake_room.SAMPLE_RATE), dtype=np.int16)
+    parts = []
+    while sum(len(p) for p in parts) < seconds * fake_room.SAMPLE_RATE:
+        parts += [pause, fake_room.voiced_speech(2.0, seed=len(parts))]
+    samples = np.concatenate(parts + [pause])
+    silero_vad = silero.VAD.load()
+    for name, vad_ in (("silero", silero_vad), ("ring", RingVAD(silero_vad))):
+        cpu, wall, collections, events = _benchmark(vad_, calls, samples)
+        audio = calls * len(samples) / fake_room.SAMPLE_RATE
+        print(
+            f"{name:>6}: {calls} calls x {len(samples) / fake_room.SAMPLE_RATE:.0f}s, "
+            f"cpu {cpu:.2f}s ({cpu / audio * 100:.2f}% of audio time), wall {wall:.2f}s, gc runs {collections}"
+        )
+        for ev in events:
+            print(f"        {ev[0]:<16} at {ev[1]:>6.2f}s, {ev[2]} samples")
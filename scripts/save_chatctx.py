@@ -1,42 +1,72 @@
 import asyncio
-from datetime import datetime
-
-from aiofile import async_open as open
-from dotenv import load_dotenv
-from livekit import rtc
-from livekit.agents import AutoSubscribe, JobContext, WorkerOptions, cli, llm
-from livekit.agents.pipeline import VoicePipelineAgent
-from livekit.plugins import deepgram, openai, silero, elevenlabs
-
 import logging
+import os
 import random
 import re
-import urllib
+from datetime import datetime
 from typing import Annotated
 
-import aiohttp
 from dotenv import load_dotenv
+from livekit import rtc
 from livekit.agents import (
     AutoSubscribe,
     JobContext,
-    WorkerOptions,
+    JobProcess,
     cli,
     llm,
 )
 from livekit.agents.pipeline import AgentCallContext, VoicePipelineAgent
-from livekit.plugins import deepgram, openai, silero
+from livekit.plugins import openai, silero  # noqa: F401  (silero must register on the main thread)
+
+import chat_ingress
+import chat_window
+import frame_profiler
+import health_check
+import latency_metrics
+import ring_vad
+import tool_prefetch
+import transcripts
+import tts_cache
+import tts_chunking
+import vad_service
+import worker_setup
+from call_registry import active_calls
+from worker_setup import GreetingTimer, get_vad, track_job, worker_options
 
 logger = logging.getLogger("weather-demo")
 logger.setLevel(logging.INFO)
 
 load_dotenv()
 
+# Deepgram is only loaded when it is configured; otherwise OpenAI transcribes the caller
+if os.getenv("DEEPGRAM_API_KEY"):
+    from livekit.plugins import deepgram
+else:
+    deepgram = None
+
+health_check.register_stats("transcripts", lambda: transcripts.get_sink().stats())
+health_check.register_stats("tts_cache", lambda: tts_cache.get_cache().stats())
+health_check.register_stats("tool_prefetch", tool_prefetch.stats)
+health_check.register_stats("chat_window", chat_window.stats)
+health_check.register_stats("chat_ingress", chat_ingress.stats)
+health_check.register_stats("vad_service", vad_service.stats)
+
+GREETING = "Hello Pie & Other Tales. *cough* excuse me, sorry. *cough again* How can I help?"
+
+# Splits replies into the chunks sent to TTS; the cache is warmed with the same split
+SPEECH_CHUNKER = tts_chunking.ClauseTokenizer()
+
 
 class AssistantFnc(llm.FunctionContext):
     """
     The class defines a set of LLM functions that the assistant can execute.
     """
 
+    def __init__(self, prefetcher=None):
+        super().__init__()
+        # Looks tool results up off the event loop, often before the LLM asks for them
+        self.prefetcher = prefetcher or tool_prefetch.ToolPrefetcher()
+
     @llm.ai_callable()
     async def get_company_info(
         self,
@@ -54,86 +84,32 @@ class AssistantFnc(llm.FunctionContext):
         # Option 2: you can prompt the agent to return a text response when it's making a function call
         agent = AgentCallContext.get_current().agent
 
-        if (
-            not agent.chat_ctx.messages
-            or agent.chat_ctx.messages[-1].role != "assistant"
-        ):
-            # skip if assistant already said something
-            filler_messages = [
-                "Let me check our company information about {topic} for you.",
-                "One moment while I retrieve information about {topic} for you.",
-                "I'd be happy to tell you about {topic} at PI & Other Tales.",
-            ]
-            message = random.choice(filler_messages).format(topic=topic)
-            logger.info(f"saying filler message: {message}")
-
-            # NOTE: set add_to_chat_ctx=True will add the message to the end
-            #   of the chat context of the function call for answer synthesis
-            speech_handle = await agent.say(message, add_to_chat_ctx=True)  # noqa: F841
-
+        # Start the lookup first so it runs while the filler is spoken
         logger.info(f"getting company info about: {topic}")
-        
-        # Company information based on the website content
-        company_info = {
-            "general": """
-                PI & Other Tales (Adventures of the Persistently Impaired and Other Tales) is a creative studio specializing in 
-                the research and development of imaginative solutions in media and entertainment. Founded in late 2024 by 
-                former music industry marketing director David James Lennon, the studio focuses on research and development 
-                of future consumer goods and experiences—developing models, architectures, and products that blend everyday 
-                practicality with entertainment value, all while showcasing the latest in future tech and IoT.
-            """,
-            "fortunes told": """
-                Fortunes Told is a unique, experiential online world with a retail-crossover twist. At its core, it's a 
-                homeware and accessories range in 78 distinctive designs—each one representing a card from the Tarot. 
-                Every piece is embedded with NFC or BLE technology, hand-produced in London, blind-boxed, and distributed 
-                entirely at random. When paired with the Fortunes Told Companion App (available now on the App Store and 
-                Google Play), each item unlocks a personalised Tarot reading that unfolds and evolves over time through a 
-                real-time, voice-to-voice interactive experience. The complete narrative "Fortunes Told (A Voyager's Guide 
-                to Life Between Worlds)" will be released on June 19th, available from all good bookstores including 
-                Waterstones, Foyles, and Amazon in hardback, paperback, and Kindle formats.
-            """,
-            "ai research": """
-                PI & Other Tales conducts extensive research in AI and machine learning. The company has developed tools 
-                like Storybook, an agentic workflow engine designed for creative writers dealing with writer's block. 
-                It's powered by LLaMA 4 Scout 17B and works with existing manuscripts to help fill in the blanks and 
-                connect ideas. The company is also developing tools for storyboarding, scriptwriting, character design, 
-                and visual development for animation and film, including othertales Screenwriter and Emotional Resonance Engines.
-            """,
-            "ethics": """
-                PI & Other Tales is committed to ethical AI development. Any software or service developed through their 
-                research comes with clear sustainability and ethical clauses built into its EULA. From a commercial standpoint, 
-                their software may not be used to replace a human role within a business. The company is also researching 
-                attribution tracking to ensure original creators are credited and compensated when their work is used in 
-                generative AI systems.
-            """,
-            "animation": """
-                The company is working on animation projects, including tools for visual development and storyboarding. 
-                There's also an animation in the works related to the Fortunes Told project, though this information 
-                isn't widely publicized yet.
-            """,
-            "contact": """
-                For more information on PI & Other Tales and their projects, you can visit their website at 
-                https://othertales.co/ or check out their GitHub at https://github.com/and-other-tales/.
-            """
-        }
-        
-        # Default to general info if the topic isn't specific
-        info_key = "general"
-        
-        # Match the topic to relevant information
-        topic_lower = topic.lower()
-        if "fortune" in topic_lower or "book" in topic_lower or "tarot" in topic_lower:
-            info_key = "fortunes told"
-        elif "ai" in topic_lower or "research" in topic_lower or "ml" in topic_lower or "storybook" in topic_lower:
-            info_key = "ai research"
-        elif "ethic" in topic_lower or "sustainable" in topic_lower:
-            info_key = "ethics"
-        elif "animation" in topic_lower or "film" in topic_lower or "visual" in topic_lower:
-            info_key = "animation"
-        elif "contact" in topic_lower or "email" in topic_lower or "phone" in topic_lower or "reach" in topic_lower:
-            info_key = "contact"
-        
-        company_data = company_info[info_key].strip()
+        lookup = asyncio.ensure_future(self.prefetcher.resolve(topic))
+
+        try:
+            if (
+                not agent.chat_ctx.messages
+                or agent.chat_ctx.messages[-1].role != "assistant"
+            ):
+                # skip if assistant already said something
+                filler_messages = [
+                    "Let me check our company information about {topic} for you.",
+                    "One moment while I retrieve information about {topic} for you.",
+                    "I'd be happy to tell you about {topic} at PI & Other Tales.",
+                ]
+                message = random.choice(filler_messages).format(topic=topic)
+                logger.info(f"saying filler message: {message}")
+
+                # NOTE: set add_to_chat_ctx=True will add the message to the end
+                #   of the chat context of the function call for answer synthesis
+                speech_handle = await agent.say(message, add_to_chat_ctx=True)  # noqa: F841
+
+            company_data = await lookup
+        finally:
+            # The filler failed or the call was cancelled: do not leave the lookup running unowned
+            lookup.cancel()
         logger.info(f"company data: {company_data}")
         
         return company_data
@@ -143,9 +119,19 @@ class AssistantFnc(llm.FunctionContext):
        
 
 
+def prewarm(proc: JobProcess):
+    worker_setup.prewarm(proc)
+    # Make sure the greeting is on disk so every call can start it straight from the cache
+    tts_cache.warm_blocking(openai.TTS, [GREETING], sentence_tokenizer=SPEECH_CHUNKER)
+
+
 async def entrypoint(ctx: JobContext):
+    greeting_timer = GreetingTimer(ctx)
+    track_job(ctx)
+    profile = frame_profiler.start(ctx)
 
-    fnc_ctx = AssistantFnc()  # create our fnc ctx instance
+    prefetcher = tool_prefetch.ToolPrefetcher(ctx.room.name)
+    fnc_ctx = AssistantFnc(prefetcher)  # create our fnc ctx instance
     initial_ctx = llm.ChatContext().append(
         role="system",
         text=(
@@ -161,37 +147,79 @@ async def entrypoint(ctx: JobContext):
         ),
     )
 
+    call = active_calls.start(ctx.room.name)
+
+    async def end_call():
+        active_calls.end(ctx.room.name)
+
+    ctx.add_shutdown_callback(end_call)
+
     await ctx.connect(auto_subscribe=AutoSubscribe.AUDIO_ONLY)
 
     # await for a participant to join the room
     participant = await ctx.wait_for_participant()
+    active_calls.set_state(call, "active", participant_identity=participant.identity)
+    vad = get_vad(ctx)
     agent = VoicePipelineAgent(
-        vad=silero.VAD.load(),
-        stt=deepgram.STT(),
+        # VAD inference runs in the process's VAD worker pool when there is one
+        vad=frame_profiler.wrap_vad(ring_vad.wrap(vad, vad_service.get(vad)), profile),
+        stt=frame_profiler.wrap_stt(deepgram.STT() if deepgram else openai.STT(), profile),
         llm=openai.LLM(),
-        tts=openai.TTS(),
+        # Replies are spoken clause by clause, with the next chunk synthesized while one plays
+        tts=frame_profiler.wrap_tts(
+            tts_chunking.PrefetchStreamAdapter(
+                # Only the greeting is cached; replies are caller-facing and never written to disk
+                tts=tts_cache.CachedTTS(openai.TTS(), [GREETING], sentence_tokenizer=SPEECH_CHUNKER),
+                sentence_tokenizer=SPEECH_CHUNKER,
+            ),
+            profile,
+        ),
         fnc_ctx=fnc_ctx,
         chat_ctx=initial_ctx,
+        before_llm_cb=prefetcher.before_llm_cb,
     )
+    agent.once("agent_started_speaking", greeting_timer.mark_first_audio)
+    # Older turns are folded into a running summary so prompts stay the same size on long calls
+    window = chat_window.ChatWindow(
+        agent.chat_ctx, openai.LLM(model=os.getenv("CHAT_SUMMARY_MODEL", "gpt-4o-mini")), ctx.room.name,
+    ).attach(agent)
+    turn_tracker = latency_metrics.TurnTracker(ctx.room.name).attach(agent)
     # Start the assistant. This will automatically publish a microphone track and listen to the participant.
     agent.start(ctx.room, participant)
+    prefetcher.attach(agent)
 
     # listen to incoming chat messages, only required if you'd like the agent to
     # answer incoming messages from Chat
-    chat = rtc.ChatManager(ctx.room)
-
     async def answer_from_text(txt: str):
-        chat_ctx = agent.chat_ctx.copy()
-        chat_ctx.append(role="user", text=txt)
-        stream = agent.llm.chat(chat_ctx=chat_ctx, fnc_ctx=fnc_ctx)
-        await agent.say(stream)
+        stream = agent.llm.chat(chat_ctx=window.prompt(txt), fnc_ctx=fnc_ctx)
+        try:
+            return await agent.say(stream)
+        except asyncio.CancelledError:
+            await stream.aclose()
+            raise
+
+    # Bursts of messages are answered together, with a bounded number of replies in flight
+    chat_queue = chat_ingress.ChatIngress(answer_from_text, ctx.room.name)
+    # The handle agent.say returns is only queued; a reply is speaking once its playout starts
+    agent.on("agent_started_speaking", lambda: chat_queue.playout_started(getattr(agent, "_playing_speech", None)))
+
+    def on_chat_received(text: str):
+        if text:
+            chat_queue.submit(text)
+
+    if hasattr(rtc, "ChatManager"):
+        chat = rtc.ChatManager(ctx.room)
+        chat.on("message_received", lambda msg: on_chat_received(msg.message))
+    else:
+        # livekit-rtc 1.x replaced ChatManager with text streams on the "lk.chat" topic
+        async def read_chat(reader):
+            on_chat_received(await reader.read_all())
 
-    @chat.on("message_received")
-    def on_chat_received(msg: rtc.ChatMessage):
-        if msg.message:
-            asyncio.create_task(answer_from_text(msg.message))
+        ctx.room.register_text_stream_handler(
+            "lk.chat", lambda reader, participant_identity: asyncio.create_task(read_chat(reader))
+        )
 
-    log_queue = asyncio.Queue()
+    transcript_sink = transcripts.get_sink()
 
     @agent.on("user_speech_committed")
     def on_user_speech_committed(msg: llm.ChatMessage):
@@ -200,30 +228,32 @@ async def entrypoint(ctx: JobContext):
             msg.content = "\n".join(
                 "[image]" if isinstance(x, llm.ChatImage) else x for x in msg
             )
-        log_queue.put_nowait(f"[{datetime.now()}] USER:\n{msg.content}\n\n")
+        transcript_sink.write(ctx.room.name, f"[{datetime.now()}] USER:\n{msg.content}\n\n")
 
     @agent.on("agent_speech_committed")
     def on_agent_speech_committed(msg: llm.ChatMessage):
-        log_queue.put_nowait(f"[{datetime.now()}] AGENT:\n{msg.content}\n\n")
+        transcript_sink.write(ctx.room.name, f"[{datetime.now()}] AGENT:\n{msg.content}\n\n")
 
-    async def write_transcription():
-        async with open("transcriptions.log", "w") as f:
-            while True:
-                msg = await log_queue.get()
-                if msg is None:
-                    break
-                await f.write(msg)
+    async def close_transcript():
+        transcript_sink.close_room(ctx.room.name)
+        # Wait until the room's lines are on disk, since a job process may exit right after this
+        if not await asyncio.to_thread(transcript_sink.flush):
+            logger.warning(f"Transcript for room {ctx.room.name} was not fully written before shutdown")
+        turn_tracker.close()
+        prefetcher.close()
+        await window.aclose()
+        await chat_queue.aclose()
 
-    write_task = asyncio.create_task(write_transcription())
+    ctx.add_shutdown_callback(close_transcript)
 
-    async def finish_queue():
-        log_queue.put_nowait(None)
-        await write_task
+    await agent.say(GREETING, allow_interruptions=True)
 
-    ctx.add_shutdown_callback(finish_queue)
 
-    await agent.say("Hello Pie & Other Tales. *cough* excuse me, sorry. *cough again* How can I help?", allow_interruptions=True)
+def main():
+    """Function to be called from wrapper scripts"""
+    health_check.start_in_worker_loop()
+    cli.run_app(worker_options(entrypoint, prewarm_fnc=prewarm))
 
 
 if __name__ == "__main__":
-    cli.run_app(WorkerOptions(entrypoint_fnc=entrypoint))
+    main()
@@ -0,0 +1,177 @@
+"""Resume a realtime call that is dispatched to the same room again soon after its job ended.
+
+A dropped SIP leg or a restarted job sends the caller back through dispatch to
+the same room. When a call's job shuts down, its instructions and turns are
+parked for SESSION_RESUME_GRACE_S. If the room is dispatched again within that
+time, the new job resumes the call:
+
+- the realtime model gets the same instructions
+- the new session starts with the most recent SESSION_RESUME_MESSAGES turns,
+  with older turns condensed into a note
+- there is no greeting
+
+The realtime session itself cannot be kept. Its websocket belongs to the old
+job's event loop, and the Realtime API cannot reattach a new connection to an
+existing session.
+
+Parked calls are kept in a table of the caller store's SQLite file, keyed by
+room, so a job in any process can claim them: under the process job executor,
+the default, the new job runs in a process of its own. Without CALLER_STORE_KEY
+there is no store and nothing is parked. The caller ID is not parked, as the
+file holds no phone numbers; the new job reads it from its own job metadata.
+Either way the caller's history is saved to caller_store as soon as a job
+ends, never from parking. A resumed call adds to that history without counting
+as another call.
+
+The time from job start until the caller can talk is recorded in
+latency_metrics. It is recorded as session_ready_cold for the greeting's first
+audio, and as session_ready_resumed once the parked turns are loaded into the
+new session.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+from livekit.agents import llm
+
+import caller_store
+from latency_metrics import latency
+
+logger = logging.getLogger("session_resume")
+logger.setLevel(logging.INFO)
+
+RESUME_NOTE = (
+    "The call dropped and the caller has just reconnected. Do not greet them again; "
+    "carry on from where the conversation left off."
+)
+
+
+class ParkedCall:
+    """What a new job needs to carry on a call: its instructions and what was said"""
+
+    __slots__ = ("room_name", "instructions", "turns", "parked_at")
+
+    def __init__(self, room_name, instructions, turns, parked_at=None):
+        self.room_name = room_name
+        self.instructions = instructions
+        # [(role, text)], oldest first
+        self.turns = turns
+        self.parked_at = parked_at or time.time()
+
+    def age(self):
+        return time.time() - self.parked_at
+
+    def dumps(self):
+        return json.dumps({"instructions": self.instructions, "turns": self.turns})
+
+    @classmethod
+    def loads(cls, room_name, data, parked_at):
+        fields = json.loads(data)
+        return cls(room_name, fields["instructions"], [tuple(turn) for turn in fields["turns"]], parked_at)
+
+    def resume_context(self, keep=None, note_chars=None):
+        """Instructions and a chat context for the new session: recent turns verbatim, older ones as a note"""
+        keep = keep or int(os.getenv("SESSION_RESUME_MESSAGES", "12"))
+        note_chars = note_chars or int(os.getenv("SESSION_RESUME_NOTE_CHARS", "1500"))
+        older, recent = self.turns[:-keep], self.turns[-keep:]
+        instructions = f"{self.instructions}\n\n{RESUME_NOTE}"
+        if older:
+            earlier = " / ".join(f"{'Caller' if role == 'user' else 'You'}: {text}" for role, text in older)
+            if len(earlier) > note_chars:
+                earlier = "..." + earlier[-note_chars:]
+            instructions += f"\n\nEarlier in this call: {earlier}"
+        chat_ctx = llm.ChatContext()
+        for role, text in recent:
+            chat_ctx.append(role=role, text=text)
+        return instructions, chat_ctx
+
+
+def configured_grace():
+    """SESSION_RESUME_GRACE_S; 0 turns resumption off"""
+    return float(os.getenv("SESSION_RESUME_GRACE_S", "60"))
+
+
+class SessionParking:
+    """Parked calls by room in a caller store, each kept for grace seconds unless a new job claims it.
+
+    The counters are this process's; "waiting" counts the calls parked by every process.
+    """
+
+    def __init__(self, store, grace):
+        self.store = store
+        self.grace = grace if store is not None else 0.0
+        self.wait = float(os.getenv("SESSION_RESUME_WAIT_S", "5"))
+        self.parked = 0
+        self.resumed = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+
+    def park(self, call):
+        """Keep a call for resumption; False when resumption is off and nothing was kept. Queries the file."""
+        if self.grace <= 0:
+            return False
+        expired = self.store.park_call(call.room_name, call.dumps(), self.grace)
+        with self._lock:
+            self.parked += 1
+            self.expired += expired
+        return True
+
+    def claim(self, room_name):
+        """The room's parked call, removed from parking; None if there is none or it expired. Queries the file."""
+        if self.grace <= 0:
+            return None
+        row = self.store.claim_parked_call(room_name)
+        if row is None:
+            return None
+        call = ParkedCall.loads(room_name, *row)
+        with self._lock:
+            if call.age() > self.grace:
+                self.expired += 1
+                return None
+            self.resumed += 1
+        return call
+
+    async def claim_after(self, room_name, still_running):
+        """Claim a room's call once its previous job in this process has parked it, waiting at most self.wait"""
+        deadline = time.monotonic() + self.wait
+        while still_running() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        return await asyncio.to_thread(self.claim, room_name)
+
+    def stats(self):
+        waiting = self.store.parked_calls(self.grace) if self.grace > 0 else 0
+        with self._lock:
+            return {
+                "grace_s": self.grace,
+                "waiting": waiting,
+                "parked": self.parked,
+                "resumed": self.resumed,
+                "expired": self.expired,
+            }
+
+
+def record_ready(room_name, started, resumed):
+    """Record the time since started (perf_counter) at which a call was ready to talk"""
+    latency.record(f"session_ready_{'resumed' if resumed else 'cold'}", room_name, time.perf_counter() - started)
+
+
+_parking = None
+_parking_lock = threading.Lock()
+
+
+def get_parking():
+    """Process-wide parking in the caller store's file; parks nothing without CALLER_STORE_KEY"""
+    global _parking
+    with _parking_lock:
+        if _parking is None:
+            _parking = SessionParking(caller_store.get_store(), configured_grace())
+        return _parking
+
+
+def stats():
+    """The process-wide parking's counters, for the health endpoint"""
+    return get_parking().stats()
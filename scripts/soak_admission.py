@@ -0,0 +1,149 @@
+"""Soak test for worker admission control against a local stand-in for LiveKit dispatch.
+
+Synthetic calls arrive at a steady rate. Like the LiveKit server, the stand-in
+dispatcher polls the worker's load function on an interval and stops offering
+jobs while the worker reports itself full. Offered jobs go through the real
+request_fnc. Each accepted call adds simulated CPU load and can block the event
+loop briefly, so all three load signals get exercised.
+
+    python soak_admission.py --rate 4 --duration 30 --max-calls 8
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import time
+
+import loop_watchdog
+from worker_setup import AdmissionControl
+
+
+class FakeWorker:
+    def __init__(self):
+        self.id = "soak-worker"
+        self.active_jobs = []
+
+
+class FakeRoom:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeJobRequest:
+    def __init__(self, room_name):
+        self.room = FakeRoom(room_name)
+        # Doubles as the worker's RunningJobInfo once accepted
+        self.job = self
+        self.answer = None
+
+    async def accept(self, **_):
+        self.answer = "accepted"
+
+    async def reject(self):
+        self.answer = "rejected"
+
+
+async def run_call(worker, admission, job, args, results):
+    worker.active_jobs.append(job)
+    admission.job_started(job.room.name)
+    results["max_concurrent"] = max(results["max_concurrent"], len(worker.active_jobs))
+    try:
+        end = time.monotonic() + random.uniform(args.min_call_s, args.max_call_s)
+        while time.monotonic() < end:
+            await asyncio.sleep(1.0)
+            if args.block_ms:
+                # A job doing blocking work on the shared loop
+                stop = time.perf_counter() + args.block_ms / 1000 * random.random()
+                while time.perf_counter() < stop:
+                    pass
+    finally:
+        worker.active_jobs.remove(job)
+
+
+async def main(args):
+    worker = FakeWorker()
+    admission = AdmissionControl(
+        max_calls=args.max_calls,
+        max_loop_lag=args.max_loop_lag_ms / 1000,
+        load_threshold=args.threshold,
+        # Simulated CPU: a fixed cost per call plus some noise
+        cpu=lambda: min(1.0, len(worker.active_jobs) * args.cpu_per_call + random.uniform(0, 0.05)),
+        loop_lag=loop_watchdog.watchdog.max_recent_lag,
+    )
+    loop_watchdog.watch_current_loop("soak")
+    results = {"offered": 0, "shed_by_dispatcher": 0, "accepted": 0, "rejected": 0, "max_concurrent": 0}
+    state = {"available": True, "load": 0.0}
+    calls = set()
+
+    async def report_load():
+        loop = asyncio.get_running_loop()
+        while True:
+            state["load"] = await loop.run_in_executor(None, admission.load_fnc, worker)
+            state["available"] = state["load"] < args.threshold
+            await asyncio.sleep(args.update_interval)
+
+    async def report_progress():
+        while True:
+            await asyncio.sleep(1.0)
+            components = ", ".join(f"{k} {v:.2f}" for k, v in admission.components.items())
+            print(
+                f"calls {len(worker.active_jobs):3d}  load {state['load']:.2f} ({components})  "
+                f"{'available' if state['available'] else 'FULL     '}  "
+                f"accepted {results['accepted']}  rejected {results['rejected']}  "
+                f"shed {results['shed_by_dispatcher']}"
+            )
+
+    background = [asyncio.create_task(report_load()), asyncio.create_task(report_progress())]
+    started = time.monotonic()
+    index = 0
+    while time.monotonic() - started < args.duration:
+        await asyncio.sleep(random.expovariate(args.rate))
+        index += 1
+        results["offered"] += 1
+        if not state["available"]:
+            # The real server would dispatch to another worker
+            results["shed_by_dispatcher"] += 1
+            continue
+        job = FakeJobRequest(f"call-soak-{index}")
+        await admission.request_fnc(job)
+        if job.answer == "accepted":
+            results["accepted"] += 1
+            task = asyncio.create_task(run_call(worker, admission, job, args, results))
+            calls.add(task)
+            task.add_done_callback(calls.discard)
+        else:
+            results["rejected"] += 1
+
+    for task in background:
+        task.cancel()
+    for task in list(calls):
+        task.cancel()
+    await asyncio.gather(*background, *calls, return_exceptions=True)
+
+    lag = loop_watchdog.watchdog.snapshot()["loops"]["soak"]
+    print()
+    for key, value in results.items():
+        print(f"{key:>20}: {value}")
+    print(f"{'loop lag p99':>20}: {lag['p99_ms']:.1f}ms")
+    if args.max_calls and results["max_concurrent"] > args.max_calls:
+        print(f"FAIL: {results['max_concurrent']} concurrent calls exceeds the limit of {args.max_calls}")
+        return 1
+    print("OK: concurrent calls stayed within the limit")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=4.0, help="Call arrivals per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to keep offering calls")
+    parser.add_argument("--max-calls", type=int, default=8)
+    parser.add_argument("--threshold", type=float, default=0.75)
+    parser.add_argument("--max-loop-lag-ms", type=float, default=250.0)
+    parser.add_argument("--cpu-per-call", type=float, default=0.05)
+    parser.add_argument("--block-ms", type=float, default=20.0, help="Worst-case blocking per call per second")
+    parser.add_argument("--min-call-s", type=float, default=3.0)
+    parser.add_argument("--max-call-s", type=float, default=10.0)
+    parser.add_argument("--update-interval", type=float, default=2.5, help="How often load is reported")
+    logging.basicConfig(level=logging.WARNING)
+    raise SystemExit(asyncio.run(main(parser.parse_args())))
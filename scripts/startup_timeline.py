@@ -0,0 +1,103 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import psutil
+
+logger = logging.getLogger("startup_timeline")
+logger.setLevel(logging.INFO)
+
+
+class StartupTimeline:
+    """Phase-by-phase record of the worker's cold start.
+
+    Times are seconds since the process was created, so interpreter start-up and
+    imports done before this module loaded are included. Phases can overlap:
+    the health server, trunk reconciliation and plugin imports run concurrently.
+    """
+
+    def __init__(self):
+        try:
+            self.origin = psutil.Process().create_time()
+        except psutil.Error:
+            self.origin = time.time()
+        self._lock = threading.Lock()
+        self._phases = {}
+
+    def _now(self):
+        return time.time() - self.origin
+
+    def begin(self, name):
+        with self._lock:
+            self._phases[name] = {"start_s": self._now(), "end_s": None}
+
+    def end(self, name, **info):
+        with self._lock:
+            phase = self._phases.setdefault(name, {"start_s": self._now()})
+            phase["end_s"] = self._now()
+            phase.update(info)
+        logger.info(f"Startup phase {name} finished at {phase['end_s']:.2f}s "
+                    f"(took {phase['end_s'] - phase['start_s']:.2f}s)")
+
+    @contextmanager
+    def phase(self, name):
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end(name)
+
+    def mark(self, name):
+        """Record an instant, only the first time it happens; returns whether it was recorded"""
+        with self._lock:
+            if name in self._phases:
+                return False
+            now = self._now()
+            self._phases[name] = {"start_s": now, "end_s": now}
+        logger.info(f"Startup milestone {name} at {now:.2f}s")
+        return True
+
+    def elapsed(self, name):
+        phase = self._phases.get(name)
+        return phase and phase.get("end_s")
+
+    def snapshot(self):
+        with self._lock:
+            phases = {name: dict(phase) for name, phase in self._phases.items()}
+        for phase in phases.values():
+            for key in ("start_s", "end_s"):
+                if phase.get(key) is not None:
+                    phase[key] = round(phase[key], 3)
+        return {"uptime_s": round(self._now(), 1), "phases": phases}
+
+    def summary(self):
+        """One line per phase in start order, for the log"""
+        lines = []
+        for name, phase in sorted(self.snapshot()["phases"].items(), key=lambda p: p[1]["start_s"]):
+            end = phase.get("end_s")
+            span = f"{phase['start_s']:7.2f}s -> {end:7.2f}s" if end is not None else f"{phase['start_s']:7.2f}s -> running"
+            lines.append(f"  {name:<22} {span}")
+        return "\n".join(lines)
+
+
+class _RegistrationHook(logging.Handler):
+    """Marks worker_registered when livekit logs that the worker registered with the server"""
+
+    def emit(self, record):
+        if record.msg == "registered worker":
+            timeline.mark("worker_registered")
+
+
+def watch_worker_registration():
+    logging.getLogger("livekit.agents").addHandler(_RegistrationHook())
+
+
+def job_accepted():
+    """Called for every accepted job; the first one ends the cold start"""
+    if timeline.mark("first_job_accepted"):
+        logger.info(f"Cold start to first accepted job took {timeline.elapsed('first_job_accepted'):.2f}s\n"
+                    f"{timeline.summary()}")
+
+
+timeline = StartupTimeline()
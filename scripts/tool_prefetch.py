@@ -0,0 +1,193 @@
+"""Knowledge lookups for get_company_info, run off the event loop and ahead of the LLM.
+
+While the caller is still talking, the topics the LLM is likely to pass to
+get_company_info are guessed from the transcript and looked up in a worker
+thread. Interim transcripts are debounced, so a lookup starts once the caller
+pauses rather than on every word. When the function call arrives its lookup is usually done already, and
+otherwise it runs while the filler message is spoken. Results only count for
+the user turn they were started in: once the caller starts speaking again they
+are stale and discarded.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import company_knowledge
+import knowledge_store
+
+logger = logging.getLogger("tool_prefetch")
+logger.setLevel(logging.INFO)
+
+MAX_CANDIDATES = 48
+# Words that never start or end a guessed topic
+_STOP_WORDS = {
+    "a", "about", "an", "and", "any", "are", "can", "could", "do", "does", "for", "from", "get", "have",
+    "hello", "hi", "how", "i", "if", "in", "is", "it", "me", "my", "of", "on", "or", "our", "please",
+    "so", "tell", "thanks", "that", "the", "there", "this", "to", "us", "want", "was", "we", "what",
+    "when", "where", "which", "who", "why", "will", "with", "would", "you", "your",
+}
+
+_stats = {"speculated": 0, "hits": 0, "in_flight_hits": 0, "misses": 0, "stale": 0}
+# Calls in other job threads update the same counters
+_stats_lock = threading.Lock()
+
+
+def stats():
+    """Process-wide counters, for the health endpoint"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _count(name, n=1):
+    with _stats_lock:
+        _stats[name] += n
+
+
+def topic_key(topic):
+    """Topics that look up the same knowledge share a key: lookups only see lowercase word tokens"""
+    return " ".join(company_knowledge.tokenize(topic))
+
+
+def candidate_topics(transcript, limit=MAX_CANDIDATES):
+    """Topics the LLM is likely to ask get_company_info about, most likely first"""
+    tokens = company_knowledge.tokenize(transcript)
+    candidates = {}
+    # The sections the transcript is about, and the keywords that point at them
+    scores = company_knowledge.score_topic(transcript)
+    for section in sorted(scores, key=scores.get, reverse=True):
+        candidates[section] = None
+    for n in range(company_knowledge._MAX_PHRASE, 0, -1):
+        for i in range(len(tokens) - n + 1):
+            phrase = " ".join(tokens[i:i + n])
+            if phrase in company_knowledge.KEYWORD_INDEX:
+                candidates[phrase] = None
+    # Phrases of up to three words that neither start nor end with a stop word
+    for n in (3, 2, 1):
+        for i in range(len(tokens) - n + 1):
+            words = tokens[i:i + n]
+            if words[0] not in _STOP_WORDS and words[-1] not in _STOP_WORDS:
+                candidates[" ".join(words)] = None
+    if tokens:
+        candidates[" ".join(tokens)] = None
+    return list(candidates)[:limit]
+
+
+class ToolPrefetcher:
+    """Per-call cache of knowledge lookups, filled speculatively from what the caller says"""
+
+    def __init__(self, room_name="", enabled=None, max_age=None, debounce=None):
+        self.room_name = room_name
+        self.enabled = os.getenv("TOOL_PREFETCH", "1") != "0" if enabled is None else enabled
+        self.max_age = float(os.getenv("TOOL_PREFETCH_MAX_AGE", "30")) if max_age is None else max_age
+        self.debounce = float(os.getenv("TOOL_PREFETCH_DEBOUNCE_MS", "200")) / 1000 if debounce is None else debounce
+        self._turn = 0
+        # Interim transcript waiting out the debounce
+        self._timer = None
+        # topic key -> (turn, finished_at, text)
+        self._results = {}
+        # topic key -> (turn, future of lookup_many, index into its results)
+        self._pending = {}
+
+    def attach(self, agent):
+        """Follow a started VoicePipelineAgent: new turns, and transcripts as they arrive"""
+        agent.on("user_started_speaking", self.new_turn)
+        # Interim transcripts are not agent events; the caller's HumanInput exists once the agent started
+        human_input = getattr(agent, "_human_input", None)
+        if human_input is not None:
+            human_input.on("interim_transcript", self._on_interim_transcript)
+            human_input.on("final_transcript", self._on_final_transcript)
+        return self
+
+    def before_llm_cb(self, agent, chat_ctx):
+        """Speculate on the full user message just before the LLM sees it, then reply as usual"""
+        if chat_ctx.messages and chat_ctx.messages[-1].role == "user":
+            content = chat_ctx.messages[-1].content
+            if isinstance(content, str):
+                self.speculate(content)
+        return None
+
+    def _on_interim_transcript(self, ev):
+        if not self.enabled or not ev.alternatives:
+            return
+        self._cancel_timer()
+        self._timer = asyncio.get_running_loop().call_later(
+            self.debounce, self.speculate, ev.alternatives[0].text,
+        )
+
+    def _on_final_transcript(self, ev):
+        if ev.alternatives:
+            self.speculate(ev.alternatives[0].text)
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def new_turn(self):
+        """The caller started speaking again, so earlier results no longer answer the current question"""
+        self._cancel_timer()
+        self._turn += 1
+        if self._results:
+            _count("stale", len(self._results))
+            self._results.clear()
+
+    def speculate(self, transcript):
+        """Start looking up the likely topics of a transcript that have not been looked up this turn"""
+        self._cancel_timer()
+        if not self.enabled or not transcript:
+            return
+        keys = [
+            key for key in candidate_topics(transcript)
+            if key not in self._results and self._pending.get(key, (None,))[0] != self._turn
+        ]
+        if not keys:
+            return
+        turn = self._turn
+        future = asyncio.ensure_future(asyncio.to_thread(knowledge_store.lookup_many, keys))
+        for i, key in enumerate(keys):
+            self._pending[key] = (turn, future, i)
+        future.add_done_callback(lambda f: self._on_lookup_done(turn, keys, f))
+        _count("speculated", len(keys))
+
+    def _on_lookup_done(self, turn, keys, future):
+        for key in keys:
+            if self._pending.get(key, (None, None))[1] is future:
+                del self._pending[key]
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logger.warning(f"Speculative lookup failed in {self.room_name}: {future.exception()!r}")
+            return
+        if turn != self._turn:
+            _count("stale", len(keys))
+            return
+        finished_at = time.monotonic()
+        for key, text in zip(keys, future.result()):
+            self._results[key] = (turn, finished_at, text)
+
+    async def resolve(self, topic):
+        """Knowledge text for a topic, from a speculative lookup of this turn when there is one"""
+        key = topic_key(topic)
+        result = self._results.get(key)
+        if result is not None and result[0] == self._turn and time.monotonic() - result[1] <= self.max_age:
+            _count("hits")
+            return result[2]
+        pending = self._pending.get(key)
+        if pending is not None and pending[0] == self._turn:
+            try:
+                text = (await asyncio.shield(pending[1]))[pending[2]]
+            except Exception:
+                pass  # already logged; look it up again below
+            else:
+                _count("in_flight_hits")
+                return text
+        _count("misses")
+        return await asyncio.to_thread(knowledge_store.lookup, topic)
+
+    def close(self):
+        self._cancel_timer()
+        self._results.clear()
+        self._pending.clear()
@@ -0,0 +1,244 @@
+import atexit
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger("transcripts")
+logger.setLevel(logging.INFO)
+
+_CLOSE = object()
+_STOP = object()
+
+
+class _RoomFile:
+    """The current transcript file for one room, rotated by size and age"""
+
+    def __init__(self, directory, room_name, max_bytes, max_age):
+        self.directory = os.path.join(directory, re.sub(r"[^A-Za-z0-9_.+-]", "_", room_name))
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.file = None
+        self.opened_at = 0.0
+        self.size = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _open(self):
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self.directory, f"transcript-{stamp}.log")
+        suffix = 1
+        while os.path.exists(path):
+            path = os.path.join(self.directory, f"transcript-{stamp}-{suffix}.log")
+            suffix += 1
+        self.file = open(path, "a", encoding="utf-8")
+        self.opened_at = time.monotonic()
+        self.size = 0
+
+    def write(self, data):
+        if self.file is not None and (
+            self.size >= self.max_bytes or time.monotonic() - self.opened_at >= self.max_age
+        ):
+            self.close()
+        if self.file is None:
+            self._open()
+        self.file.write(data)
+        self.file.flush()
+        self.size += len(data)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class TranscriptSink:
+    """Per-process transcript writer shared by every call in the worker.
+
+    Calls enqueue lines without blocking. A single writer thread drains the queue
+    in batches, doing one write per room per flush, so file I/O never runs on
+    an event loop. When the queue is full, new lines are dropped and counted
+    instead of stalling the call. flush() waits for what is queued to be
+    written, and close() writes it and stops the writer when the process exits.
+    """
+
+    def __init__(self, directory, max_queue=10000, flush_interval=0.5, flush_bytes=64 * 1024,
+                 max_bytes=10 * 1024 * 1024, max_age=3600.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.flushes = 0
+        self.max_depth = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        # room name -> lines enqueued when its close was deferred
+        self._deferred_close = {}
+        # Lines the writer has taken off the queue
+        self._taken = 0
+        self._stopped = False
+        self._files = {}
+        self._thread = threading.Thread(target=self._run, name="transcript_writer", daemon=True)
+        self._thread.start()
+
+    def write(self, room_name, text):
+        """Queue text for a room's transcript; returns False if it was dropped"""
+        # Enqueued under the lock, so the count is also each line's position in the queue
+        with self._lock:
+            try:
+                if self._stopped:
+                    raise queue.Full
+                self._queue.put_nowait((room_name, text))
+            except queue.Full:
+                self.dropped += 1
+                dropped = self.dropped
+            else:
+                self.enqueued += 1
+                self.max_depth = max(self.max_depth, self._queue.qsize())
+                return True
+        if dropped == 1 or dropped % 1000 == 0:
+            logger.warning(f"Transcript queue full, {dropped} lines dropped so far")
+        return False
+
+    def close_room(self, room_name):
+        """Flush and close a room's transcript once its queued lines are written"""
+        with self._lock:
+            try:
+                self._queue.put_nowait((room_name, _CLOSE))
+            except queue.Full:
+                # Never block the caller; the writer closes it once every line queued so far is written
+                self._deferred_close[room_name] = self.enqueued
+
+    def flush(self, timeout=5.0):
+        """Block until every line queued before the call is written; False if that took longer than timeout"""
+        if not self._thread.is_alive():
+            return False
+        done = threading.Event()
+        try:
+            self._queue.put((None, done), timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout=5.0):
+        """Write everything queued, close every room's file and stop the writer; later lines are dropped"""
+        with self._lock:
+            self._stopped = True
+        if not self._thread.is_alive():
+            return
+        try:
+            self._queue.put((None, _STOP), timeout=timeout)
+        except queue.Full:
+            logger.warning(f"Transcript writer still busy after {timeout}s, some lines were not written")
+            return
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self._close_deferred()
+                continue
+            batch = [first]
+            size = len(first[1]) if isinstance(first[1], str) else 0
+            deadline = time.monotonic() + self.flush_interval
+            # Keep collecting until the interval elapses, enough text is buffered or a marker asks for a flush
+            while size < self.flush_bytes and isinstance(batch[-1][1], str):
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                if isinstance(item[1], str):
+                    size += len(item[1])
+            self._flush(batch)
+            if batch[-1][1] is _STOP:
+                for room_file in self._files.values():
+                    room_file.close()
+                self._files.clear()
+                return
+
+    def _close_deferred(self):
+        with self._lock:
+            closing = [room_name for room_name, seq in self._deferred_close.items() if seq <= self._taken]
+            for room_name in closing:
+                del self._deferred_close[room_name]
+        for room_name in closing:
+            room_file = self._files.pop(room_name, None)
+            if room_file is not None:
+                room_file.close()
+
+    def _flush(self, batch):
+        pending = {}
+        closing = []
+        flushed = []
+        for room_name, text in batch:
+            if isinstance(text, str):
+                pending.setdefault(room_name, []).append(text)
+            elif text is _CLOSE:
+                closing.append(room_name)
+            elif text is not _STOP:
+                flushed.append(text)
+        for room_name, texts in pending.items():
+            try:
+                room_file = self._files.get(room_name)
+                if room_file is None:
+                    room_file = self._files[room_name] = _RoomFile(
+                        self.directory, room_name, self.max_bytes, self.max_age
+                    )
+                room_file.write("".join(texts))
+                self.written += len(texts)
+            except OSError as e:
+                logger.error(f"Error writing transcript for room {room_name}: {e}")
+        for room_name in closing:
+            room_file = self._files.pop(room_name, None)
+            if room_file is not None:
+                room_file.close()
+        with self._lock:
+            self._taken += sum(len(texts) for texts in pending.values())
+        # Also under sustained load, when the queue never goes idle
+        self._close_deferred()
+        self.flushes += 1
+        for done in flushed:
+            done.set()
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_queue_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "open_rooms": len(self._files),
+        }
+
+
+_sink = None
+_sink_lock = threading.Lock()
+
+
+def get_sink():
+    """Process-wide sink configured from the TRANSCRIPT_* environment variables"""
+    global _sink
+    with _sink_lock:
+        if _sink is None:
+            _sink = TranscriptSink(
+                os.getenv("TRANSCRIPT_DIR", "transcripts"),
+                max_queue=int(os.getenv("TRANSCRIPT_MAX_QUEUE", "10000")),
+                flush_interval=float(os.getenv("TRANSCRIPT_FLUSH_INTERVAL", "0.5")),
+                max_bytes=int(os.getenv("TRANSCRIPT_MAX_BYTES", str(10 * 1024 * 1024))),
+                max_age=float(os.getenv("TRANSCRIPT_ROTATE_SECONDS", "3600")),
+            )
+            atexit.register(_sink.close)
+    return _sink
@@ -1,13 +1,40 @@
+"""Reconcile the Twilio and LiveKit SIP setup with the desired state.
+
+Desired state: a Twilio trunk originating to LIVEKIT_SIP_URI, a LiveKit inbound
+trunk for TWILIO_PHONE_NUMBER, and the dispatch rule in pi_dispatch_rule.json
+bound to that inbound trunk. Existing resources are fetched concurrently and
+compared with the desired state, and only the differences are applied. The
+resolved IDs and a fingerprint of the desired state are cached in a state file,
+so a startup with nothing to change takes one round of lookups by ID.
+
+    python trunk.py [--dry-run] [--prune] [--force]
+"""
+
+import argparse
+import asyncio
+import hashlib
 import json
 import logging
 import os
-import re
-import subprocess
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
 from dotenv import load_dotenv
+from google.protobuf.json_format import MessageToDict, ParseDict
+from livekit import api
+from twilio.base.exceptions import TwilioRestException
 from twilio.rest import Client
 
-import sys
-sys.path.insert(0, './')
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DISPATCH_RULE_FILE = os.path.join(SCRIPT_DIR, "pi_dispatch_rule.json")
+STATE_FILE = os.getenv("TRUNK_STATE_FILE", os.path.join(SCRIPT_DIR, ".trunk_state.json"))
+
+TWILIO_TRUNK_NAME = "LiveKit Trunk"
+# Origination URLs with this name were added by trunk.py, so it replaces them when the URL changes
+ORIGINATION_URL_NAME = "LiveKit SIP URI"
+INBOUND_TRUNK_NAME = "Inbound LiveKit Trunk"
+
 
 def get_env_var(var_name):
     value = os.getenv(var_name)
@@ -16,112 +43,320 @@ def get_env_var(var_name):
         exit(1)
     return value
 
-def create_livekit_trunk(client, livekit_sip_uri):
-    domain_name = f"livekit-trunk-{os.urandom(4).hex()}.pstn.twilio.com"
-    trunk = client.trunking.v1.trunks.create(
-        friendly_name="LiveKit Trunk",
-        domain_name=domain_name,
-    )
-    trunk.origination_urls.create(
-        sip_url=f"{livekit_sip_uri};transport=tcp",
-        weight=1,
-        priority=1,
-        enabled=True,
-        friendly_name="LiveKit SIP URI",
+
+@dataclass
+class Desired:
+    origination_url: str
+    inbound_trunk: api.SIPInboundTrunkInfo
+    dispatch_rule: api.SIPDispatchRuleInfo
+
+    def fingerprint(self):
+        raw = json.dumps([
+            TWILIO_TRUNK_NAME,
+            self.origination_url,
+            MessageToDict(self.inbound_trunk),
+            MessageToDict(self.dispatch_rule),
+        ], sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def desired_state(phone_number, livekit_sip_uri, dispatch_rule_file=DISPATCH_RULE_FILE):
+    with open(dispatch_rule_file, "r") as f:
+        dispatch_rule = ParseDict(json.load(f), api.SIPDispatchRuleInfo())
+    return Desired(
+        origination_url=f"{livekit_sip_uri};transport=tcp",
+        inbound_trunk=api.SIPInboundTrunkInfo(name=INBOUND_TRUNK_NAME, numbers=[phone_number]),
+        dispatch_rule=dispatch_rule,
     )
-    logging.info("Created new LiveKit Trunk.")
-    return trunk
-
-def create_inbound_trunk(phone_number, livekit_url, livekit_api_key, livekit_api_secret):
-    trunk_data = {
-        "trunk": {
-            "name": "Inbound LiveKit Trunk",
-            "numbers": [phone_number]
-        }
-    }
-    with open('inbound_trunk.json', 'w') as f:
-        json.dump(trunk_data, f, indent=4)
-
-    # Check if the lk command is available
-    try:
-        subprocess.run(['which', 'lk'], check=True, capture_output=True, text=True)
-    except subprocess.CalledProcessError:
-        logging.error("LiveKit CLI (lk) not found in PATH. Cannot create inbound trunk.")
-        return None
 
+
+def load_state(path=STATE_FILE):
     try:
-        result = subprocess.run(
-            ['lk', 'sip', 'inbound', 'create', 'inbound_trunk.json', '--url', livekit_url.replace("wss", "https"), '--api-key', livekit_api_key, '--api-secret', livekit_api_secret],
-            capture_output=True,
-            text=True,
-            cwd=os.getcwd(),
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state, path=STATE_FILE):
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+class TwilioTrunks:
+    """Async wrapper over the blocking Twilio client; each call runs in a worker thread"""
+
+    def __init__(self, client):
+        self.trunks = client.trunking.v1.trunks
+
+    async def fetch(self, trunk_sid):
+        try:
+            return await asyncio.to_thread(self.trunks(trunk_sid).fetch)
+        except TwilioRestException as e:
+            if e.status == 404:
+                return None
+            raise
+
+    async def find(self, friendly_name):
+        trunks = await asyncio.to_thread(self.trunks.list, page_size=100)
+        return next((trunk for trunk in trunks if trunk.friendly_name == friendly_name), None)
+
+    async def origination_urls(self, trunk_sid):
+        """The trunk's origination URLs (sid, sip_url, friendly_name); empty if the trunk is gone"""
+        try:
+            return await asyncio.to_thread(self.trunks(trunk_sid).origination_urls.list)
+        except TwilioRestException as e:
+            if e.status == 404:
+                return []
+            raise
+
+    async def create(self, friendly_name):
+        domain_name = f"livekit-trunk-{os.urandom(4).hex()}.pstn.twilio.com"
+        return await asyncio.to_thread(self.trunks.create, friendly_name=friendly_name, domain_name=domain_name)
+
+    async def add_origination_url(self, trunk_sid, sip_url):
+        await asyncio.to_thread(
+            self.trunks(trunk_sid).origination_urls.create,
+            sip_url=sip_url,
+            weight=1,
+            priority=1,
+            enabled=True,
+            friendly_name=ORIGINATION_URL_NAME,
         )
 
-        if result.returncode != 0:
-            logging.error(f"Error executing command: {result.stderr}")
-            logging.error(f"Command output: {result.stdout}")
-            return None
-
-        stdout_output = result.stdout
-        print(stdout_output)
-        print("123123", result.stdout)
-        match = re.search(r'ST_\w+', result.stdout)
-        if match:
-            inbound_trunk_sid = match.group(0)
-            logging.info(f"Created inbound trunk with SID: {inbound_trunk_sid}")
-            return inbound_trunk_sid
-        else:
-            logging.error("Could not find inbound trunk SID in output.")
-            return None
-    except FileNotFoundError:
-        logging.error("LiveKit CLI (lk) not found in PATH. Cannot create inbound trunk.")
-        return None
-
-def create_dispatch_rule(trunk_sid, livekit_url, livekit_api_key, livekit_api_secret):
-    # Use our custom dispatch rule file that includes agent configuration
-    dispatch_rule_file = 'pi_dispatch_rule.json'
-    
-    # Add trunk_ids to the file if not present
-    with open(dispatch_rule_file, 'r') as f:
-        dispatch_rule_data = json.load(f)
-    
-    # Add trunk_id to the rule
-    if "trunk_ids" not in dispatch_rule_data:
-        dispatch_rule_data["trunk_ids"] = [trunk_sid]
-    elif trunk_sid not in dispatch_rule_data["trunk_ids"]:
-        dispatch_rule_data["trunk_ids"].append(trunk_sid)
-    
-    # Write the updated rule back to file
-    with open(dispatch_rule_file, 'w') as f:
-        json.dump(dispatch_rule_data, f, indent=4)
-
-    # Check if the lk command is available
-    try:
-        subprocess.run(['which', 'lk'], check=True, capture_output=True, text=True)
-    except subprocess.CalledProcessError:
-        logging.error("LiveKit CLI (lk) not found in PATH. Cannot create dispatch rule.")
-        return
+    async def remove_origination_url(self, trunk_sid, url_sid):
+        await asyncio.to_thread(self.trunks(trunk_sid).origination_urls(url_sid).delete)
+
 
+@dataclass
+class Change:
+    description: str
+    apply: Callable[[dict], Awaitable[None]]
+
+
+@dataclass
+class Observed:
+    twilio_trunk: object = None
+    origination_urls: list = field(default_factory=list)
+    inbound_trunks: list = field(default_factory=list)
+    dispatch_rules: list = field(default_factory=list)
+
+
+async def check_cached(twilio, lkapi, state, desired):
+    """One concurrent round of lookups by cached ID; True if nothing needs to change"""
+    if state.get("fingerprint") != desired.fingerprint():
+        return False
     try:
-        result = subprocess.run(
-            ['lk', 'sip', 'dispatch-rule', 'create', dispatch_rule_file, '--url', livekit_url.replace("wss", "https"), '--api-key', livekit_api_key, '--api-secret', livekit_api_secret],
-            capture_output=True,
-            text=True
+        trunk, urls, inbound, rules = await asyncio.gather(
+            twilio.fetch(state["twilio_trunk_sid"]),
+            twilio.origination_urls(state["twilio_trunk_sid"]),
+            lkapi.sip.list_inbound_trunk(api.ListSIPInboundTrunkRequest(trunk_ids=[state["inbound_trunk_id"]])),
+            lkapi.sip.list_dispatch_rule(api.ListSIPDispatchRuleRequest(
+                dispatch_rule_ids=[state["dispatch_rule_id"]],
+            )),
         )
+    except KeyError:
+        return False
+    inbound = next((t for t in inbound.items if t.sip_trunk_id == state["inbound_trunk_id"]), None)
+    rule = next((r for r in rules.items if r.sip_dispatch_rule_id == state["dispatch_rule_id"]), None)
+    return (
+        trunk is not None
+        and desired.origination_url in [url.sip_url for url in urls]
+        and not _stale_urls(urls, desired)
+        and inbound is not None
+        and inbound.name == desired.inbound_trunk.name
+        and set(inbound.numbers) == set(desired.inbound_trunk.numbers)
+        and rule is not None
+        and _desired_rule(desired, state["inbound_trunk_id"], rule) == rule
+    )
 
-        if result.returncode != 0:
-            logging.error(f"Error executing command: {result.stderr}")
-            return
 
-        logging.info(f"Dispatch rule created: {result.stdout}")
-    except FileNotFoundError:
-        logging.error("LiveKit CLI (lk) not found in PATH. Cannot create dispatch rule.")
-        return
+async def observe(twilio, lkapi, state):
+    """Fetch the current Twilio trunk and LiveKit SIP resources concurrently"""
+
+    async def twilio_trunk():
+        trunk = await twilio.fetch(state["twilio_trunk_sid"]) if state.get("twilio_trunk_sid") else None
+        if trunk is None:
+            trunk = await twilio.find(TWILIO_TRUNK_NAME)
+        urls = await twilio.origination_urls(trunk.sid) if trunk is not None else []
+        return trunk, urls
+
+    (trunk, urls), inbound, rules = await asyncio.gather(
+        twilio_trunk(),
+        lkapi.sip.list_inbound_trunk(api.ListSIPInboundTrunkRequest()),
+        lkapi.sip.list_dispatch_rule(api.ListSIPDispatchRuleRequest()),
+    )
+    return Observed(trunk, urls, list(inbound.items), list(rules.items))
+
+
+def _stale_urls(urls, desired):
+    """Origination URLs trunk.py added for an earlier LIVEKIT_SIP_URI"""
+    return [url for url in urls if url.sip_url != desired.origination_url and url.friendly_name == ORIGINATION_URL_NAME]
+
+
+def _desired_rule(desired, inbound_trunk_id, base=None):
+    """The dispatch rule as it should be, keeping any fields of base this script does not manage"""
+    info = api.SIPDispatchRuleInfo()
+    if base is not None:
+        info.CopyFrom(base)
+    info.name = desired.dispatch_rule.name
+    info.rule.CopyFrom(desired.dispatch_rule.rule)
+    info.room_config.CopyFrom(desired.dispatch_rule.room_config)
+    del info.trunk_ids[:]
+    info.trunk_ids.append(inbound_trunk_id)
+    return info
+
+
+def _pick(items, cached_id, id_of, matches):
+    """The resource to keep (the cached one if still present, else the oldest match) and any duplicates"""
+    candidates = sorted(
+        (item for item in items if matches(item)), key=lambda item: item.created_at.ToNanoseconds()
+    )
+    keep = next((item for item in candidates if id_of(item) == cached_id), candidates[0] if candidates else None)
+    return keep, [item for item in candidates if item is not keep]
+
+
+def plan(desired, observed, twilio, lkapi, state, prune=False):
+    """Changes needed to reach the desired state, in the order they must be applied.
+
+    Each change records the IDs it resolves in a shared dict, so that later
+    changes (such as binding the dispatch rule) can use IDs created earlier in
+    the same run.
+    """
+    changes = []
+    ids = {}
+
+    # Twilio trunk and its origination URL
+    if observed.twilio_trunk is None:
+        async def create_twilio_trunk(ids):
+            trunk = await twilio.create(TWILIO_TRUNK_NAME)
+            ids["twilio_trunk_sid"] = trunk.sid
+        changes.append(Change(f"create Twilio trunk '{TWILIO_TRUNK_NAME}'", create_twilio_trunk))
+    else:
+        ids["twilio_trunk_sid"] = observed.twilio_trunk.sid
+    if desired.origination_url not in [url.sip_url for url in observed.origination_urls]:
+        async def add_origination_url(ids):
+            await twilio.add_origination_url(ids["twilio_trunk_sid"], desired.origination_url)
+        changes.append(Change(f"add origination URL {desired.origination_url}", add_origination_url))
+    # Old URLs go only after the new one is in place, so calls keep routing
+    for url in _stale_urls(observed.origination_urls, desired):
+        async def remove_origination_url(ids, url_sid=url.sid):
+            await twilio.remove_origination_url(ids["twilio_trunk_sid"], url_sid)
+        changes.append(Change(f"remove old origination URL {url.sip_url}", remove_origination_url))
+
+    # LiveKit inbound trunk
+    numbers = set(desired.inbound_trunk.numbers)
+    inbound, duplicate_trunks = _pick(
+        observed.inbound_trunks, state.get("inbound_trunk_id"), lambda t: t.sip_trunk_id,
+        lambda t: t.name == desired.inbound_trunk.name or numbers & set(t.numbers),
+    )
+    if inbound is None:
+        async def create_inbound_trunk(ids):
+            trunk = await lkapi.sip.create_inbound_trunk(api.CreateSIPInboundTrunkRequest(trunk=desired.inbound_trunk))
+            ids["inbound_trunk_id"] = trunk.sip_trunk_id
+        changes.append(Change(f"create inbound trunk '{desired.inbound_trunk.name}'", create_inbound_trunk))
+    else:
+        ids["inbound_trunk_id"] = inbound.sip_trunk_id
+        if inbound.name != desired.inbound_trunk.name or set(inbound.numbers) != numbers:
+            updated = api.SIPInboundTrunkInfo()
+            updated.CopyFrom(inbound)
+            updated.name = desired.inbound_trunk.name
+            del updated.numbers[:]
+            updated.numbers.extend(desired.inbound_trunk.numbers)
+
+            async def update_inbound_trunk(ids, updated=updated):
+                await lkapi.sip.update_inbound_trunk(updated.sip_trunk_id, updated)
+            changes.append(Change(f"update inbound trunk {inbound.sip_trunk_id}", update_inbound_trunk))
+
+    # LiveKit dispatch rule, bound to the inbound trunk
+    rule, duplicate_rules = _pick(
+        observed.dispatch_rules, state.get("dispatch_rule_id"), lambda r: r.sip_dispatch_rule_id,
+        lambda r: r.name == desired.dispatch_rule.name,
+    )
+
+    if rule is None:
+        async def create_dispatch_rule(ids):
+            created = await lkapi.sip.create_dispatch_rule(
+                api.CreateSIPDispatchRuleRequest(dispatch_rule=_desired_rule(desired, ids["inbound_trunk_id"]))
+            )
+            ids["dispatch_rule_id"] = created.sip_dispatch_rule_id
+        changes.append(Change(f"create dispatch rule '{desired.dispatch_rule.name}'", create_dispatch_rule))
+    else:
+        ids["dispatch_rule_id"] = rule.sip_dispatch_rule_id
+        # An inbound trunk created in this run always needs the rule rebound
+        if inbound is None or _desired_rule(desired, ids["inbound_trunk_id"], rule) != rule:
+            async def update_dispatch_rule(ids, rule=rule):
+                await lkapi.sip.update_dispatch_rule(
+                    rule.sip_dispatch_rule_id, _desired_rule(desired, ids["inbound_trunk_id"], rule),
+                )
+            changes.append(Change(f"update dispatch rule {rule.sip_dispatch_rule_id}", update_dispatch_rule))
+
+    # Duplicates left behind by earlier deploys
+    for trunk in duplicate_trunks:
+        if prune:
+            async def delete_trunk(ids, trunk_id=trunk.sip_trunk_id):
+                await lkapi.sip.delete_trunk(api.DeleteSIPTrunkRequest(sip_trunk_id=trunk_id))
+            changes.append(Change(f"delete duplicate inbound trunk {trunk.sip_trunk_id}", delete_trunk))
+        else:
+            logging.warning(f"Duplicate inbound trunk {trunk.sip_trunk_id} (use --prune to delete it)")
+    for duplicate in duplicate_rules:
+        if prune:
+            async def delete_rule(ids, rule_id=duplicate.sip_dispatch_rule_id):
+                await lkapi.sip.delete_dispatch_rule(api.DeleteSIPDispatchRuleRequest(sip_dispatch_rule_id=rule_id))
+            changes.append(Change(f"delete duplicate dispatch rule {duplicate.sip_dispatch_rule_id}", delete_rule))
+        else:
+            logging.warning(
+                f"Duplicate dispatch rule {duplicate.sip_dispatch_rule_id} (use --prune to delete it)"
+            )
+    return changes, ids
+
+
+async def reconcile(twilio, lkapi, desired, state_file=STATE_FILE, dry_run=False, prune=False, force=False):
+    """Bring Twilio and LiveKit in line with the desired state; returns the changes planned"""
+    started = time.perf_counter()
+    state = load_state(state_file)
+    if not force and not prune and await check_cached(twilio, lkapi, state, desired):
+        logging.info(f"SIP setup is up to date (checked in {(time.perf_counter() - started) * 1000:.0f}ms)")
+        return []
+
+    observed = await observe(twilio, lkapi, state)
+    changes, ids = plan(desired, observed, twilio, lkapi, state, prune=prune)
+    if not changes:
+        logging.info("SIP setup already matches the desired state")
+    for change in changes:
+        logging.info(f"{'Would ' if dry_run else ''}{change.description}")
+    if dry_run:
+        return changes
+
+    for change in changes:
+        await change.apply(ids)
+    save_state({**ids, "fingerprint": desired.fingerprint(), "reconciled_at": time.time()}, state_file)
+    if changes:
+        logging.info(f"Applied {len(changes)} changes in {(time.perf_counter() - started) * 1000:.0f}ms")
+    return changes
+
+
+async def run(args, account_sid, auth_token, desired, livekit_url, livekit_api_key, livekit_api_secret):
+    twilio = TwilioTrunks(Client(account_sid, auth_token))
+    lkapi = api.LiveKitAPI(livekit_url, livekit_api_key, livekit_api_secret)
+    try:
+        await reconcile(twilio, lkapi, desired, dry_run=args.dry_run, prune=args.prune, force=args.force)
+    finally:
+        await lkapi.aclose()
+
 
 def main():
     load_dotenv()
     logging.basicConfig(level=logging.INFO)
 
+    parser = argparse.ArgumentParser(description="Reconcile the Twilio and LiveKit SIP setup")
+    parser.add_argument("--dry-run", action="store_true", help="Show the changes without applying them")
+    parser.add_argument("--prune", action="store_true", help="Delete duplicate inbound trunks and dispatch rules")
+    parser.add_argument("--force", action="store_true", help="Ignore the cached state and compare everything")
+    args = parser.parse_args()
+
     try:
         account_sid = get_env_var("TWILIO_ACCOUNT_SID")
         auth_token = get_env_var("TWILIO_AUTH_TOKEN")
@@ -129,55 +364,17 @@ def main():
         livekit_sip_uri = get_env_var("LIVEKIT_SIP_URI")
         livekit_url = get_env_var("LIVEKIT_URL")
         livekit_api_key = get_env_var("LIVEKIT_API_KEY")
-        liveket_api_secret = get_env_var("LIVEKIT_API_SECRET")
+        livekit_api_secret = get_env_var("LIVEKIT_API_SECRET")
     except SystemExit:
         logging.error("Missing required environment variables. Skipping trunk setup.")
         return
 
-    # Check if the lk command is in the PATH
     try:
-        lk_path = subprocess.run(['which', 'lk'], check=True, capture_output=True, text=True).stdout.strip()
-        logging.info(f"Found LiveKit CLI at: {lk_path}")
-    except subprocess.CalledProcessError:
-        logging.error("LiveKit CLI (lk) not found in PATH. Checking alternative locations...")
-        lk_paths = [
-            "/root/.livekit/bin/lk",
-            "/usr/local/bin/lk",
-            "/usr/bin/lk"
-        ]
-        found = False
-        for path in lk_paths:
-            if os.path.exists(path) and os.access(path, os.X_OK):
-                logging.info(f"Found LiveKit CLI at: {path}")
-                # Add the directory to PATH
-                os.environ["PATH"] += f":{os.path.dirname(path)}"
-                found = True
-                break
-        
-        if not found:
-            logging.error("LiveKit CLI not found. Cannot continue with trunk setup.")
-            return
-
-    try:
-        client = Client(account_sid, auth_token)
-
-        existing_trunks = client.trunking.v1.trunks.list()
-        livekit_trunk = next(
-            (trunk for trunk in existing_trunks if trunk.friendly_name == "LiveKit Trunk"),
-            None
-        )
-
-        if not livekit_trunk:
-            livekit_trunk = create_livekit_trunk(client, livekit_sip_uri)
-        else:
-            logging.info("LiveKit Trunk already exists. Using the existing trunk.")
-
-        inbound_trunk_sid = create_inbound_trunk(phone_number, livekit_url, livekit_api_key, liveket_api_secret)
-        if inbound_trunk_sid:
-            create_dispatch_rule(inbound_trunk_sid, livekit_url, livekit_api_key, liveket_api_secret)
+        desired = desired_state(phone_number, livekit_sip_uri)
+        asyncio.run(run(args, account_sid, auth_token, desired, livekit_url, livekit_api_key, livekit_api_secret))
     except Exception as e:
         logging.error(f"An error occurred during trunk setup: {str(e)}")
         # Continue execution even if there's an error
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from livekit import rtc
+from livekit.agents import tokenize, tts, utils
+
+logger = logging.getLogger("tts_cache")
+logger.setLevel(logging.INFO)
+
+# Frames read back from the cache are 20ms long, so the first one is ready immediately
+FRAME_MS = 20
+
+
+class AudioCache:
+    """On-disk store of raw int16 PCM clips with LRU eviction under a size cap.
+
+    Several worker processes can share one directory. Files are replaced atomically
+    and read through memory maps, so a clip evicted by one process stays readable
+    by any process that already has it open.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        # Rebuild recency order from modification times, which are bumped on every hit
+        existing = []
+        for entry in os.scandir(cache_dir):
+            if entry.name.endswith(".pcm"):
+                stat = entry.stat()
+                existing.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        for _, key, size in sorted(existing):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    @staticmethod
+    def make_key(voice, model, sample_rate, num_channels, text):
+        raw = f"{voice}|{model}|{sample_rate}|{num_channels}|{' '.join(text.split())}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pcm")
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        """Memory-mapped int16 samples for a key, or None on a miss"""
+        path = self._path(key)
+        try:
+            samples = np.memmap(path, dtype=np.int16, mode="r")
+        except (OSError, ValueError):
+            with self._lock:
+                size = self._entries.pop(key, None)
+                if size is not None:
+                    self._total_bytes -= size
+                self.misses += 1
+            return None
+        with self._lock:
+            if key not in self._entries:
+                # Written by another process sharing the directory
+                self._entries[key] = samples.nbytes
+                self._total_bytes += samples.nbytes
+            self._entries.move_to_end(key)
+            self.hits += 1
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return samples
+
+    def put(self, key, pcm):
+        """Store a clip, evicting least recently used clips to stay under the size cap"""
+        if not pcm or len(pcm) > self.max_bytes:
+            return
+        tmp_path = f"{self._path(key)}.tmp{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, "wb") as f:
+            f.write(pcm)
+        os.replace(tmp_path, self._path(key))
+        with self._lock:
+            self._total_bytes += len(pcm) - self._entries.pop(key, 0)
+            self._entries[key] = len(pcm)
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, size = self._entries.popitem(last=False)
+                self._total_bytes -= size
+                try:
+                    os.remove(self._path(old_key))
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def _normalize(text):
+    return " ".join(text.split())
+
+
+class CachedTTS(tts.TTS):
+    """Wraps a non-streaming TTS plugin and serves a fixed set of phrases from an AudioCache.
+
+    Only the chunks of `phrases`, split by sentence_tokenizer the way the agent's
+    TTS adapter splits text, are cached. Anything else, such as the LLM's
+    replies, is synthesized every time and never written to disk.
+    """
+
+    def __init__(
+        self, wrapped: tts.TTS, phrases=(), *, sentence_tokenizer=None, cache: AudioCache | None = None,
+        voice=None, model=None,
+    ):
+        super().__init__(
+            capabilities=wrapped.capabilities,
+            sample_rate=wrapped.sample_rate,
+            num_channels=wrapped.num_channels,
+        )
+        self._wrapped = wrapped
+        self._cache = cache or get_cache()
+        opts = getattr(wrapped, "_opts", None)
+        self._voice = voice or getattr(opts, "voice", "")
+        self._model = model or getattr(opts, "model", "")
+        sentence_tokenizer = sentence_tokenizer or tokenize.basic.SentenceTokenizer()
+        # Normalized chunk -> chunk, in the order the phrases were given
+        self.phrases = {
+            _normalize(chunk): chunk for text in phrases for chunk in sentence_tokenizer.tokenize(text)
+        }
+
+    def cache_key(self, text):
+        return AudioCache.make_key(self._voice, self._model, self.sample_rate, self.num_channels, text)
+
+    def cacheable(self, text):
+        return _normalize(text) in self.phrases
+
+    def synthesize(self, text, *, conn_options=None):
+        if not self.cacheable(text):
+            return _ForwardingChunkedStream(tts=self, input_text=text, conn_options=conn_options)
+        samples = self._cache.get(self.cache_key(text))
+        if samples is not None:
+            return _CachedChunkedStream(tts=self, input_text=text, conn_options=conn_options, samples=samples)
+        return _ForwardingChunkedStream(tts=self, input_text=text, conn_options=conn_options, record=True)
+
+    def prewarm(self):
+        self._wrapped.prewarm()
+
+    async def aclose(self):
+        await self._wrapped.aclose()
+
+
+class _CachedChunkedStream(tts.ChunkedStream):
+    def __init__(self, *, tts, input_text, conn_options, samples):
+        super().__init__(tts=tts, input_text=input_text, conn_options=conn_options)
+        self._samples = samples
+
+    async def _run(self):
+        request_id = utils.shortuuid()
+        sample_rate, num_channels = self._tts.sample_rate, self._tts.num_channels
+        frame_samples = sample_rate * FRAME_MS // 1000 * num_channels
+        for start in range(0, len(self._samples), frame_samples):
+            data = self._samples[start:start + frame_samples]
+            self._event_ch.send_nowait(
+                tts.SynthesizedAudio(
+                    frame=rtc.AudioFrame(
+                        data=memoryview(data).cast("B"),
+                        sample_rate=sample_rate,
+                        num_channels=num_channels,
+                        samples_per_channel=len(data) // num_channels,
+                    ),
+                    request_id=request_id,
+                )
+            )
+
+
+class _ForwardingChunkedStream(tts.ChunkedStream):
+    """The wrapped TTS's audio, recorded into the cache when record is set"""
+
+    def __init__(self, *, tts, input_text, conn_options, record=False):
+        super().__init__(tts=tts, input_text=input_text, conn_options=conn_options)
+        self._record = record
+
+    async def _run(self):
+        pcm = bytearray() if self._record else None
+        async with self._tts._wrapped.synthesize(self.input_text, conn_options=self._conn_options) as stream:
+            async for audio in stream:
+                if pcm is not None:
+                    pcm += audio.frame.data.cast("B")
+                self._event_ch.send_nowait(audio)
+        # Only complete clips are cached; a cancelled synthesis never reaches this point
+        if pcm is not None:
+            await asyncio.to_thread(self._tts._cache.put, self._tts.cache_key(self.input_text), bytes(pcm))
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Process-wide cache configured from TTS_CACHE_DIR and TTS_CACHE_MAX_MB"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AudioCache(
+                os.getenv("TTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "reception-tts-cache")),
+                int(float(os.getenv("TTS_CACHE_MAX_MB", "256")) * 1024 * 1024),
+            )
+    return _cache
+
+
+async def warm(cached_tts: CachedTTS):
+    """Synthesize any of the TTS's phrases missing from the cache"""
+    started = time.perf_counter()
+    synthesized = 0
+    for chunk in cached_tts.phrases.values():
+        if cached_tts.cache_key(chunk) not in cached_tts._cache:
+            await cached_tts.synthesize(chunk).collect()
+            synthesized += 1
+    logger.info(
+        f"TTS cache warm in {(time.perf_counter() - started) * 1000:.0f}ms "
+        f"({synthesized} phrases synthesized, {cached_tts._cache.stats()})"
+    )
+
+
+def warm_blocking(build_tts, texts, timeout=5.0, sentence_tokenizer=None):
+    """Warm the cache from a synchronous prewarm hook, giving up after timeout seconds"""
+
+    async def _warm():
+        cached_tts = CachedTTS(build_tts(), texts, sentence_tokenizer=sentence_tokenizer)
+        try:
+            await asyncio.wait_for(warm(cached_tts), timeout)
+        finally:
+            await cached_tts.aclose()
+
+    try:
+        asyncio.run(_warm())
+    except Exception as e:
+        logger.warning(f"Could not warm the TTS cache: {e}")
@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+
+from livekit.agents import tokenize, tts, utils
+from livekit.agents.tts.stream_adapter import StreamAdapterWrapper
+
+logger = logging.getLogger("tts_chunking")
+logger.setLevel(logging.INFO)
+
+_SENTENCE_END = ".!?…"
+_CLAUSE_END = ",;:—"
+# Closing quotes and brackets stay with the punctuation they follow
+_CLOSERS = "\"')]}”’»"
+# Abbreviations that never end a sentence, lowercased and without their final period
+_NEVER_END = {
+    "mr", "mrs", "ms", "dr", "prof", "st", "mt", "jr", "sr", "rev", "capt", "lt", "col", "gen", "sgt",
+    "e.g", "i.e", "vs", "approx", "no", "nos", "fig", "ca", "cf",
+}
+
+
+def _is_abbreviation(text, dot):
+    """Whether the period at text[dot] closes an abbreviation or an initial rather than a sentence"""
+    start = dot
+    while start > 0 and not text[start - 1].isspace():
+        start -= 1
+    word = text[start:dot].lstrip("\"'([{“‘«").lower()
+    return word in _NEVER_END or (len(word) == 1 and word.isalpha())
+
+
+def find_chunk_end(text, min_chars, clause_chars, max_chars, final):
+    """End of the first speakable chunk of text, or None until more text has arrived.
+
+    Chunks end at a sentence boundary once they are at least min_chars long, or
+    at a clause boundary (comma, semicolon, colon, dash) once they are at least
+    clause_chars long. Punctuation only counts when whitespace follows it, so
+    domains, URLs, decimals and times such as othertales.co, 3.5 and 9:30 are
+    never split. A period also needs the next word to start with something other
+    than a lowercase letter, and must not close an abbreviation or an initial.
+    Text with no boundary within max_chars is split at a word boundary.
+    """
+    n = len(text)
+    i = 0
+    while i < n:
+        ch = text[i]
+        if ch == "\n":
+            if len(text[:i].strip()) >= min_chars:
+                return i + 1
+            i += 1
+            continue
+        if ch not in _SENTENCE_END and ch not in _CLAUSE_END:
+            i += 1
+            continue
+        end = i + 1
+        # "?!", "..." and closing quotes belong to the chunk
+        while end < n and (text[end] in _SENTENCE_END or text[end] in _CLOSERS):
+            end += 1
+        if end == n:
+            # Whether this is a boundary depends on what comes next
+            break
+        if not text[end].isspace():
+            i = end
+            continue
+        sentence = ch in _SENTENCE_END
+        if text[i:end].rstrip(_CLOSERS).endswith("."):
+            following = end
+            while following < n and text[following].isspace():
+                following += 1
+            if following == n:
+                break
+            if text[following].islower() or _is_abbreviation(text, i):
+                i = end
+                continue
+        length = len(text[:end].strip())
+        if length >= (min_chars if sentence else clause_chars):
+            return end
+        i = end
+    if final:
+        return n if text.strip() else None
+    if n > max_chars:
+        split = text.rfind(" ", 0, max_chars)
+        if split > 0:
+            return split
+    return None
+
+
+class ClauseTokenizer(tokenize.SentenceTokenizer):
+    """Splits streamed LLM text into chunks that can be spoken as soon as they are complete.
+
+    The first chunk of each segment may end at a clause boundary once it has
+    first_clause_chars, so the first audio starts early. Later chunks only break
+    at clauses when a sentence runs past clause_chars, which keeps the prosody
+    of whole sentences.
+    """
+
+    def __init__(self, *, min_chars=20, first_clause_chars=30, clause_chars=120, max_chars=300):
+        self.min_chars = min_chars
+        self.first_clause_chars = first_clause_chars
+        self.clause_chars = clause_chars
+        self.max_chars = max_chars
+
+    def split(self, text, first, final):
+        """(chunks, remaining text) for a buffer of text; first is whether no chunk was emitted yet"""
+        chunks = []
+        while True:
+            end = find_chunk_end(
+                text, self.min_chars, self.first_clause_chars if first else self.clause_chars,
+                self.max_chars, final,
+            )
+            if end is None:
+                return chunks, text
+            chunk, text = text[:end].strip(), text[end:].lstrip()
+            if chunk:
+                chunks.append(chunk)
+                first = False
+            if not text:
+                return chunks, text
+
+    def tokenize(self, text, *, language=None):
+        return self.split(text, True, True)[0]
+
+    def stream(self, *, language=None):
+        return ClauseStream(self)
+
+
+class ClauseStream(tokenize.SentenceStream):
+    def __init__(self, tokenizer):
+        super().__init__()
+        self._tokenizer = tokenizer
+        self._buf = ""
+        self._first = True
+        self._segment_id = utils.shortuuid()
+
+    def _emit(self, final):
+        chunks, self._buf = self._tokenizer.split(self._buf, self._first, final)
+        for chunk in chunks:
+            self._event_ch.send_nowait(tokenize.TokenData(segment_id=self._segment_id, token=chunk))
+            self._first = False
+
+    def push_text(self, text):
+        self._check_not_closed()
+        self._buf += text
+        self._emit(final=False)
+
+    def flush(self):
+        self._check_not_closed()
+        self._emit(final=True)
+        self._buf = ""
+        self._first = True
+        self._segment_id = utils.shortuuid()
+
+    def end_input(self):
+        self.flush()
+        self._event_ch.close()
+
+    async def aclose(self):
+        self._event_ch.close()
+
+
+class PrefetchStreamAdapter(tts.StreamAdapter):
+    """StreamAdapter that synthesizes upcoming chunks while the current one is still streaming.
+
+    Up to `prefetch` chunks after the current one are synthesized concurrently,
+    and their audio is forwarded strictly in order, so the next chunk's time to
+    first byte overlaps the current chunk instead of following it. With
+    prefetch=0 chunks are synthesized one after another, as StreamAdapter does.
+    """
+
+    def __init__(self, *, tts, sentence_tokenizer=None, prefetch=None):
+        super().__init__(tts=tts, sentence_tokenizer=sentence_tokenizer or ClauseTokenizer())
+        self.prefetch = int(os.getenv("TTS_PREFETCH_CHUNKS", "1")) if prefetch is None else prefetch
+
+    def stream(self, *, conn_options=None):
+        return _PrefetchStream(
+            tts=self, conn_options=conn_options, wrapped_tts=self._tts,
+            sentence_tokenizer=self._sentence_tokenizer, prefetch=self.prefetch,
+        )
+
+
+class _PrefetchStream(StreamAdapterWrapper):
+    def __init__(self, *, prefetch, **kwargs):
+        super().__init__(**kwargs)
+        self._prefetch = prefetch
+
+    async def _run(self):
+        if self._prefetch <= 0:
+            return await super()._run()
+
+        # The chunk being forwarded plus the prefetched ones
+        slots = asyncio.Semaphore(self._prefetch + 1)
+        ready = asyncio.Queue()
+        syntheses = set()
+
+        async def _forward_input():
+            async for data in self._input_ch:
+                if isinstance(data, self._FlushSentinel):
+                    self._sent_stream.flush()
+                    continue
+                self._sent_stream.push_text(data)
+            self._sent_stream.end_input()
+
+        async def _synthesize(text, audio_ch):
+            try:
+                async with self._wrapped_tts.synthesize(text) as stream:
+                    async for audio in stream:
+                        audio_ch.send_nowait(audio)
+            finally:
+                audio_ch.close()
+
+        async def _start_syntheses():
+            async for ev in self._sent_stream:
+                await slots.acquire()
+                audio_ch = utils.aio.Chan()
+                task = asyncio.create_task(_synthesize(ev.token, audio_ch))
+                syntheses.add(task)
+                task.add_done_callback(syntheses.discard)
+                ready.put_nowait((task, audio_ch))
+            ready.put_nowait(None)
+
+        async def _forward_audio():
+            while (item := await ready.get()) is not None:
+                task, audio_ch = item
+                last_audio = None
+                async for audio in audio_ch:
+                    if last_audio is not None:
+                        self._event_ch.send_nowait(last_audio)
+                    last_audio = audio
+                # Surfaces a failed synthesis
+                await task
+                if last_audio is not None:
+                    last_audio.is_final = True
+                    self._event_ch.send_nowait(last_audio)
+                slots.release()
+
+        tasks = [
+            asyncio.create_task(_forward_input()),
+            asyncio.create_task(_start_syntheses()),
+            asyncio.create_task(_forward_audio()),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            await utils.aio.gracefully_cancel(*tasks, *syntheses)
+            await self._wrapped_tts.aclose()
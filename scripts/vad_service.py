@@ -0,0 +1,393 @@
+"""Silero VAD inference for every call in the process, run in a pool of worker processes.
+
+Each call's ring_vad stream submits one 32ms window at a time, since the model
+is recurrent. A dispatcher thread per worker process takes whatever windows are
+waiting from any call, up to VAD_SERVICE_MAX_BATCH of them. It waits at most
+VAD_SERVICE_BATCH_WAIT_MS for more, and then infers them as one batch: the
+Silero model takes a batch of inputs with one recurrent state each. Inputs,
+states and results pass through a shared-memory block per worker. Only the
+batch size goes over the worker's pipe. The GIL is released while the
+dispatcher waits, so inference no longer competes with the calls' audio I/O.
+
+VAD_SERVICE_WORKERS sets the number of worker processes. With 0, the default,
+inference stays in process on ring_vad's threads. The pool is opt-in and only
+starts with the thread job executor (AGENT_JOB_EXECUTOR=thread): under the
+process executor every call has its own process, which would start a pool of
+its own with nothing to batch across. A batch has a few
+windows' worth of time to come back. If a worker dies or misses that deadline,
+it is restarted and the windows it had run in process instead, as do windows
+that arrive while a worker is still loading the model.
+
+Workers are started with spawn, which imports the parent's __main__ module
+again in each worker (as __mp_main__, without running its __main__ block).
+Under agent_wrapper that is only the small wrapper module. When save_chatctx
+is run directly, each worker imports the whole agent module and its plugins.
+"""
+
+import asyncio
+import atexit
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import ring_vad
+
+logger = logging.getLogger("vad_service")
+logger.setLevel(logging.INFO)
+
+STATE_SIZE = 128
+# A batch must come back within this many windows of audio time, plus a share per window in it
+BATCH_TIMEOUT_WINDOWS = 4
+BATCH_TIMEOUT_WINDOWS_PER_INPUT = 1 / 8
+# A worker that has not loaded the model after this long is restarted
+WORKER_START_TIMEOUT_S = 30.0
+
+_stats = {"batches": 0, "windows": 0, "max_batch": 0, "worker_restarts": 0, "fallbacks": 0}
+# Updated by every dispatcher thread and by the calls' event loops
+_stats_lock = threading.Lock()
+_service = None
+_service_lock = threading.Lock()
+
+
+class VADServiceError(RuntimeError):
+    pass
+
+
+def configured_workers():
+    """Worker processes from VAD_SERVICE_WORKERS; "auto" picks 0 for single-call workers"""
+    workers = os.getenv("VAD_SERVICE_WORKERS", "0")
+    if workers == "0":
+        return 0
+    if os.getenv("AGENT_JOB_EXECUTOR") != "thread":
+        logger.warning(
+            "VAD_SERVICE_WORKERS is ignored under the process job executor, where each call would start "
+            "a pool of its own; set AGENT_JOB_EXECUTOR=thread to share one pool between calls"
+        )
+        return 0
+    if workers != "auto":
+        return int(workers)
+    if os.getenv("AGENT_MAX_CONCURRENT_CALLS") == "1":
+        return 0
+    return min(2, os.cpu_count() or 1)
+
+
+def stats():
+    """Process-wide counters and pool state, for the health endpoint"""
+    service = _service
+    with _stats_lock:
+        counters = dict(_stats)
+    return {
+        **counters,
+        "mean_batch": round(counters["windows"] / counters["batches"], 2) if counters["batches"] else 0.0,
+        "workers": len(service.workers) if service else 0,
+        "queued": service.queue.qsize() if service else 0,
+    }
+
+
+def _count(name, n=1):
+    with _stats_lock:
+        _stats[name] += n
+
+
+def _worker_main(shm_name, max_batch, width, sample_rate, force_cpu, conn):
+    """Worker process: infers batches written to the shared block, one per batch size received"""
+    from livekit.plugins.silero import onnx_model
+
+    session = onnx_model.new_inference_session(force_cpu)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    inputs, states, outputs = _views(shm, max_batch, width)
+    sr = np.array(sample_rate, dtype=np.int64)
+    try:
+        conn.send("ready")
+        while True:
+            n = conn.recv()
+            if n is None:
+                break
+            out, state = session.run(None, {
+                "input": inputs[:n], "state": np.ascontiguousarray(states[:, :n]), "sr": sr,
+            })
+            outputs[:n] = out[:, 0]
+            states[:, :n] = state
+            conn.send(n)
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        del inputs, states, outputs
+        shm.close()
+
+
+def _views(shm, max_batch, width):
+    """Inputs, recurrent states and probabilities laid out in one shared block"""
+    inputs = np.ndarray((max_batch, width), dtype=np.float32, buffer=shm.buf)
+    states = np.ndarray((2, max_batch, STATE_SIZE), dtype=np.float32, buffer=shm.buf, offset=inputs.nbytes)
+    outputs = np.ndarray(
+        (max_batch,), dtype=np.float32, buffer=shm.buf, offset=inputs.nbytes + states.nbytes,
+    )
+    return inputs, states, outputs
+
+
+class _Worker:
+    def __init__(self, index, max_batch, width, window_s, sample_rate, force_cpu):
+        self.index = index
+        self.window_s = window_s
+        self.args = (max_batch, width, sample_rate, force_cpu)
+        size = 4 * (max_batch * width + 2 * max_batch * STATE_SIZE + max_batch)
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.inputs, self.states, self.outputs = _views(self.shm, max_batch, width)
+        self.process = self.conn = None
+        self.loaded = False
+        self.started_at = 0.0
+        self.start()
+
+    def start(self):
+        # spawn: the worker process is started from a thread of a process already running event loops.
+        # It imports the parent's __main__ again, see the module docstring.
+        context = multiprocessing.get_context("spawn")
+        self.conn, child = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(self.shm.name, *self.args, child),
+            name=f"vad-service-{self.index}", daemon=True,
+        )
+        self.process.start()
+        child.close()
+        self.loaded = False
+        self.started_at = time.monotonic()
+
+    def ready(self):
+        """Whether the worker has loaded the model; one that died or took too long to start is restarted"""
+        if self.loaded:
+            return True
+        try:
+            if self.conn.poll():
+                self.loaded = self.conn.recv() == "ready"
+                return self.loaded
+        except (EOFError, OSError):
+            pass
+        else:
+            if self.process.is_alive() and time.monotonic() - self.started_at < WORKER_START_TIMEOUT_S:
+                return False
+        logger.error(f"VAD worker {self.index} did not start; restarting it")
+        self.restart()
+        return False
+
+    def timeout(self, n):
+        """Seconds a batch of n windows may take before the worker counts as stuck"""
+        return self.window_s * (BATCH_TIMEOUT_WINDOWS + n * BATCH_TIMEOUT_WINDOWS_PER_INPUT)
+
+    def infer(self, n):
+        """Run the first n rows of the shared block; raises VADServiceError if the worker fails"""
+        try:
+            self.conn.send(n)
+            timeout = self.timeout(n)
+            if not self.conn.poll(timeout):
+                raise VADServiceError(f"VAD worker {self.index} did not answer within {timeout * 1000:.0f}ms")
+            self.conn.recv()
+        except (EOFError, OSError) as e:
+            raise VADServiceError(f"VAD worker {self.index} failed: {e!r}") from e
+
+    def restart(self):
+        _count("worker_restarts")
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+        self.start()
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.kill()
+        self.conn.close()
+        del self.inputs, self.states, self.outputs
+        self.shm.close()
+        self.shm.unlink()
+
+
+class _Request:
+    __slots__ = ("model", "loop", "future")
+
+    def __init__(self, model):
+        self.model = model
+        self.loop = asyncio.get_running_loop()
+        self.future = self.loop.create_future()
+
+    def resolve(self, result=None, error=None):
+        try:
+            self.loop.call_soon_threadsafe(_set_future, self.future, result, error)
+        except RuntimeError:
+            pass  # that call's loop has closed
+
+
+def _set_future(future, result, error):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class ServiceModel(ring_vad._Model):
+    """A stream's model state, inferred by the service's workers and in process when they fail"""
+
+    def __init__(self, service, session, sample_rate):
+        super().__init__(session, sample_rate)
+        self.service = service
+
+    async def infer(self, windows, count, probabilities):
+        for j in range(count):
+            self.next_input(windows[j])
+            request = _Request(self)
+            self.service.queue.put(request)
+            try:
+                probabilities[j] = await request.future
+            except VADServiceError:
+                _count("fallbacks")
+                probabilities[j] = await request.loop.run_in_executor(ring_vad._executor, self.run_input)
+
+
+class VADService:
+    """Worker processes running Silero VAD, fed batches of windows from every call by dispatcher threads"""
+
+    def __init__(self, workers, sample_rate, force_cpu=True, max_batch=None, batch_wait=None):
+        self.max_batch = max_batch or int(os.getenv("VAD_SERVICE_MAX_BATCH", "32"))
+        # Seconds
+        self.batch_wait = (
+            float(os.getenv("VAD_SERVICE_BATCH_WAIT_MS", "2")) / 1000 if batch_wait is None else batch_wait
+        )
+        probe = ring_vad._Model(None, sample_rate)
+        width = probe.context + probe.window
+        self.queue = queue.Queue()
+        self.workers = [
+            _Worker(i, self.max_batch, width, probe.window / sample_rate, sample_rate, force_cpu)
+            for i in range(workers)
+        ]
+        self._threads = [
+            threading.Thread(target=self._dispatch, args=(worker,), name=f"vad-dispatch-{worker.index}", daemon=True)
+            for worker in self.workers
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"Started {workers} VAD worker processes, batches of up to {self.max_batch} windows")
+
+    def model(self, session, sample_rate):
+        return ServiceModel(self, session, sample_rate)
+
+    def _take_batch(self):
+        """The next request, with any others that arrive within batch_wait; None once closed"""
+        first = self.queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.max_batch:
+            try:
+                request = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if request is None:
+                # Leave it for this thread's next round, after this batch
+                self.queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _dispatch(self, worker):
+        while (batch := self._take_batch()) is not None:
+            if not worker.ready():
+                # Loading the model takes seconds; meanwhile the windows run in process
+                error = VADServiceError(f"VAD worker {worker.index} is starting")
+                for request in batch:
+                    request.resolve(error=error)
+                continue
+            n = len(batch)
+            for i, request in enumerate(batch):
+                worker.inputs[i] = request.model.input[0]
+                worker.states[:, i] = request.model.state[:, 0]
+            try:
+                worker.infer(n)
+            except VADServiceError as e:
+                logger.error(f"{e}; restarting it, its {n} windows run in process")
+                for request in batch:
+                    request.resolve(error=e)
+                try:
+                    worker.restart()
+                except Exception as e:
+                    logger.error(f"Could not restart VAD worker {worker.index}: {e!r}")
+                continue
+            with _stats_lock:
+                _stats["batches"] += 1
+                _stats["windows"] += n
+                _stats["max_batch"] = max(_stats["max_batch"], n)
+            for i, request in enumerate(batch):
+                request.model.state[:, 0] = worker.states[:, i]
+                request.resolve(float(worker.outputs[i]))
+
+    def close(self):
+        for _ in self._threads:
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout=2)
+        for worker in self.workers:
+            worker.close()
+        self.workers = []
+
+
+def get(silero_vad, workers=None):
+    """The process's VAD service, started on first use; None when inference stays in process"""
+    global _service
+    workers = configured_workers() if workers is None else workers
+    if workers <= 0 or not hasattr(silero_vad, "_onnx_session"):
+        return None
+    with _service_lock:
+        if _service is None:
+            _service = VADService(workers, silero_vad._opts.sample_rate)
+            atexit.register(_service.close)
+    return _service
+
+
+if __name__ == "__main__":
+    import sys
+
+    import psutil
+
+    import fake_room
+    from livekit.plugins import silero
+
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 20.0
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+    pause = np.zeros(int(1.5 * fake_room.SAMPLE_RATE), dtype=np.int16)
+    parts = []
+    while sum(len(p) for p in parts) < seconds * fake_room.SAMPLE_RATE:
+        parts += [pause, fake_room.voiced_speech(2.0, seed=len(parts))]
+    samples = np.concatenate(parts + [pause])
+    silero_vad = silero.VAD.load()
+    service = get(silero_vad, workers)
+    this_process = psutil.Process()
+    # Let the workers finish starting, so their start-up is not counted: until then windows run in process
+    while True:
+        fallbacks = stats()["fallbacks"]
+        ring_vad._benchmark(ring_vad.RingVAD(silero_vad, service=service), 1, samples[:fake_room.SAMPLE_RATE])
+        if stats()["fallbacks"] == fallbacks:
+            break
+    with _stats_lock:
+        _stats["fallbacks"] = 0
+    for name, vad_ in (("in process", ring_vad.RingVAD(silero_vad)), ("service", ring_vad.RingVAD(silero_vad, service=service))):
+        before = sum(sum(child.cpu_times()[:2]) for child in this_process.children())
+        cpu, wall, collections, events = ring_vad._benchmark(vad_, calls, samples)
+        workers_cpu = sum(sum(child.cpu_times()[:2]) for child in this_process.children()) - before
+        print(
+            f"{name:>10}: {calls} calls x {len(samples) / fake_room.SAMPLE_RATE:.0f}s, cpu {cpu:.2f}s in this process "
+            f"and {workers_cpu:.2f}s in workers, wall {wall:.2f}s, {len(events)} speech events in the first call"
+        )
+    print(stats())
@@ -0,0 +1,283 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from livekit.agents import JobContext, JobExecutorType, JobProcess, WorkerOptions, utils
+
+import call_registry
+import caller_store
+import health_check
+import knowledge_store
+import latency_metrics
+import loop_watchdog
+import startup_timeline
+import vad_service
+
+log = logging.getLogger("worker_setup")
+log.setLevel(logging.INFO)
+
+# Heavy plugin objects shared by every job served by this process
+_shared = {}
+
+
+def _load_vad():
+    """Load the Silero VAD model once per process"""
+    if "vad" not in _shared:
+        from livekit.plugins import silero
+
+        started = time.perf_counter()
+        _shared["vad"] = silero.VAD.load()
+        log.info(f"Loaded Silero VAD in {(time.perf_counter() - started) * 1000:.0f}ms")
+    return _shared["vad"]
+
+
+def _record_prewarm(proc: JobProcess, started: float):
+    proc.userdata["prewarm_ms"] = (time.perf_counter() - started) * 1000
+    proc.userdata["prewarmed_at"] = time.monotonic()
+    proc.userdata["jobs_served"] = 0
+    log.info(f"Process {proc.pid} prewarmed in {proc.userdata['prewarm_ms']:.0f}ms")
+
+
+def prewarm(proc: JobProcess):
+    """Prewarm hook for the voice pipeline agent: loads VAD and the knowledge index before any job arrives"""
+    started = time.perf_counter()
+    proc.userdata["vad"] = _load_vad()
+    # The VAD worker processes, if configured, start before the first call needs them
+    vad_service.get(proc.userdata["vad"])
+    proc.userdata["knowledge"] = knowledge_store.get_store()
+    _record_prewarm(proc, started)
+
+
+def prewarm_realtime(proc: JobProcess):
+    """Prewarm hook for the realtime agent, which runs VAD server-side"""
+    started = time.perf_counter()
+    # Open the caller store so the first call does not
+    caller_store.get_store()
+    _record_prewarm(proc, started)
+
+
+def get_vad(ctx: JobContext):
+    """Return the prewarmed VAD, loading it inline if the process was not prewarmed"""
+    vad = ctx.proc.userdata.get("vad")
+    if vad is None:
+        log.warning("VAD was not prewarmed, loading it inside the job")
+        vad = ctx.proc.userdata["vad"] = _load_vad()
+        ctx.proc.userdata["vad_loaded_inline"] = True
+    return vad
+
+
+def track_job(ctx: JobContext):
+    """Per-job bookkeeping: watch the job's event loop and count it as a call for admission control"""
+    loop = asyncio.get_running_loop()
+    loop_watchdog.watchdog.watch(loop, f"job:{ctx.room.name}")
+    # Only reaches the worker's admission control under the thread executor; in a job process the
+    # reservation ends once the worker sees the job in its job list
+    admission.job_started(ctx.room.name)
+
+    async def _unwatch():
+        loop_watchdog.watchdog.unwatch(loop)
+
+    ctx.add_shutdown_callback(_unwatch)
+
+
+class GreetingTimer:
+    """Measures time from job start to the first audio the caller hears"""
+
+    def __init__(self, ctx: JobContext):
+        self._ctx = ctx
+        self._started = time.perf_counter()
+        self._reported = False
+        userdata = ctx.proc.userdata
+        self.idle_s = time.monotonic() - userdata.get("prewarmed_at", time.monotonic())
+        self.job_index = userdata.get("jobs_served", 0)
+        userdata["jobs_served"] = self.job_index + 1
+
+    def mark_first_audio(self, *_):
+        if self._reported:
+            return
+        self._reported = True
+        elapsed_ms = (time.perf_counter() - self._started) * 1000
+        userdata = self._ctx.proc.userdata
+        # Warm means nothing heavy had to be loaded between job start and the greeting
+        warm = "prewarmed_at" in userdata and not userdata.pop("vad_loaded_inline", False)
+        log.info(
+            f"First greeting audio in room {self._ctx.room.name} after {elapsed_ms:.0f}ms "
+            f"({'warm' if warm else 'cold'} process, job #{self.job_index + 1}, "
+            f"idle {self.idle_s:.1f}s, prewarm {userdata.get('prewarm_ms', 0):.0f}ms)"
+        )
+
+
+class CpuLoad:
+    """CPU utilisation averaged over the last few seconds, sampled on a background thread"""
+
+    def __init__(self, interval=0.5, window=5):
+        self._monitor = utils.hw.get_cpu_monitor()
+        self._interval = interval
+        self._avg = utils.MovingAverage(window)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _sample(self):
+        while True:
+            value = self._monitor.cpu_percent(interval=self._interval)
+            with self._lock:
+                self._avg.add_sample(value)
+
+    def get(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._sample, daemon=True, name="cpu_load_sampler")
+            self._thread.start()
+        with self._lock:
+            return self._avg.get_avg()
+
+
+cpu_load = CpuLoad()
+
+
+class AdmissionControl:
+    """Decides how loaded the worker is and whether it takes another call.
+
+    The reported load is the highest of three signals, each scaled so that
+    reaching its limit lands exactly on the load threshold:
+
+    - CPU utilisation, which is compared with the threshold directly.
+    - Calls in progress, against AGENT_MAX_CONCURRENT_CALLS (0 disables this).
+    - Event-loop lag, against AGENT_MAX_LOOP_LAG_MS.
+
+    LiveKit stops dispatching to the worker once the reported load reaches the
+    threshold. The load is only reported every few seconds, so request_fnc also
+    rejects jobs that arrive while the worker is already full. An accepted job
+    holds a reservation for its room until it shows up in the worker's job list.
+    """
+
+    # Accepted jobs count as calls until they show up in the worker's job list, or for this long
+    RESERVATION_S = 10.0
+
+    def __init__(self, max_calls=10, max_loop_lag=0.25, load_threshold=0.75,
+                 cpu=None, loop_lag=None, count_calls=None):
+        self.max_calls = max_calls
+        self.max_loop_lag = max_loop_lag
+        self.load_threshold = load_threshold
+        self._cpu = cpu or cpu_load.get
+        self._loop_lag = loop_lag or loop_watchdog.watchdog.max_recent_lag
+        self._count_calls = count_calls or (lambda: len(call_registry.active_calls))
+        self._worker = None
+        self._lock = threading.Lock()
+        # Room name -> when its job was accepted (monotonic)
+        self._reservations = {}
+        self.accepted = 0
+        self.rejected = 0
+        self.components = {"cpu": 0.0, "calls": 0.0, "loop_lag": 0.0}
+
+    def set_call_counter(self, count_calls):
+        """Count calls in progress with count_calls() instead of the calls in the call registry"""
+        self._count_calls = count_calls
+
+    def calls(self):
+        """Calls in progress, including jobs accepted but not yet started"""
+        rooms = _job_rooms(self._worker) if self._worker is not None else set()
+        # The registry only sees calls in this process, so with the process executor the
+        # worker's job list is the better count
+        running = max(self._count_calls(), len(rooms))
+        now = time.monotonic()
+        with self._lock:
+            # A job in the worker's job list is already counted as running, whichever process runs it
+            self._reservations = {
+                room: accepted_at for room, accepted_at in self._reservations.items()
+                if room not in rooms and now - accepted_at < self.RESERVATION_S
+            }
+            return running + len(self._reservations)
+
+    def load(self):
+        calls = self.calls()
+        components = {
+            "cpu": self._cpu(),
+            "calls": (
+                (1.0 if calls >= self.max_calls else calls / self.max_calls * self.load_threshold)
+                if self.max_calls else 0.0
+            ),
+            "loop_lag": min(1.0, self._loop_lag() / self.max_loop_lag * self.load_threshold),
+        }
+        self.components = components
+        return min(1.0, max(components.values()))
+
+    def load_fnc(self, worker):
+        """Worker load reported to LiveKit; also feeds the /ready and /stats endpoints"""
+        self._worker = worker
+        # A job process that died before ending its room leaves that room's relayed latencies behind
+        latency_metrics.latency.retain_relayed_rooms(_job_rooms(worker))
+        load = self.load()
+        health_check.worker_status.update(worker, load)
+        return load
+
+    async def request_fnc(self, req):
+        """Accept a job unless the worker is already at capacity"""
+        if self.load() >= self.load_threshold:
+            self.rejected += 1
+            log.warning(
+                f"Rejecting job for room {req.room.name}: worker at capacity "
+                f"({', '.join(f'{k} {v:.2f}' for k, v in self.components.items())})"
+            )
+            await req.reject()
+            return
+        with self._lock:
+            self._reservations[req.room.name] = time.monotonic()
+        self.accepted += 1
+        await req.accept()
+        startup_timeline.job_accepted()
+
+    def job_started(self, room_name):
+        """Called by each job once it is counted as a call"""
+        with self._lock:
+            self._reservations.pop(room_name, None)
+
+    def stats(self):
+        return {
+            "calls": self.calls(),
+            "max_calls": self.max_calls,
+            "max_loop_lag_ms": self.max_loop_lag * 1000,
+            "load_components": {k: round(v, 3) for k, v in self.components.items()},
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+        }
+
+
+def _job_rooms(worker):
+    """Rooms of the jobs the worker is running"""
+    return {job.job.room.name for job in worker.active_jobs}
+
+
+admission = AdmissionControl(
+    max_calls=int(os.getenv("AGENT_MAX_CONCURRENT_CALLS", "10")),
+    max_loop_lag=float(os.getenv("AGENT_MAX_LOOP_LAG_MS", "250")) / 1000,
+    load_threshold=float(os.getenv("AGENT_LOAD_THRESHOLD", "0.75")),
+)
+health_check.register_stats("admission", admission.stats)
+
+
+def worker_options(entrypoint_fnc, prewarm_fnc=prewarm, count_calls=None, **kwargs) -> WorkerOptions:
+    """Build the WorkerOptions shared by the agent entrypoints.
+
+    count_calls returns the number of calls in progress for admission control;
+    by default the calls in the call registry are counted.
+    """
+    # Each job runs in its own process, so one call cannot crash or stall another; their latencies
+    # are relayed to the health server. AGENT_JOB_EXECUTOR=thread runs them in the worker process.
+    kwargs.setdefault(
+        "job_executor_type",
+        JobExecutorType.THREAD if os.getenv("AGENT_JOB_EXECUTOR") == "thread" else JobExecutorType.PROCESS,
+    )
+    if count_calls is not None:
+        admission.set_call_counter(count_calls)
+    kwargs.setdefault("load_fnc", admission.load_fnc)
+    kwargs.setdefault("request_fnc", admission.request_fnc)
+    if os.getenv("AGENT_LOAD_THRESHOLD"):
+        kwargs.setdefault("load_threshold", float(os.environ["AGENT_LOAD_THRESHOLD"]))
+    if isinstance(kwargs.get("load_threshold"), float):
+        admission.load_threshold = kwargs["load_threshold"]
+        health_check.worker_status.load_threshold = kwargs["load_threshold"]
+    return WorkerOptions(entrypoint_fnc=entrypoint_fnc, prewarm_fnc=prewarm_fnc, **kwargs)
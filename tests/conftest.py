@@ -0,0 +1,6 @@
+"""The scripts import each other as top-level modules, as they do when run from scripts/"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
@@ -0,0 +1,83 @@
+import asyncio
+from types import SimpleNamespace
+
+import worker_setup
+
+
+class FakeWorker:
+    def __init__(self):
+        self.id = "test-worker"
+        self.active_jobs = []
+
+    def start(self, room_name):
+        """A job process started: it shows up in the job list, but never calls job_started in the worker"""
+        self.active_jobs.append(SimpleNamespace(job=SimpleNamespace(room=SimpleNamespace(name=room_name))))
+
+    def end(self, room_name):
+        self.active_jobs = [job for job in self.active_jobs if job.job.room.name != room_name]
+
+
+class FakeJobRequest:
+    def __init__(self, room_name):
+        self.room = SimpleNamespace(name=room_name)
+        self.answer = None
+
+    async def accept(self, **_):
+        self.answer = "accepted"
+
+    async def reject(self):
+        self.answer = "rejected"
+
+
+def new_admission(max_calls=4):
+    # Under the process executor the worker's own call registry stays empty
+    return worker_setup.AdmissionControl(
+        max_calls=max_calls, load_threshold=0.75, cpu=lambda: 0.0, loop_lag=lambda: 0.0, count_calls=lambda: 0,
+    )
+
+
+def offer(admission, room_name):
+    req = FakeJobRequest(room_name)
+    asyncio.run(admission.request_fnc(req))
+    return req.answer
+
+
+def test_started_job_processes_are_not_counted_twice():
+    admission, worker = new_admission(), FakeWorker()
+    admission.load_fnc(worker)
+    for i in range(3):
+        assert offer(admission, f"call-{i}") == "accepted"
+    # Accepted but not yet running: reserved
+    assert admission.calls() == 3
+    for i in range(3):
+        worker.start(f"call-{i}")
+    assert admission.load_fnc(worker) < admission.load_threshold
+    assert admission.calls() == 3
+    assert offer(admission, "call-3") == "accepted"
+    assert offer(admission, "call-4") == "rejected"
+
+    worker.start("call-3")
+    worker.end("call-0")
+    admission.load_fnc(worker)
+    assert admission.calls() == 3
+    assert offer(admission, "call-5") == "accepted"
+    assert admission.stats()["accepted"] == 5 and admission.stats()["rejected"] == 1
+
+
+def test_reservations_expire_when_the_job_never_starts(monkeypatch):
+    admission, worker = new_admission(max_calls=2), FakeWorker()
+    admission.load_fnc(worker)
+    assert offer(admission, "call-0") == "accepted"
+    assert offer(admission, "call-1") == "accepted"
+    assert offer(admission, "call-2") == "rejected"
+    monkeypatch.setattr(worker_setup.AdmissionControl, "RESERVATION_S", 0.0)
+    assert admission.calls() == 0
+    assert offer(admission, "call-2") == "accepted"
+
+
+def test_thread_executor_jobs_release_their_reservation():
+    admission = new_admission(max_calls=2)
+    assert offer(admission, "call-0") == "accepted"
+    admission.set_call_counter(lambda: 1)
+    admission.job_started("call-0")
+    assert admission.calls() == 1
@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+import call_registry
+
+
+def new_registry(**kwargs):
+    return call_registry.CallRegistry(**kwargs)
+
+
+def test_counts_follow_start_state_and_end():
+    registry = new_registry()
+    record = registry.start("room-a")
+    registry.start("room-b")
+    assert registry.counts() == {"waiting": 2, "active": 0}
+    registry.set_state(record, "active", participant_identity="sip_1")
+    assert registry.counts() == {"waiting": 1, "active": 1}
+    assert registry.end("room-a") is record
+    assert registry.end("room-a") is None
+    assert registry.counts() == {"waiting": 1, "active": 0}
+    assert len(registry) == 1
+    snapshot = registry.snapshot()
+    assert (snapshot["started"], snapshot["ended"]) == (2, 1)
+
+
+def test_restarting_a_room_replaces_its_record():
+    registry = new_registry()
+    first = registry.start("room-a")
+    registry.set_state(first, "active")
+    second = registry.start("room-a")
+    assert registry.get("room-a") is second
+    assert registry.counts() == {"waiting": 1, "active": 0}
+    # The replaced record no longer moves the counts
+    registry.set_state(first, "waiting")
+    assert registry.counts() == {"waiting": 1, "active": 0}
+
+
+def test_full_registry_drops_the_least_recently_updated():
+    registry = new_registry(max_calls=2)
+    a = registry.start("room-a")
+    registry.start("room-b")
+    registry.set_state(a, "active")
+    registry.start("room-c")
+    assert "room-a" in registry and "room-b" not in registry and "room-c" in registry
+    assert registry.reaped == 1
+    assert registry.counts() == {"waiting": 1, "active": 1}
+
+
+def test_long_call_with_a_live_job_is_never_reaped():
+    registry = new_registry(ttl=0.0)
+
+    async def call():
+        registry.start("room-a")
+        await asyncio.sleep(0.01)
+        assert registry.reap(force=True) == 0
+        assert "room-a" in registry
+
+    asyncio.run(call())
+
+
+def test_call_whose_job_ended_is_reaped():
+    registry = new_registry()
+
+    async def call_without_cleanup():
+        registry.start("room-a")
+
+    asyncio.run(call_without_cleanup())
+    assert registry.reap(force=True) == 1
+    assert "room-a" not in registry
+    assert registry.counts() == {"waiting": 0, "active": 0}
+
+
+def test_call_outside_a_job_is_reaped_after_the_ttl():
+    registry = new_registry(ttl=0.05)
+    record = registry.start("room-a")
+    assert registry.reap(force=True) == 0
+    time.sleep(0.1)
+    registry.set_state(record, "active")
+    assert registry.reap(force=True) == 0
+    time.sleep(0.1)
+    assert registry.reap(force=True) == 1
@@ -0,0 +1,93 @@
+import sqlite3
+import time
+
+import pytest
+
+import caller_store
+
+CALLER = "+447000000001"
+
+
+def stored_rows(path):
+    with sqlite3.connect(path) as db:
+        return db.execute("SELECT COUNT(*) FROM callers").fetchone()[0]
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "callers.sqlite3")
+
+
+def test_caller_ids_are_keyed_with_the_secret(path):
+    assert caller_store.caller_key(CALLER, b"one") != caller_store.caller_key(CALLER, b"two")
+    store = caller_store.CallerStore(path, "secret")
+    store.record_call(CALLER, ["My name is Ada Lovelace"])
+    with open(path, "rb") as f:
+        assert CALLER.encode() not in f.read()
+    assert store.get(CALLER).preferences == {"name": "Ada Lovelace"}
+    # Another key finds nobody
+    assert caller_store.CallerStore(path, "other").get(CALLER) is None
+
+
+def test_a_secret_is_required(path, monkeypatch):
+    with pytest.raises(ValueError):
+        caller_store.CallerStore(path, "")
+    monkeypatch.delenv("CALLER_STORE_KEY", raising=False)
+    monkeypatch.setattr(caller_store, "_store", None)
+    monkeypatch.setattr(caller_store, "_configured", False)
+    assert caller_store.get_store() is None
+    assert caller_store.stats() == {"enabled": False}
+
+
+def test_stored_count_follows_saves_and_deletes(path):
+    store = caller_store.CallerStore(path, "secret", ttl=3600)
+    store.record_call(CALLER, ["hello"])
+    store.record_call(CALLER, ["again"])
+    store.record_call("+447000000002", ["hi"])
+    assert store.stats()["stored"] == stored_rows(path) == 2
+    assert store.get(CALLER).calls == 2
+
+    store._cache.clear()
+    with store._lock:
+        store._db.execute("UPDATE callers SET last_seen = ?", (time.time() - 7200,))
+        store._db.commit()
+    assert store.get(CALLER) is None
+    assert store.stats()["stored"] == stored_rows(path) == 1
+    assert store.purge_expired() == 1
+    assert store.stats()["stored"] == stored_rows(path) == 0
+
+    store.record_call(CALLER, ["back"])
+    assert caller_store.CallerStore(path, "secret").stats()["stored"] == 1
+
+
+def test_a_resumed_call_is_not_counted_again(path):
+    store = caller_store.CallerStore(path, "secret")
+    store.record_call(CALLER, ["When is the book out?"])
+    profile = store.record_call(CALLER, ["Can you email me the details?"], resumed=True)
+    assert profile.calls == 1
+    assert "When is the book out?" in profile.summary and "Can you email me the details?" in profile.summary
+
+
+def test_only_requests_and_topics_are_kept():
+    summary = caller_store.summarize_call("", [
+        "Hi there, lovely weather today. My daughter is at school.",
+        "I'd like to know when the tarot book comes out",
+        "and can you send me your email address?",
+        "Great, thanks. Bye.",
+    ], 600)
+    assert "topics fortunes told, contact." in summary
+    assert "I'd like to know when the tarot book comes out / and can you send me your email address?" in summary
+    assert "weather" not in summary and "daughter" not in summary and "Bye" not in summary
+    # Nothing asked for: the notes stay as they were
+    assert caller_store.summarize_call("Earlier notes.", ["Okay, thanks.", "Bye."], 600) == "Earlier notes."
+
+
+@pytest.mark.parametrize("said, name", [
+    ("My name is Ada Lovelace", "Ada Lovelace"),
+    ("hi, my name is Ada and I'm calling about the book", "Ada"),
+    ("MY NAME IS Grace", "Grace"),
+    ("my name is not important", None),
+    ("my name is ada", None),
+])
+def test_name_preference(said, name):
+    assert caller_store.preferences_from([said], {}).get("name") == name
@@ -0,0 +1,65 @@
+import asyncio
+
+import chat_ingress
+
+
+class FakeHandle:
+    """The parts of a SpeechHandle that ChatIngress uses"""
+
+    def __init__(self, text):
+        self.text = text
+        self.cancelled = False
+        self._done = asyncio.get_running_loop().create_future()
+
+    def join(self):
+        return self._done
+
+    def cancel(self):
+        self.cancelled = True
+        if not self._done.done():
+            self._done.set_result(None)
+
+
+def new_ingress():
+    handles = []
+
+    async def reply(text):
+        handles.append(FakeHandle(text))
+        return handles[-1]
+
+    return chat_ingress.ChatIngress(reply, "room-a", coalesce=0.01, max_wait=0.05, max_in_flight=2), handles
+
+
+def test_burst_is_answered_once():
+    async def scenario():
+        ingress, handles = new_ingress()
+        for text in ("one", "two", "three"):
+            ingress.submit(text)
+        await asyncio.sleep(0.05)
+        assert [h.text for h in handles] == ["one\ntwo\nthree"]
+        await ingress.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_queued_reply_is_superseded_until_its_playout_starts():
+    async def scenario():
+        ingress, handles = new_ingress()
+        ingress.submit("one")
+        await asyncio.sleep(0.05)
+        # agent.say has returned, but the speech is still waiting for playout
+        ingress.submit("two")
+        await asyncio.sleep(0.05)
+        assert handles[0].cancelled
+        assert [h.text for h in handles] == ["one", "one\ntwo"]
+
+        ingress.playout_started(handles[1])
+        ingress.submit("three")
+        await asyncio.sleep(0.05)
+        assert not handles[1].cancelled
+        assert [h.text for h in handles] == ["one", "one\ntwo", "three"]
+        await ingress.aclose()
+
+    superseded = chat_ingress.stats()["superseded"]
+    asyncio.run(scenario())
+    assert chat_ingress.stats()["superseded"] == superseded + 1
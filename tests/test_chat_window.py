@@ -0,0 +1,97 @@
+import asyncio
+from types import SimpleNamespace
+
+from livekit.agents import llm
+
+import chat_window
+
+
+class StubLLM:
+    """Summary model that answers with a fixed text, or fails"""
+
+    def __init__(self, summary="The caller asked about the book.", error=None):
+        self.summary = summary
+        self.error = error
+        self.requests = []
+
+    def chat(self, *, chat_ctx):
+        self.requests.append(chat_ctx)
+        return _StubStream(self)
+
+
+class _StubStream:
+    def __init__(self, stub):
+        self.stub = stub
+
+    async def __aiter__(self):
+        if self.stub.error is not None:
+            raise self.stub.error
+        yield llm.ChatChunk(request_id="r", choices=[llm.Choice(delta=llm.ChoiceDelta(role="assistant", content=self.stub.summary))])
+
+    async def aclose(self):
+        pass
+
+
+def said(role, words=100):
+    return llm.ChatMessage.create(text=f"{role} " + "word " * words, role=role)
+
+
+def tool_call(call_id):
+    call = SimpleNamespace(function_info=SimpleNamespace(name="get_company_info"), raw_arguments='{"topic": "book"}')
+    return [
+        llm.ChatMessage(role="assistant", tool_calls=[call]),
+        llm.ChatMessage(role="tool", content="word " * 100, tool_call_id=call_id),
+    ]
+
+
+def compact(messages, summary_llm, **kwargs):
+    chat_ctx = llm.ChatContext(messages=[llm.ChatMessage.create(text="You are a receptionist.", role="system"), *messages])
+
+    async def scenario():
+        window = chat_window.ChatWindow(chat_ctx, summary_llm, budget_tokens=500, keep_tokens=300, **kwargs)
+        window.maybe_compact()
+        if window._task is not None:
+            await window._task
+        return window
+
+    return asyncio.run(scenario())
+
+
+def test_tool_calls_stay_with_their_results():
+    turns = [
+        said("user"), *tool_call("1"), said("assistant"),
+        said("user"), *tool_call("2"), said("assistant"),
+        said("user"), said("assistant"),
+    ]
+    stub = StubLLM()
+    window = compact(turns, stub)
+    messages = window.chat_ctx.messages
+    assert messages[1].content == chat_window.SUMMARY_HEADER + stub.summary
+    kept = messages[2:]
+    # Whole turns were folded: the second tool call would have been cut off from its result
+    assert kept == turns[-2:]
+    assert sum(chat_window.estimate_tokens(m) for m in kept) <= window.keep_tokens
+    assert "(looked up:" in stub.requests[0].messages[-1].content
+
+
+def test_the_latest_user_turn_is_never_folded():
+    # One long turn still in progress: nothing can be folded
+    in_progress = [said("user"), *tool_call("1"), *tool_call("2"), said("assistant", 400)]
+    window = compact(in_progress, StubLLM())
+    assert window.summary is None
+    assert window.chat_ctx.messages[1:] == in_progress
+
+    turns = [said("user"), said("assistant", 400), said("user", 400), *tool_call("1")]
+    window = compact(turns, StubLLM())
+    assert window.chat_ctx.messages[2:] == turns[2:]
+
+
+def test_a_failed_summary_keeps_the_end_of_the_transcript():
+    turns = [said("user"), said("assistant"), said("user"), said("assistant"), said("user"), said("assistant")]
+    failures = chat_window.stats()["summary_failures"]
+    window = compact(turns, StubLLM(error=RuntimeError("no model")), summary_words=20)
+    assert chat_window.stats()["summary_failures"] == failures + 1
+    assert window.summary.startswith("...") and len(window.summary) == 3 + 20 * 6
+    assert window.summary.endswith("word")
+    assert window.chat_ctx.messages[1].content == chat_window.SUMMARY_HEADER + window.summary
+    assert window.chat_ctx.messages[2].role == "user"
@@ -0,0 +1,73 @@
+import re
+
+import pytest
+
+import company_knowledge
+
+
+@pytest.mark.parametrize("topic, expected", [
+    # One section per topic
+    ("fortunes told book", "fortunes told"),
+    ("when is the book released", "fortunes told"),
+    ("tarot", "fortunes told"),
+    ("AI research", "ai research"),
+    ("machine learning models", "ai research"),
+    ("ethics", "ethics"),
+    ("animation film", "animation"),
+    ("email address", "contact"),
+    ("contact details", "contact"),
+    ("who founded the company", "general"),
+    # Plurals the keyword tables do not list
+    ("storyboards", "animation"),
+    ("cartoons", "animation"),
+    ("tarot cards", "fortunes told"),
+    # Casing and punctuation
+    ("FORTUNES TOLD", "fortunes told"),
+    ("Machine-Learning", "ai research"),
+    ("E-mail?", "contact"),
+    # Word boundaries: 'ai' is not matched inside other words
+    ("detail", "general"),
+    ("email", "contact"),
+    ("said", "general"),
+    ("available formats", "general"),
+    ("something unrelated", "general"),
+    ("", "general"),
+])
+def test_lookup_sections(topic, expected):
+    assert company_knowledge.lookup_sections(topic)[0] == expected
+
+
+def test_phrase_outscores_its_words():
+    scores = company_knowledge.score_topic("get in touch")
+    assert max(scores, key=scores.get) == "contact"
+
+
+def test_runner_up_kept_only_when_close():
+    assert company_knowledge.lookup_sections("ethics of ai research") == ["ethics", "ai research"]
+    assert company_knowledge.lookup_sections("fortunes told book release", max_sections=1) == ["fortunes told"]
+
+
+def test_every_section_has_text():
+    assert set(company_knowledge.SECTION_KEYWORDS) <= set(company_knowledge.SECTION_TEXT)
+    for section in company_knowledge.SECTION_KEYWORDS:
+        assert company_knowledge.lookup(section).strip()
+
+
+def test_sections_keep_the_original_phrasing():
+    assert (
+        "unfolds and evolves over time through a real-time, voice-to-voice interactive experience."
+        in company_knowledge.SECTION_TEXT["fortunes told"]
+    )
+    for section, text in company_knowledge.SECTION_TEXT.items():
+        # A hard wrap after a hyphen must not leave "voice- to-voice"
+        assert not re.search(r"\w- \w", text), section
+
+
+@pytest.mark.parametrize("lines, expected", [
+    (["a real-time, voice-", "to-voice experience"], "a real-time, voice-to-voice experience"),
+    (["hand-produced in", "  London  "], "hand-produced in London"),
+    (["a pause -", "then more"], "a pause - then more"),
+    (["", "one", ""], "one"),
+])
+def test_join_lines(lines, expected):
+    assert company_knowledge.join_lines(lines) == expected
@@ -0,0 +1,46 @@
+import asyncio
+import json
+import tracemalloc
+from types import SimpleNamespace
+
+from livekit import rtc
+
+import frame_profiler
+
+
+class FakeJobContext:
+    def __init__(self, room_name):
+        self.room = SimpleNamespace(name=room_name)
+        self.shutdown_callbacks = []
+
+    def add_shutdown_callback(self, callback):
+        self.shutdown_callbacks.append(callback)
+
+    def shutdown(self):
+        for callback in self.shutdown_callbacks:
+            asyncio.run(callback())
+
+
+def test_hooks_last_only_while_calls_are_profiled(tmp_path, monkeypatch):
+    monkeypatch.setattr(frame_profiler, "ENABLED", True)
+    monkeypatch.setattr(frame_profiler, "PROFILE_DIR", str(tmp_path))
+    capture_frame = rtc.AudioSource.capture_frame
+    assert not tracemalloc.is_tracing()
+
+    first, second = FakeJobContext("room-a"), FakeJobContext("room-b")
+    frame_profiler.start(first)
+    frame_profiler.start(second)
+    assert tracemalloc.is_tracing()
+    assert rtc.AudioSource.capture_frame is not capture_frame
+
+    first.shutdown()
+    assert tracemalloc.is_tracing()
+    assert rtc.AudioSource.capture_frame is not capture_frame
+
+    second.shutdown()
+    assert not tracemalloc.is_tracing()
+    assert rtc.AudioSource.capture_frame is capture_frame
+
+    reports = sorted(tmp_path.glob("*.json"))
+    assert [json.loads(path.read_text())["room"] for path in reports] == ["room-a", "room-b"]
+    assert all("top_allocations" in json.loads(path.read_text()) for path in reports)
@@ -0,0 +1,96 @@
+import knowledge_store
+
+
+def test_chunk_text_joins_hyphenated_wraps():
+    text = "# Fortunes Told\n\nA real-time, voice-\nto-voice interactive experience.\n"
+    assert knowledge_store.chunk_text(text) == ["Fortunes Told: A real-time, voice-to-voice interactive experience."]
+
+
+def test_chunk_text_splits_on_sentences():
+    sentence = "This sentence is about forty characters. "
+    chunks = knowledge_store.chunk_text("# Ethics\n\n" + sentence * 10, max_chars=100)
+    assert len(chunks) == 5
+    assert all(chunk.startswith("Ethics: ") and len(chunk) <= 100 + len("Ethics: ") for chunk in chunks)
+
+
+def test_store_indexes_the_knowledge_files(tmp_path):
+    store = knowledge_store.KnowledgeStore(index_dir=str(tmp_path / "index"))
+    assert store.refresh(force=True)
+    texts = [chunk["text"] for chunk in store._state[1]]
+    assert any("voice-to-voice" in text for text in texts)
+    assert not any("voice- to" in text for text in texts)
+
+
+def write_sources(directory):
+    directory.mkdir()
+    (directory / "books.md").write_text(
+        "# Books\n\nFortunes Told is a book about tarot, released in June.\n\n"
+        "Pre-order the book at Waterstones, Foyles and Amazon.\n"
+    )
+    (directory / "films.md").write_text("# Films\n\nAn animated film is in production, hand-drawn in London.\n")
+    (directory / "contact.md").write_text("# Contact\n\nEmail the studio to get in touch with the team.\n")
+
+
+def counting_features(store, monkeypatch):
+    embedded = []
+    features = store.embedder.features
+
+    def count(text):
+        embedded.append(text)
+        return features(text)
+
+    monkeypatch.setattr(store.embedder, "features", count)
+    return embedded
+
+
+def test_only_the_changed_file_is_re_embedded(tmp_path, monkeypatch):
+    source_dir = tmp_path / "knowledge"
+    write_sources(source_dir)
+    store = knowledge_store.KnowledgeStore(str(source_dir), index_dir=str(tmp_path / "index"))
+    assert store.refresh(force=True)
+    assert not store.refresh(force=True)
+
+    (source_dir / "films.md").write_text("# Films\n\nThe animated film is now a series, still made in London.\n")
+    embedded = counting_features(store, monkeypatch)
+    assert store.refresh(force=True)
+    assert embedded == ["Films: The animated film is now a series, still made in London."]
+    assert {chunk["source"] for chunk in store._state[1]} == {"books.md", "films.md", "contact.md"}
+
+    # A new process picks the index up from disk and embeds nothing
+    reopened = knowledge_store.KnowledgeStore(str(source_dir), index_dir=str(tmp_path / "index"))
+    embedded = counting_features(reopened, monkeypatch)
+    assert not reopened.refresh(force=True)
+    assert embedded == [] and len(reopened) == len(store)
+
+
+def test_search_ranks_the_matching_chunk_first(tmp_path):
+    source_dir = tmp_path / "knowledge"
+    write_sources(source_dir)
+    store = knowledge_store.KnowledgeStore(str(source_dir), index_dir=str(tmp_path / "index"))
+    for query, source, phrase in [
+        ("when is the book released", "books.md", "released in June"),
+        ("where can I pre-order it", "books.md", "Waterstones"),
+        ("animation", "films.md", "animated film"),
+        ("how do I contact you by email", "contact.md", "Email"),
+    ]:
+        results = store.search(query, k=3)
+        scores = [score for score, _ in results]
+        assert scores == sorted(scores, reverse=True)
+        assert results[0][1]["source"] == source and phrase in results[0][1]["text"], query
+
+
+def test_unwritable_index_is_kept_in_memory(tmp_path):
+    source_dir = tmp_path / "knowledge"
+    write_sources(source_dir)
+    # A file where the index directory should be, as on a read-only image
+    blocked = tmp_path / "index"
+    blocked.write_text("")
+    store = knowledge_store.KnowledgeStore(str(source_dir), index_dir=str(blocked / "sub"))
+    assert store.refresh(force=True)
+    assert store.search("tarot")[0][1]["source"] == "books.md"
+
+
+def test_default_index_dir_is_outside_the_sources():
+    index_dir = knowledge_store.default_index_dir(knowledge_store.KNOWLEDGE_DIR)
+    assert not index_dir.startswith(knowledge_store.KNOWLEDGE_DIR)
+    assert index_dir != knowledge_store.default_index_dir("/elsewhere")
@@ -0,0 +1,98 @@
+import os
+import select
+import socket
+import subprocess
+import sys
+
+import pytest
+
+import latency_metrics
+
+SCRIPTS_DIR = os.path.dirname(latency_metrics.__file__)
+
+
+def test_histogram_quantiles_within_bucket_error():
+    histogram = latency_metrics.LatencyHistogram()
+    for ms in range(1, 1001):
+        histogram.record(ms / 1000)
+    p50, p95, p99 = histogram.quantiles()
+    assert p50 == pytest.approx(0.5, rel=0.03)
+    assert p95 == pytest.approx(0.95, rel=0.03)
+    assert p99 == pytest.approx(0.99, rel=0.03)
+    assert histogram.count == 1000
+
+
+def test_end_room_drops_only_that_room():
+    registry = latency_metrics.LatencyRegistry()
+    registry._relay = None
+    registry.record("turn_total", "room-a", 0.5)
+    registry.record("turn_total", "room-b", 0.7)
+    registry.end_room("room-a")
+    snapshot = registry.snapshot()
+    assert snapshot["worker"]["turn_total"]["count"] == 2
+    assert list(snapshot["rooms"]) == ["room-b/turn_total"]
+
+
+@pytest.fixture
+def listening(monkeypatch):
+    monkeypatch.setenv(latency_metrics.RELAY_SOCKET_ENV, "")
+    registry = latency_metrics.LatencyRegistry()
+    sock = registry.listen()
+    yield registry, sock
+    sock.close()
+    os.unlink(os.environ[latency_metrics.RELAY_SOCKET_ENV])
+
+
+def run_job_process(code):
+    """Run code in a new process with the worker's environment, as the process executor does"""
+    subprocess.run(
+        [sys.executable, "-c", f"import latency_metrics\n{code}"],
+        cwd=SCRIPTS_DIR, env=os.environ.copy(), check=True, timeout=30,
+    )
+
+
+def receive_all(registry, sock, messages):
+    for _ in range(messages):
+        select.select([sock], [], [], 5)
+        registry.receive(sock)
+
+
+def test_job_process_latencies_reach_the_worker(listening):
+    registry, sock = listening
+    run_job_process(
+        "latency_metrics.latency.record('turn_total', 'room-a', 0.8)\n"
+        "latency_metrics.latency.record('turn_total', 'room-b', 1.2)\n"
+        "latency_metrics.latency.end_room('room-a')\n"
+    )
+    receive_all(registry, sock, 3)
+    snapshot = registry.snapshot()
+    assert snapshot["worker"]["turn_total"]["count"] == 2
+    assert list(snapshot["rooms"]) == ["room-b/turn_total"]
+    assert 'stage="turn_total"' in registry.render_prometheus()
+
+
+def test_worker_does_not_relay_to_itself(listening):
+    registry, _ = listening
+    registry.record("turn_total", "room-a", 0.1)
+    assert registry._relay is None
+
+
+def test_rooms_of_dead_job_processes_are_dropped(listening):
+    registry, sock = listening
+    run_job_process("latency_metrics.latency.record('turn_total', 'room-a', 0.8)")
+    receive_all(registry, sock, 1)
+    registry.retain_relayed_rooms(["room-a"])
+    assert "room-a/turn_total" in registry.snapshot()["rooms"]
+    registry.retain_relayed_rooms([])
+    assert registry.snapshot()["rooms"] == {}
+    assert registry.snapshot()["worker"]["turn_total"]["count"] == 1
+
+
+def test_malformed_messages_are_ignored(listening):
+    registry, sock = listening
+    sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sender.sendto(b"not json", os.environ[latency_metrics.RELAY_SOCKET_ENV])
+    sender.sendto(b'["record", "turn_total"]', os.environ[latency_metrics.RELAY_SOCKET_ENV])
+    sender.close()
+    receive_all(registry, sock, 1)
+    assert registry.snapshot()["worker"] == {}
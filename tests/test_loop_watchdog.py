@@ -0,0 +1,50 @@
+import asyncio
+import time
+
+import loop_watchdog
+
+
+def block_the_loop(seconds):
+    time.sleep(seconds)
+
+
+def test_stall_is_attributed_to_the_blocking_call():
+    watchdog = loop_watchdog.LoopWatchdog(interval=0.02, threshold=0.05, window=0.5)
+
+    async def scenario():
+        watchdog.watch(asyncio.get_running_loop(), "test")
+        await asyncio.sleep(0.1)
+        block_the_loop(0.3)
+        await asyncio.sleep(0.1)
+        # The stall is over, but still within the window
+        return watchdog.max_recent_lag(), watchdog.snapshot()
+
+    lag, snapshot = asyncio.run(scenario())
+    assert lag >= 0.25
+    assert snapshot["loops"]["test"]["stalls"] == 1
+    site = snapshot["top_slow_sites"][0]
+    assert site["site"].startswith("test_loop_watchdog.py:") and site["site"].endswith("in block_the_loop")
+    assert site["worst_ms"] >= 250
+    assert "block_the_loop(0.3)" in site["stack"] and "in scenario" in site["stack"]
+    assert snapshot["recent_stalls"][-1]["site"] == site["site"]
+
+    # Once the window has passed, the old stall no longer counts
+    time.sleep(0.6)
+    assert watchdog.max_recent_lag() < 0.25
+
+
+def test_max_recent_lag_is_the_worst_beat_in_the_window():
+    watchdog = loop_watchdog.LoopWatchdog(interval=0.02, threshold=1.0, window=5.0)
+
+    async def scenario():
+        watchdog.watch(asyncio.get_running_loop(), "test")
+        await asyncio.sleep(0.05)
+        block_the_loop(0.15)
+        for _ in range(5):
+            await asyncio.sleep(0.02)
+        return watchdog.max_recent_lag(), watchdog.snapshot()["loops"]["test"]
+
+    lag, loop = asyncio.run(scenario())
+    # Later, shorter beats do not hide the earlier slow one
+    assert lag >= 0.12
+    assert loop["beats"] >= 5 and loop["stalls"] == 0
@@ -0,0 +1,147 @@
+import argparse
+import asyncio
+import contextlib
+import json
+
+from aiohttp import web
+from livekit import api
+
+import manage_calls
+from mock_livekit import MockLiveKit
+
+# The mock accepts any credentials
+API_KEY = "devkey"
+API_SECRET = "devsecret" * 4
+
+
+@contextlib.asynccontextmanager
+async def serving(mock):
+    """The mock's API on a free local port; yields its URL"""
+    runner = web.AppRunner(mock.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    try:
+        yield f"http://127.0.0.1:{runner.addresses[0][1]}"
+    finally:
+        await runner.cleanup()
+
+
+def new_mock(rooms=3):
+    mock = MockLiveKit(rooms=rooms)
+    # Not a call room, so never listed or ended
+    mock.rooms["lobby"] = api.Room(sid="RM_lobby", name="lobby", num_participants=1)
+    return mock
+
+
+def cli_args(action, **kwargs):
+    defaults = {"room": None, "filter": None, "all": False, "json": False, "interval": 0.01, "concurrency": 4}
+    return argparse.Namespace(action=action, **{**defaults, **kwargs})
+
+
+async def run_cli(mock, action, **kwargs):
+    async with serving(mock) as url:
+        return await manage_calls.run(cli_args(action, **kwargs), url, API_KEY, API_SECRET)
+
+
+def test_list_calls():
+    mock = new_mock()
+
+    async def scenario():
+        async with serving(mock) as url, manage_calls.CallManager(url, API_KEY, API_SECRET) as manager:
+            return await manager.list_active_calls()
+
+    calls = asyncio.run(scenario())
+    assert sorted(c["room"] for c in calls) == sorted(n for n in mock.rooms if n.startswith("call-"))
+    for call in calls:
+        assert call["num_participants"] == 2
+        assert [p["name"] for p in call["participants"]] == ["Caller", "pi-receptionist"]
+    assert mock.requests["ListRooms"] == 1
+    assert mock.requests["ListParticipants"] == 3
+
+
+def test_list_json(capsys):
+    mock = new_mock()
+    assert asyncio.run(run_cli(mock, "list", json=True)) == 0
+    calls = json.loads(capsys.readouterr().out)
+    assert len(calls) == 3
+    assert all(c["room"].startswith("call-") for c in calls)
+
+
+def test_end_by_room():
+    mock = new_mock()
+    room = next(n for n in mock.rooms if n.startswith("call-"))
+    assert asyncio.run(run_cli(mock, "end", room=[room, room])) == 0
+    assert room not in mock.rooms
+    assert mock.requests["DeleteRoom"] == 1
+    assert len(mock.rooms) == 3
+
+
+def test_end_unknown_room_fails(capsys):
+    mock = new_mock()
+    assert asyncio.run(run_cli(mock, "end", room=["call-missing"], json=True)) == 1
+    assert json.loads(capsys.readouterr().out) == {"ended": [], "failed": ["call-missing"]}
+
+
+def test_end_by_filter():
+    mock = new_mock(rooms=0)
+    for name in ("call-_+441_a", "call-_+441_b", "call-_+442_c"):
+        mock.rooms[name] = api.Room(name=name)
+    assert asyncio.run(run_cli(mock, "end", filter="call-_+441_*")) == 0
+    assert sorted(mock.rooms) == ["call-_+442_c", "lobby"]
+
+
+def test_end_all_json(capsys):
+    mock = new_mock()
+    calls = sorted(n for n in mock.rooms if n.startswith("call-"))
+    assert asyncio.run(run_cli(mock, "end", all=True, json=True)) == 0
+    assert sorted(json.loads(capsys.readouterr().out)["ended"]) == calls
+    assert list(mock.rooms) == ["lobby"]
+
+
+def test_watcher_reports_changes_with_few_requests():
+    mock = new_mock()
+
+    async def scenario():
+        async with serving(mock) as url, manage_calls.CallManager(url, API_KEY, API_SECRET) as manager:
+            watcher = manage_calls.CallWatcher(manager)
+            started, ended, changed = await watcher.poll()
+            assert sorted(started) == sorted(n for n in mock.rooms if n.startswith("call-"))
+            assert (ended, changed) == ([], [])
+            requests = watcher.requests
+
+            # Nothing changed: one ListRooms request and no participant fetches
+            assert await watcher.poll() == ([], [], [])
+            assert watcher.requests == requests + 1
+
+            first, second = sorted(watcher.calls)[:2]
+            room = mock.rooms[first]
+            room.num_participants = 3
+            room.version.ticks += 1
+            mock.delete(second)
+            new = mock.add_call()
+            started, ended, changed = await watcher.poll()
+            assert (started, ended, changed) == ([new], [second], [first])
+            assert watcher.requests == requests + 1 + 3
+            assert set(watcher.calls) == {n for n in mock.rooms if n.startswith("call-")}
+
+    asyncio.run(scenario())
+
+
+def test_watch_json_emits_one_line_per_change(capsys):
+    mock = new_mock(rooms=2)
+
+    async def scenario():
+        async with serving(mock) as url, manage_calls.CallManager(url, API_KEY, API_SECRET) as manager:
+            task = asyncio.create_task(manage_calls.watch_calls(manager, 0.01, as_json=True))
+            await asyncio.sleep(0.2)
+            mock.delete(sorted(n for n in mock.rooms if n.startswith("call-"))[0])
+            await asyncio.sleep(0.2)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(scenario())
+    events = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert len(events) == 2
+    assert len(events[0]["started"]) == 2 and events[0]["active"] == 2
+    assert len(events[1]["ended"]) == 1 and events[1]["active"] == 1
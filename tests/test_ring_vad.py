@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+import ring_vad
+
+
+def filled_ring(capacity, total):
+    """A ring that has been written positions 0..total-1, each sample holding its own position"""
+    ring = ring_vad.AudioRing(capacity)
+    samples = np.arange(total, dtype=np.int16)
+    for i in range(0, total, 7):
+        ring.write(samples[i:i + 7].tobytes())
+    return ring
+
+
+def test_writes_wrap_around():
+    ring = filled_ring(16, 40)
+    assert (ring.start, ring.end) == (24, 40)
+    assert sorted(ring.buffer) == list(range(24, 40))
+    # One write longer than the ring keeps its newest samples
+    ring.write(np.arange(100, 150, dtype=np.int16).tobytes())
+    assert (ring.start, ring.end) == (74, 90)
+    assert sorted(ring.buffer) == list(range(134, 150))
+
+
+def test_reads_across_the_wrap():
+    ring = filled_ring(16, 40)
+    out = np.empty(10, dtype=np.float32)
+    # Positions 28..37 span the end of the buffer
+    ring.scaled(28, out)
+    np.testing.assert_array_equal(out, np.arange(28, 38, dtype=np.float32) / 32768)
+
+    frame = ring.frame(28, 38, 8000)
+    assert frame.samples_per_channel == 10
+    np.testing.assert_array_equal(np.frombuffer(frame.data, dtype=np.int16), np.arange(28, 38))
+    # Positions already overwritten are left out
+    assert np.frombuffer(ring.frame(10, 30, 8000).data, dtype=np.int16).tolist() == list(range(24, 30))
+
+
+def test_windows_at_the_model_rate():
+    reader = ring_vad.WindowReader(16000, 16000, 8)
+    ring = filled_ring(32, 23)
+    assert reader.available(ring) == 2
+    out = np.empty(8, dtype=np.float32)
+    reader.read(ring, out)
+    reader.read(ring, out)
+    np.testing.assert_array_equal(out * 32768, np.arange(8, 16))
+    assert reader.available(ring) == 0
+    ring.write(np.arange(23, 24, dtype=np.int16).tobytes())
+    assert reader.available(ring) == 1
+    assert reader.input_position == 16
+
+
+@pytest.mark.parametrize("input_rate", [8000, 24000, 48000])
+def test_resampled_windows_interpolate_across_the_wrap(input_rate):
+    window = 32
+    reader = ring_vad.WindowReader(input_rate, 16000, window)
+    # Little more than one window's span, so most windows straddle the wrap
+    ring = ring_vad.AudioRing(int(window * reader.step) + 20)
+    signal = (np.sin(np.arange(4000) / 5.0) * 10000).astype(np.int16)
+    out = np.empty(window, dtype=np.float32)
+    written = windows = 0
+    while written < len(signal):
+        ring.write(signal[written:written + 13].tobytes())
+        written = min(written + 13, len(signal))
+        while reader.available(ring):
+            start = reader.position
+            # Every sample the window interpolates between must still be in the ring
+            assert start >= ring.start
+            reader.read(ring, out)
+            positions = start + np.arange(window) * reader.step
+            assert positions[-1] + 1 < ring.end
+            expected = np.interp(positions, np.arange(len(signal)), signal) / 32768
+            np.testing.assert_allclose(out, expected, atol=1e-6)
+            windows += 1
+    # Windows are read as soon as they are complete, never later
+    assert windows == int((len(signal) - 2) / (window * reader.step))
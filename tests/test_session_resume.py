@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+import pytest
+
+import caller_store
+import session_resume
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "callers.sqlite3")
+
+
+def parked_call(room_name="room-a", turns=None):
+    return session_resume.ParkedCall(room_name, "Be helpful.", turns or [("user", "hello")])
+
+
+def test_claimed_once_by_a_job_in_another_process(path):
+    parking = session_resume.SessionParking(caller_store.CallerStore(path, "secret"), 60)
+    assert parking.park(parked_call(turns=[("user", "hello"), ("assistant", "hi there")]))
+    # A new job process opens the store again
+    other = session_resume.SessionParking(caller_store.CallerStore(path, "secret"), 60)
+    assert other.stats()["waiting"] == 1
+    assert other.claim("room-b") is None
+    call = other.claim("room-a")
+    assert (call.instructions, call.turns) == ("Be helpful.", [("user", "hello"), ("assistant", "hi there")])
+    assert call.age() < 1
+    assert parking.claim("room-a") is None and other.claim("room-a") is None
+    assert other.stats()["resumed"] == 1 and other.stats()["waiting"] == 0
+
+
+def test_expired_calls_are_not_resumed(path):
+    store = caller_store.CallerStore(path, "secret")
+    parking = session_resume.SessionParking(store, 60)
+    parking.park(parked_call())
+    with store._lock:
+        store._db.execute("UPDATE parked_calls SET parked_at = ?", (time.time() - 61,))
+        store._db.commit()
+    assert parking.stats()["waiting"] == 0
+    assert parking.claim("room-a") is None
+    assert parking.stats()["expired"] == 1
+
+    # Parking purges calls nobody claimed
+    parking.park(parked_call("room-b"))
+    with store._lock:
+        store._db.execute("UPDATE parked_calls SET parked_at = ?", (time.time() - 61,))
+        store._db.commit()
+    parking.park(parked_call("room-c"))
+    assert parking.stats()["expired"] == 2
+
+
+def test_nothing_is_parked_without_a_store(monkeypatch):
+    monkeypatch.setenv("SESSION_RESUME_GRACE_S", "60")
+    parking = session_resume.SessionParking(None, session_resume.configured_grace())
+    assert not parking.park(parked_call())
+    assert parking.claim("room-a") is None
+    assert parking.stats()["grace_s"] == 0
+
+
+def test_a_reconnect_waits_for_the_running_job_to_park_the_call(path):
+    parking = session_resume.SessionParking(caller_store.CallerStore(path, "secret"), 60)
+    running = [True]
+
+    async def scenario():
+        async def old_job_ends():
+            await asyncio.sleep(0.3)
+            parking.park(parked_call())
+            running[0] = False
+
+        ending = asyncio.create_task(old_job_ends())
+        call = await parking.claim_after("room-a", lambda: running[0])
+        await ending
+        return call
+
+    assert asyncio.run(scenario()).turns == [("user", "hello")]
+
+
+def test_resume_context_keeps_recent_turns_and_notes_older_ones():
+    turns = [("user" if i % 2 == 0 else "assistant", f"turn {i}") for i in range(6)]
+    instructions, chat_ctx = parked_call(turns=turns).resume_context(keep=2, note_chars=1000)
+    assert instructions.startswith("Be helpful.")
+    assert session_resume.RESUME_NOTE in instructions
+    assert "Caller: turn 0 / You: turn 1" in instructions and "turn 4" not in instructions
+    assert [m.content for m in chat_ctx.messages] == ["turn 4", "turn 5"]
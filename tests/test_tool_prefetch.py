@@ -0,0 +1,109 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import knowledge_store
+import tool_prefetch
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    """Topic lists passed to lookup_many; each lookup waits for the release event"""
+    calls = []
+    release = threading.Event()
+    release.set()
+
+    def lookup_many(topics, k=2):
+        calls.append(list(topics))
+        release.wait(5)
+        return [f"about {topic}" for topic in topics]
+
+    monkeypatch.setattr(knowledge_store, "lookup_many", lookup_many)
+    monkeypatch.setattr(knowledge_store, "lookup", lambda topic, k=2: f"looked up {topic}")
+    return SimpleNamespace(calls=calls, release=release)
+
+
+def transcript(text):
+    return SimpleNamespace(alternatives=[SimpleNamespace(text=text)])
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0.02)
+
+
+def test_interim_transcripts_are_debounced(lookups):
+    async def scenario():
+        prefetcher = tool_prefetch.ToolPrefetcher(enabled=True, debounce=0.05)
+        for text in ("when", "when is the", "when is the book", "when is the book released"):
+            prefetcher._on_interim_transcript(transcript(text))
+            await asyncio.sleep(0.01)
+        assert lookups.calls == []
+        await settle()
+        assert len(lookups.calls) == 1
+        assert "book released" in lookups.calls[0]
+        # A final transcript is looked up at once, for the topics not looked up yet
+        prefetcher._on_final_transcript(transcript("when is the book released in paperback"))
+        await settle()
+        assert len(lookups.calls) == 2 and "paperback" in lookups.calls[1]
+        assert "book released" not in lookups.calls[1]
+        assert await prefetcher.resolve("Book released") == "about book released"
+
+    asyncio.run(scenario())
+
+
+def test_a_new_turn_cancels_the_debounced_lookup(lookups):
+    async def scenario():
+        prefetcher = tool_prefetch.ToolPrefetcher(enabled=True, debounce=0.05)
+        prefetcher._on_interim_transcript(transcript("tarot cards"))
+        prefetcher.new_turn()
+        await settle()
+        assert lookups.calls == []
+
+    asyncio.run(scenario())
+
+
+def test_results_of_an_earlier_turn_are_discarded(lookups):
+    async def scenario():
+        prefetcher = tool_prefetch.ToolPrefetcher(enabled=True)
+        lookups.release.clear()
+        prefetcher.speculate("tarot cards")
+        await asyncio.sleep(0.02)
+        # The caller speaks again before the lookup finishes
+        prefetcher.new_turn()
+        lookups.release.set()
+        await settle()
+        assert prefetcher._results == {} and prefetcher._pending == {}
+        return await prefetcher.resolve("tarot cards")
+
+    before = tool_prefetch.stats()
+    assert asyncio.run(scenario()) == "looked up tarot cards"
+    after = tool_prefetch.stats()
+    assert after["stale"] > before["stale"]
+    assert after["misses"] == before["misses"] + 1
+    assert after["hits"] == before["hits"]
+
+
+def test_before_llm_cb_speculates_on_the_user_message(lookups):
+    def chat_ctx(role, content):
+        return SimpleNamespace(messages=[SimpleNamespace(role=role, content=content)])
+
+    async def scenario():
+        prefetcher = tool_prefetch.ToolPrefetcher(enabled=True)
+        assert prefetcher.before_llm_cb(None, chat_ctx("assistant", "How can I help?")) is None
+        await settle()
+        assert lookups.calls == []
+
+        lookups.release.clear()
+        # Returning None lets the agent call the LLM as usual
+        assert prefetcher.before_llm_cb(None, chat_ctx("user", "Tell me about the tarot cards")) is None
+        resolving = asyncio.ensure_future(prefetcher.resolve("tarot cards"))
+        await asyncio.sleep(0.02)
+        lookups.release.set()
+        return await resolving
+
+    before = tool_prefetch.stats()
+    assert asyncio.run(scenario()) == "about tarot cards"
+    assert tool_prefetch.stats()["in_flight_hits"] == before["in_flight_hits"] + 1
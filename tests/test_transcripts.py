@@ -0,0 +1,77 @@
+import threading
+
+import transcripts
+
+
+def read_room(directory, room_name):
+    room_dir = directory / room_name
+    return "".join(path.read_text() for path in sorted(room_dir.iterdir()))
+
+
+def test_flush_writes_queued_lines(tmp_path):
+    sink = transcripts.TranscriptSink(str(tmp_path), flush_interval=10.0)
+    try:
+        for i in range(3):
+            assert sink.write("room-a", f"line {i}\n")
+        assert sink.flush(timeout=2)
+        assert read_room(tmp_path, "room-a") == "line 0\nline 1\nline 2\n"
+        assert sink.stats()["written"] == 3
+    finally:
+        sink.close()
+
+
+def test_close_room_then_flush_closes_the_file(tmp_path):
+    sink = transcripts.TranscriptSink(str(tmp_path), flush_interval=10.0)
+    try:
+        sink.write("room-a", "hello\n")
+        sink.close_room("room-a")
+        assert sink.flush(timeout=2)
+        assert sink.stats()["open_rooms"] == 0
+        assert read_room(tmp_path, "room-a") == "hello\n"
+    finally:
+        sink.close()
+
+
+def test_close_writes_everything_and_stops(tmp_path):
+    sink = transcripts.TranscriptSink(str(tmp_path), flush_interval=10.0)
+    for i in range(100):
+        sink.write(f"room-{i % 4}", f"{i}\n")
+    sink.close(timeout=2)
+    assert not sink._thread.is_alive()
+    assert sink.stats()["written"] == 100
+    assert sink.stats()["open_rooms"] == 0
+    assert not sink.write("room-0", "too late\n")
+
+
+def test_deferred_close_under_sustained_load(tmp_path, monkeypatch):
+    blocked = threading.Event()
+    release = threading.Event()
+    write = transcripts._RoomFile.write
+
+    def slow_write(self, data):
+        if not release.is_set():
+            blocked.set()
+            release.wait(5)
+        write(self, data)
+
+    monkeypatch.setattr(transcripts._RoomFile, "write", slow_write)
+    sink = transcripts.TranscriptSink(str(tmp_path), max_queue=2, flush_interval=0.05, flush_bytes=1)
+    try:
+        sink.write("busy", "first\n")
+        assert blocked.wait(2)
+        # The writer is stuck on the first line, so the queue fills up
+        sink.write("room-a", "a\n")
+        sink.write("busy", "b\n")
+        sink.close_room("room-a")
+        assert sink._deferred_close == {"room-a": 3}
+        release.set()
+        # Keep the queue busy so the writer never sees an idle interval
+        for i in range(20):
+            sink.write("busy", f"{i}\n")
+        assert sink.flush(timeout=2)
+        assert sink._deferred_close == {}
+        assert "room-a" not in sink._files
+        assert read_room(tmp_path, "room-a") == "a\n"
+    finally:
+        release.set()
+        sink.close()
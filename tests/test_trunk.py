@@ -0,0 +1,211 @@
+import asyncio
+import logging
+from types import SimpleNamespace
+
+import pytest
+from aiohttp import web
+from livekit import api
+from twilio.base.exceptions import TwilioRestException
+
+import trunk
+from mock_livekit import MockLiveKit
+
+PHONE = "+447000000001"
+SIP_URI = "sip:abc.sip.livekit.cloud"
+
+
+class StubOriginationUrls:
+    """client.trunking.v1.trunks(sid).origination_urls"""
+
+    def __init__(self, twilio, trunk_sid):
+        self.twilio = twilio
+        self.trunk_sid = trunk_sid
+
+    def _urls(self):
+        if self.trunk_sid not in self.twilio.trunks:
+            raise TwilioRestException(404, "uri", "The requested resource was not found")
+        return self.twilio.urls.setdefault(self.trunk_sid, [])
+
+    def list(self):
+        self.twilio.calls.append("list_urls")
+        return list(self._urls())
+
+    def create(self, sip_url, friendly_name, **_):
+        self.twilio.calls.append("create_url")
+        url = SimpleNamespace(sid=f"OU{len(self.twilio.calls)}", sip_url=sip_url, friendly_name=friendly_name)
+        self._urls().append(url)
+        return url
+
+    def __call__(self, url_sid):
+        def delete():
+            self.twilio.calls.append("delete_url")
+            self.twilio.urls[self.trunk_sid] = [u for u in self._urls() if u.sid != url_sid]
+            return True
+        return SimpleNamespace(delete=delete)
+
+
+class StubTwilio:
+    """The slice of twilio.rest.Client that TwilioTrunks uses, in memory"""
+
+    def __init__(self):
+        self.trunks = {}
+        self.urls = {}
+        self.calls = []
+        self.trunking = SimpleNamespace(v1=SimpleNamespace(trunks=self._trunk_list()))
+
+    def _trunk_list(self):
+        twilio = self
+
+        class TrunkList:
+            def __call__(self, sid):
+                def fetch():
+                    twilio.calls.append("fetch_trunk")
+                    if sid not in twilio.trunks:
+                        raise TwilioRestException(404, "uri", "The requested resource was not found")
+                    return twilio.trunks[sid]
+                return SimpleNamespace(fetch=fetch, origination_urls=StubOriginationUrls(twilio, sid))
+
+            def list(self, page_size=50):
+                twilio.calls.append("list_trunks")
+                return list(twilio.trunks.values())
+
+            def create(self, friendly_name, domain_name):
+                twilio.calls.append("create_trunk")
+                created = SimpleNamespace(sid=f"TK{len(twilio.trunks) + 1}", friendly_name=friendly_name)
+                twilio.trunks[created.sid] = created
+                return created
+
+        return TrunkList()
+
+
+@pytest.fixture
+def setup(tmp_path):
+    """(stub Twilio, mock LiveKit, state file path)"""
+    return StubTwilio(), MockLiveKit(rooms=0), str(tmp_path / "state.json")
+
+
+def reconcile(setup, sip_uri=SIP_URI, **kwargs):
+    """Run trunk.reconcile against the stubs; returns the descriptions of the changes planned"""
+    twilio, mock, state_file = setup
+
+    async def scenario():
+        runner = web.AppRunner(mock.app(), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        lkapi = api.LiveKitAPI(f"http://127.0.0.1:{runner.addresses[0][1]}", "devkey", "devsecret" * 4)
+        try:
+            desired = trunk.desired_state(PHONE, sip_uri)
+            changes = await trunk.reconcile(trunk.TwilioTrunks(twilio), lkapi, desired, state_file=state_file, **kwargs)
+            return [change.description for change in changes]
+        finally:
+            await lkapi.aclose()
+            await runner.cleanup()
+
+    return asyncio.run(scenario())
+
+
+def only(items):
+    assert len(items) == 1, items
+    return next(iter(items))
+
+
+def test_first_run_creates_everything(setup):
+    twilio, mock, _ = setup
+    changes = reconcile(setup)
+    assert [c.split(" ")[0] for c in changes] == ["create", "add", "create", "create"]
+    twilio_trunk = only(twilio.trunks.values())
+    assert [u.sip_url for u in twilio.urls[twilio_trunk.sid]] == [f"{SIP_URI};transport=tcp"]
+    inbound = only(mock.inbound_trunks.values())
+    assert list(inbound.numbers) == [PHONE]
+    rule = only(mock.dispatch_rules.values())
+    assert list(rule.trunk_ids) == [inbound.sip_trunk_id]
+    assert rule.room_config.agents[0].agent_name == "pi-receptionist"
+
+
+def test_second_run_is_one_round_of_lookups(setup):
+    twilio, mock, _ = setup
+    reconcile(setup)
+    mock.requests.clear()
+    twilio.calls.clear()
+    assert reconcile(setup) == []
+    assert dict(mock.requests) == {"ListSIPInboundTrunk": 1, "ListSIPDispatchRule": 1}
+    assert sorted(twilio.calls) == ["fetch_trunk", "list_urls"]
+
+
+def test_dry_run_changes_nothing(setup):
+    twilio, mock, state_file = setup
+    changes = reconcile(setup, dry_run=True)
+    assert len(changes) == 4
+    assert not twilio.trunks and not mock.inbound_trunks and not mock.dispatch_rules
+    assert trunk.load_state(state_file) == {}
+
+    reconcile(setup)
+    assert reconcile(setup, sip_uri="sip:new.sip.livekit.cloud", dry_run=True) == [
+        "add origination URL sip:new.sip.livekit.cloud;transport=tcp",
+        f"remove old origination URL {SIP_URI};transport=tcp",
+    ]
+    assert [u.sip_url for u in only(twilio.urls.values())] == [f"{SIP_URI};transport=tcp"]
+
+
+def test_deleted_inbound_trunk_is_recreated_and_rebound(setup):
+    _, mock, _ = setup
+    reconcile(setup)
+    old_id = only(mock.inbound_trunks)
+    mock.inbound_trunks.clear()
+    changes = reconcile(setup)
+    assert [c.split(" ")[:2] for c in changes] == [["create", "inbound"], ["update", "dispatch"]]
+    new_id = only(mock.inbound_trunks)
+    assert new_id != old_id
+    assert list(only(mock.dispatch_rules.values()).trunk_ids) == [new_id]
+
+
+def test_changed_sip_uri_replaces_the_origination_url(setup):
+    twilio, _, _ = setup
+    reconcile(setup)
+    twilio_trunk = only(twilio.trunks.values())
+    # A URL someone added by hand is left alone
+    twilio.trunking.v1.trunks(twilio_trunk.sid).origination_urls.create(
+        sip_url="sip:backup.example.com", friendly_name="Backup",
+    )
+    reconcile(setup, sip_uri="sip:new.sip.livekit.cloud")
+    assert [u.sip_url for u in twilio.urls[twilio_trunk.sid]] == [
+        "sip:backup.example.com", "sip:new.sip.livekit.cloud;transport=tcp",
+    ]
+    assert only(twilio.trunks) == twilio_trunk.sid
+    assert reconcile(setup, sip_uri="sip:new.sip.livekit.cloud") == []
+
+
+def test_prune_deletes_duplicates_only_when_asked(setup, caplog):
+    _, mock, _ = setup
+    reconcile(setup)
+    kept_trunk, kept_rule = only(mock.inbound_trunks), only(mock.dispatch_rules)
+    # Left behind by an earlier deploy
+    duplicate = api.SIPInboundTrunkInfo(sip_trunk_id="ST_dup", name="Old trunk", numbers=[PHONE])
+    duplicate.created_at.GetCurrentTime()
+    mock.inbound_trunks["ST_dup"] = duplicate
+    rule = api.SIPDispatchRuleInfo()
+    rule.CopyFrom(mock.dispatch_rules[kept_rule])
+    rule.sip_dispatch_rule_id = "SDR_dup"
+    mock.dispatch_rules["SDR_dup"] = rule
+
+    with caplog.at_level(logging.WARNING):
+        assert reconcile(setup, force=True) == []
+    assert "ST_dup" in caplog.text and "SDR_dup" in caplog.text
+    assert len(mock.inbound_trunks) == 2 and len(mock.dispatch_rules) == 2
+
+    assert sorted(reconcile(setup, prune=True)) == [
+        "delete duplicate dispatch rule SDR_dup", "delete duplicate inbound trunk ST_dup",
+    ]
+    assert list(mock.inbound_trunks) == [kept_trunk]
+    assert list(mock.dispatch_rules) == [kept_rule]
+
+
+def test_edited_dispatch_rule_is_caught_by_the_cached_lookup(setup):
+    _, mock, _ = setup
+    reconcile(setup)
+    rule = only(mock.dispatch_rules.values())
+    rule.rule.dispatch_rule_individual.room_prefix = "edited-"
+    assert reconcile(setup) == [f"update dispatch rule {rule.sip_dispatch_rule_id}"]
+    assert only(mock.dispatch_rules.values()).rule.dispatch_rule_individual.room_prefix == "call-"
+    assert reconcile(setup) == []
@@ -0,0 +1,87 @@
+import asyncio
+import os
+
+import numpy as np
+from livekit import rtc
+from livekit.agents import tts, utils
+
+import tts_cache
+import tts_chunking
+
+GREETING = "Hello, Pi and Other Tales. How can I help?"
+
+
+def clip(nbytes, value=1):
+    return np.full(nbytes // 2, value, dtype=np.int16).tobytes()
+
+
+def test_least_recently_used_clips_are_evicted_first(tmp_path):
+    cache = tts_cache.AudioCache(str(tmp_path), max_bytes=300)
+    cache.put("a", clip(100))
+    cache.put("b", clip(100))
+    cache.put("c", clip(100))
+    # A hit makes "a" the most recently used
+    assert cache.get("a") is not None
+    cache.put("d", clip(100))
+    assert "b" not in cache
+    assert all(key in cache for key in ("a", "c", "d"))
+    assert cache.stats()["bytes"] == 300
+
+
+def test_byte_cap_and_reopening_the_directory(tmp_path):
+    cache = tts_cache.AudioCache(str(tmp_path), max_bytes=250)
+    cache.put("a", clip(100))
+    cache.put("b", clip(100))
+    cache.put("c", clip(100))
+    assert cache.stats() == {"entries": 2, "bytes": 200, "hits": 0, "misses": 0}
+    assert sorted(os.listdir(tmp_path)) == ["b.pcm", "c.pcm"]
+    # A clip over the cap is never stored
+    cache.put("huge", clip(300))
+    assert "huge" not in cache
+
+    # Another process rebuilds recency order from the files
+    reopened = tts_cache.AudioCache(str(tmp_path), max_bytes=250)
+    assert reopened.stats()["bytes"] == 200
+    np.testing.assert_array_equal(reopened.get("c"), np.full(50, 1, dtype=np.int16))
+
+
+class StubTTS(tts.TTS):
+    def __init__(self):
+        super().__init__(capabilities=tts.TTSCapabilities(streaming=False), sample_rate=24000, num_channels=1)
+        self.synthesized = []
+
+    def synthesize(self, text, *, conn_options=None):
+        self.synthesized.append(text)
+        return _StubStream(tts=self, input_text=text, conn_options=conn_options)
+
+
+class _StubStream(tts.ChunkedStream):
+    async def _run(self):
+        self._event_ch.send_nowait(tts.SynthesizedAudio(
+            frame=rtc.AudioFrame(clip(960), sample_rate=24000, num_channels=1, samples_per_channel=480),
+            request_id=utils.shortuuid(),
+        ))
+
+
+def test_only_the_listed_phrases_are_cached(tmp_path):
+    async def scenario():
+        stub = StubTTS()
+        cache = tts_cache.AudioCache(str(tmp_path), max_bytes=1 << 20)
+        cached_tts = tts_cache.CachedTTS(
+            stub, [GREETING], sentence_tokenizer=tts_chunking.ClauseTokenizer(), cache=cache, voice="v", model="m",
+        )
+        await tts_cache.warm(cached_tts)
+        warmed = list(stub.synthesized)
+        assert warmed == list(cached_tts.phrases.values())
+        for chunk in warmed:
+            await cached_tts.synthesize(chunk).collect()
+        reply = "The book is out on June 19th, and you can pre-order it now."
+        await cached_tts.synthesize(reply).collect()
+        await cached_tts.synthesize(reply).collect()
+        return stub.synthesized, warmed, cache.stats()
+
+    synthesized, warmed, stats = asyncio.run(scenario())
+    # The greeting came from the cache; the reply was synthesized both times and never stored
+    assert synthesized == warmed + [synthesized[-1]] * 2
+    assert stats["entries"] == len(warmed)
+    assert len(os.listdir(tmp_path)) == len(warmed)
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+import tts_chunking
+
+
+@pytest.mark.parametrize("text, chunks", [
+    ("Mr. Smith will call you back tomorrow. Thanks for waiting.",
+     ["Mr. Smith will call you back tomorrow.", "Thanks for waiting."]),
+    ("Visit othertales.co for the full catalogue. It is updated weekly.",
+     ["Visit othertales.co for the full catalogue.", "It is updated weekly."]),
+    ("The ratio is 3.5 to one in our favour. That is good news.",
+     ["The ratio is 3.5 to one in our favour.", "That is good news."]),
+    ("Well... let me think about that. I can check for you.",
+     ["Well... let me think about that.", "I can check for you."]),
+    ("Hmm, I am not sure… Let me check the catalogue for you.",
+     ["Hmm, I am not sure…", "Let me check the catalogue for you."]),
+    ("We open at 9:30 on weekdays. Weekends are closed.",
+     ["We open at 9:30 on weekdays.", "Weekends are closed."]),
+])
+def test_tokenize(text, chunks):
+    assert tts_chunking.ClauseTokenizer(min_chars=10).tokenize(text) == chunks
+
+
+@pytest.mark.parametrize("text, end", [
+    # Whether these end a sentence depends on the text still to come
+    ("Please ask Mr.", None),
+    ("Please ask Mr. ", None),
+    ("See othertales.", None),
+    ("The price is 3.", None),
+    ("I am not sure...", None),
+    ("Please ask Mr. Smith. He", len("Please ask Mr. Smith.")),
+    ("See othertales.co for details. It", len("See othertales.co for details.")),
+    ("The price is 3.5 pounds. Is", len("The price is 3.5 pounds.")),
+    ("I am not sure... Let", len("I am not sure...")),
+    ("I am not sure... let me check. It", len("I am not sure... let me check.")),
+])
+def test_find_chunk_end(text, end):
+    assert tts_chunking.find_chunk_end(text, 10, 30, 300, final=False) == end
+
+
+def test_text_streamed_mid_token_is_not_split():
+    parts = ["Please ask Mr", ". Smith at othertales", ".co about it", ". The price is 3", ".5 pounds today", "."]
+
+    async def scenario():
+        stream = tts_chunking.ClauseTokenizer(min_chars=10).stream()
+        emitted = []
+        for part in parts:
+            stream.push_text(part)
+            await asyncio.sleep(0)
+            while not stream._event_ch.empty():
+                emitted.append((part, stream._event_ch.recv_nowait().token))
+        stream.end_input()
+        async for ev in stream:
+            emitted.append((None, ev.token))
+        return emitted
+
+    assert asyncio.run(scenario()) == [
+        # Emitted as soon as the next sentence starts
+        (". The price is 3", "Please ask Mr. Smith at othertales.co about it."),
+        (None, "The price is 3.5 pounds today."),
+    ]
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import signal
+import time
+
+import numpy as np
+import pytest
+from livekit.plugins import silero
+
+import ring_vad
+import vad_service
+
+
+@pytest.fixture(scope="module")
+def silero_vad():
+    return silero.VAD.load()
+
+
+@pytest.fixture
+def service(silero_vad):
+    service = vad_service.VADService(1, silero_vad._opts.sample_rate)
+    yield service
+    service.close()
+
+
+def infer(silero_vad, service, windows):
+    """Speech probabilities of windows, inferred by the service and by the model in process"""
+    sample_rate = silero_vad._opts.sample_rate
+
+    async def run():
+        probabilities = np.zeros(len(windows), dtype=np.float32)
+        await service.model(silero_vad._onnx_session, sample_rate).infer(windows, len(windows), probabilities)
+        return probabilities
+
+    expected = np.zeros(len(windows), dtype=np.float32)
+    ring_vad._Model(silero_vad._onnx_session, sample_rate).run(windows, len(windows), expected)
+    return asyncio.run(run()), expected
+
+
+def wait_until_loaded(silero_vad, service):
+    deadline = time.monotonic() + vad_service.WORKER_START_TIMEOUT_S
+    windows = np.zeros((1, 512), dtype=np.float32)
+    while not service.workers[0].loaded:
+        assert time.monotonic() < deadline
+        infer(silero_vad, service, windows)
+        time.sleep(0.05)
+
+
+def test_windows_run_in_process_while_the_worker_starts(silero_vad, service):
+    windows = np.random.default_rng(0).uniform(-0.5, 0.5, (4, 512)).astype(np.float32)
+    fallbacks = vad_service.stats()["fallbacks"]
+    started = time.monotonic()
+    probabilities, expected = infer(silero_vad, service, windows)
+    # Loading the model takes far longer than this
+    assert time.monotonic() - started < 1.0
+    assert vad_service.stats()["fallbacks"] == fallbacks + 4
+    np.testing.assert_allclose(probabilities, expected, rtol=1e-4)
+
+
+def test_stuck_worker_is_given_up_on_within_the_batch_deadline(silero_vad, service):
+    wait_until_loaded(silero_vad, service)
+    windows = np.random.default_rng(1).uniform(-0.5, 0.5, (3, 512)).astype(np.float32)
+    probabilities, expected = infer(silero_vad, service, windows)
+    np.testing.assert_allclose(probabilities, expected, rtol=1e-4)
+
+    worker = service.workers[0]
+    restarts = vad_service.stats()["worker_restarts"]
+    os.kill(worker.process.pid, signal.SIGSTOP)
+    started = time.monotonic()
+    probabilities, expected = infer(silero_vad, service, windows)
+    # The first window waits out one batch deadline, the rest run while the new worker starts
+    assert time.monotonic() - started < worker.timeout(1) + 0.5
+    assert vad_service.stats()["worker_restarts"] == restarts + 1
+    np.testing.assert_allclose(probabilities, expected, rtol=1e-4)
+
+
+@pytest.mark.parametrize("workers, executor, max_calls, expected", [
+    (None, "thread", "10", 0),
+    ("2", "thread", "10", 2),
+    ("auto", "thread", "1", 0),
+    ("auto", "thread", "10", min(2, os.cpu_count() or 1)),
+    # Every call has its own process
+    ("2", None, "10", 0),
+    ("auto", "process", "10", 0),
+])
+def test_the_pool_is_opt_in(monkeypatch, workers, executor, max_calls, expected):
+    for name, value in (
+        ("VAD_SERVICE_WORKERS", workers), ("AGENT_JOB_EXECUTOR", executor), ("AGENT_MAX_CONCURRENT_CALLS", max_calls),
+    ):
+        if value is None:
+            monkeypatch.delenv(name, raising=False)
+        else:
+            monkeypatch.setenv(name, value)
+    assert vad_service.configured_workers() == expected